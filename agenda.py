@@ -0,0 +1,137 @@
+# agenda.py
+
+import bisect
+import datetime
+import os
+from array import array
+from dataclasses import dataclass, field
+
+# Horario por defecto: lunes a sábado 07:00-17:00, domingo 09:00-13:00
+HORAS_DEFECTO = ((420, 1020),) * 6 + ((540, 780),)
+
+
+def _minutos(hhmm):
+    h, m = hhmm.split(":")
+    return int(h) * 60 + int(m)
+
+
+def _parsear_horas(texto):
+    """
+    "0-5=07:00-17:00;6=09:00-13:00" -> tupla de 7 (inicio, fin) en minutos o None.
+    """
+    horas = [None] * 7
+    for parte in filter(None, (p.strip() for p in texto.split(";"))):
+        dias, rango = parte.split("=")
+        a, _, b = dias.partition("-")
+        inicio, fin = rango.split("-")
+        for d in range(int(a), int(b or a) + 1):
+            horas[d] = (_minutos(inicio), _minutos(fin))
+    return tuple(horas)
+
+
+@dataclass(frozen=True)
+class Horario:
+    """
+    Configuración de la agenda: horas por día de semana (0=lun), duración del
+    slot y del descanso, feriados y días de horizonte.
+    """
+
+    horas: tuple = HORAS_DEFECTO
+    slot_minutos: int = 50
+    descanso_minutos: int = 30
+    horizonte_dias: int = 7
+    feriados: frozenset = field(default_factory=frozenset)
+
+    @classmethod
+    def desde_env(cls):
+        feriados = os.getenv("AGENDA_FERIADOS", "")
+        return cls(
+            horas=_parsear_horas(os.environ["AGENDA_HORAS"]) if os.getenv("AGENDA_HORAS") else HORAS_DEFECTO,
+            slot_minutos=int(os.getenv("AGENDA_SLOT_MINUTOS", "50")),
+            descanso_minutos=int(os.getenv("AGENDA_DESCANSO_MINUTOS", "30")),
+            horizonte_dias=int(os.getenv("AGENDA_HORIZONTE_DIAS", "7")),
+            feriados=frozenset(datetime.date.fromisoformat(f.strip()) for f in feriados.split(",") if f.strip()),
+        )
+
+    def plantilla(self):
+        """
+        Compila la plantilla semanal: por día, los minutos de inicio de cada slot.
+        """
+        paso = self.slot_minutos + self.descanso_minutos
+        por_dia = []
+        for horas in self.horas:
+            inicios = array("H")
+            if horas is not None:
+                inicio, fin = horas
+                while inicio + self.slot_minutos <= fin:
+                    inicios.append(inicio)
+                    inicio += paso
+            por_dia.append(inicios)
+        return tuple(por_dia)
+
+
+class Disponibilidad:
+    """
+    Slots del horizonte materializados en arrays, con ocupación incremental.
+
+    `inicios` guarda el epoch de cada slot en orden; `ocupacion` cuántos
+    intervalos ocupados lo pisan; `bloqueado` es 1 si ocupacion > 0, lo que
+    permite buscar el siguiente libre con bytearray.find (en C). `tz` (p.ej.
+    una zoneinfo.ZoneInfo) fija la zona de la agenda; por defecto, la local.
+    """
+
+    def __init__(self, horario, desde, tz=None):
+        self.horario = horario
+        self.desde = desde
+        self.duracion = horario.slot_minutos * 60
+        plantilla = horario.plantilla()
+        self.inicios = array("d")
+        for d in range(horario.horizonte_dias + 1):
+            dia = desde + datetime.timedelta(days=d)
+            if dia in horario.feriados:
+                continue
+            # Hora de pared de cada día: sin tz es la hora local del proceso, así
+            # el desfase de horario de verano se resuelve día a día
+            for minuto in plantilla[dia.weekday()]:
+                hora = datetime.time(minuto // 60, minuto % 60)
+                self.inicios.append(datetime.datetime.combine(dia, hora, tzinfo=tz).timestamp())
+        self.ocupacion = array("H", bytes(2 * len(self.inicios)))
+        self.bloqueado = bytearray(len(self.inicios))
+
+    def _rango(self, inicio, fin):
+        # Slots i con inicios[i] < fin y inicios[i] + duracion > inicio
+        return (bisect.bisect_right(self.inicios, inicio - self.duracion),
+                bisect.bisect_left(self.inicios, fin))
+
+    def agregar(self, inicio, fin):
+        a, b = self._rango(inicio.timestamp(), fin.timestamp())
+        for i in range(a, b):
+            self.ocupacion[i] += 1
+            self.bloqueado[i] = 1
+
+    def quitar(self, inicio, fin):
+        a, b = self._rango(inicio.timestamp(), fin.timestamp())
+        for i in range(a, b):
+            if self.ocupacion[i]:
+                self.ocupacion[i] -= 1
+                if not self.ocupacion[i]:
+                    self.bloqueado[i] = 0
+
+    def es_slot(self, inicio):
+        ts = inicio.timestamp()
+        i = bisect.bisect_left(self.inicios, ts)
+        return i < len(self.inicios) and self.inicios[i] == ts
+
+    def siguientes(self, n, desde):
+        """
+        Los próximos `n` slots libres a partir de `desde` (datetimes locales).
+        """
+        libres = []
+        i = bisect.bisect_left(self.inicios, desde.timestamp())
+        while len(libres) < n:
+            i = self.bloqueado.find(0, i)
+            if i < 0:
+                break
+            libres.append(datetime.datetime.fromtimestamp(self.inicios[i]).astimezone())
+            i += 1
+        return libres
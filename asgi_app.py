@@ -0,0 +1,292 @@
+# asgi_app.py
+#
+# Modo de servidor asíncrono (SERVER_MODE=async). Mismas rutas y reglas que la
+# app Flask de main.py, pero cada petición es una corrutina: la espera a OpenAI
+# no ocupa un hilo. Los envíos de WhatsApp ya salen por la cola de main.outbound.
+
+import asyncio
+import json
+import logging
+import os
+import time
+from urllib.parse import parse_qsl
+
+import httpx
+
+import main
+import metrics
+from conversacion import PrimerFragmento
+from dispatcher import AsyncKeyedLocks, AsyncLimites, limites_desde_env
+from llm_cache import get_llm_cache
+from resiliencia import get_breaker
+
+OPENAI_URL     = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1") + "/chat/completions"
+# Las llamadas bloqueantes (SQLite, Google Calendar) van a hilos, con un tope
+MAX_BLOQUEANTES = int(os.getenv("ASGI_MAX_BLOQUEANTES", "16"))
+
+_http = None
+_bloqueantes = None
+_limites = None
+_por_telefono = None
+
+
+async def _en_hilo(fn, *args):
+    async with _bloqueantes:
+        return await asyncio.to_thread(fn, *args)
+
+
+async def llamar_openai_async(mensajes, fragmento=None) -> str:
+    async with _limites("openai"):
+        with get_breaker("openai"):
+            return await _post_openai(mensajes, fragmento)
+
+
+async def _post_openai(mensajes, fragmento=None) -> str:
+    headers = {"Authorization": f"Bearer {main.OPENAI_API_KEY}"}
+    payload = {
+        "model": main.OPENAI_MODEL,
+        "messages": mensajes,
+        "max_tokens": main.IA_MAX_TOKENS,
+        "temperature": 0.7,
+    }
+    with metrics.medir("openai"):
+        if fragmento is None:
+            resp = await _http.post(OPENAI_URL, headers=headers, json=payload)
+            resp.raise_for_status()
+            return resp.json()["choices"][0]["message"]["content"].strip()
+        # Server-sent events: "data: {json}" por fragmento y "data: [DONE]" al final
+        t0 = time.perf_counter()
+        async with _http.stream("POST", OPENAI_URL, headers=headers, json=dict(payload, stream=True)) as resp:
+            resp.raise_for_status()
+            async for linea in resp.aiter_lines():
+                if not linea.startswith("data: ") or linea == "data: [DONE]":
+                    continue
+                delta = json.loads(linea[6:])["choices"][0]["delta"].get("content")
+                if delta:
+                    if t0 is not None:
+                        metrics.observar("ia_primer_fragmento_segundos", time.perf_counter() - t0)
+                        t0 = None
+                    fragmento.agregar(delta)
+    return fragmento.texto().strip()
+
+
+async def completar_ia_async(frm: str, text: str) -> str:
+    """
+    Igual que main.completar_ia: contexto de la conversación, streaming y
+    caché solo en el primer turno. Devuelve lo que falta enviar.
+    """
+    clave = main.normalize_phone(frm)
+    mensajes = main.memoria.mensajes(clave, text)
+    fragmento = PrimerFragmento(lambda parte: main.enviar_whatsapp(frm, parte)) if main.IA_STREAM else None
+    try:
+        if len(mensajes) == 2:
+            respuesta = await get_llm_cache().aget_or_compute(
+                main.PROMPT_EMILIA, text, lambda: llamar_openai_async(mensajes, fragmento),
+            )
+        else:
+            respuesta = await llamar_openai_async(mensajes, fragmento)
+    except Exception as e:
+        return main.respuesta_degradada(text, fragmento, e)
+    main.memoria.registrar(clave, text, respuesta)
+    return fragmento.resto(respuesta) if fragmento is not None else respuesta
+
+
+# ─── HTTP MÍNIMO ───────────────────────────────────────────────────────────────
+class Peticion:
+    def __init__(self, scope, cuerpo):
+        self.method = scope["method"]
+        self.path = scope["path"].rstrip("/") or "/"
+        self.args = dict(parse_qsl(scope.get("query_string", b"").decode()))
+        self.headers = {k.decode().lower(): v.decode() for k, v in scope["headers"]}
+        self.data = cuerpo
+
+    def form(self):
+        return dict(parse_qsl(self.data.decode()))
+
+    def json(self):
+        try:
+            return json.loads(self.data or b"null")
+        except ValueError:
+            return None
+
+
+async def _leer_cuerpo(receive):
+    partes = []
+    while True:
+        mensaje = await receive()
+        partes.append(mensaje.get("body", b""))
+        if not mensaje.get("more_body"):
+            return b"".join(partes)
+
+
+async def _responder(send, status, cuerpo=b"", content_type="text/plain"):
+    if isinstance(cuerpo, (dict, list)):
+        cuerpo, content_type = json.dumps(cuerpo).encode(), "application/json"
+    elif isinstance(cuerpo, str):
+        cuerpo = cuerpo.encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode()),
+                    (b"content-length", str(len(cuerpo)).encode())],
+    })
+    await send({"type": "http.response.body", "body": cuerpo})
+
+
+# ─── RUTAS ─────────────────────────────────────────────────────────────────────
+async def index(req):
+    return {"message": "Webhook is alive."}, 200
+
+
+async def incoming_whatsapp(req):
+    if req.method == "GET":
+        return main.verificar_suscripcion(req.args)
+    form = req.form()
+    frm = form.get("From", "")
+    body = form.get("Body", "").strip()
+    clave = main.clave_mensaje(form)
+    if clave:
+        nuevo, previa = await _en_hilo(main.idempotencia.begin, clave)
+        if not nuevo:
+            return tuple(previa) if previa else ("", 200)
+    try:
+        # Mensajes del mismo teléfono en orden; distintos usuarios en paralelo
+        async with _por_telefono(main.normalize_phone(frm)):
+            respuesta, consulta = await _en_hilo(main.resolver_mensaje, frm, body)
+            if respuesta is None:
+                respuesta = await completar_ia_async(frm, consulta)
+            if respuesta:
+                main.enviar_whatsapp(frm, respuesta)
+    except Exception:
+        if clave:
+            await _en_hilo(main.idempotencia.fail, clave)
+        raise
+    if clave:
+        await _en_hilo(main.idempotencia.complete, clave, ["", 200])
+    return "", 200
+
+
+async def webhook_woocommerce(req):
+    if req.method in ("GET", "HEAD"):
+        return main.verificar_suscripcion(req.args)
+    data = req.json()
+    if not data:
+        return {"status": "no data"}, 200
+    if not main.validar_wc_signature(req.data, req.headers.get("x-wc-webhook-signature", "")):
+        return "Forbidden", 403
+    headers = {"X-WC-Webhook-Delivery-ID": req.headers.get("x-wc-webhook-delivery-id")}
+    clave = main.clave_pedido(headers, data)
+    return await _en_hilo(main.procesar_idempotente, clave, main.procesar_pedido, data)
+
+
+async def nuevo_contenido(req):
+    if not main.wp_secret_valido(req.headers.get("x-wp-webhook-secret", "")):
+        return "Forbidden", 403
+    data = req.json()
+    if data is None:
+        return "Bad Request", 400
+    return main.crear_difusion(data)
+
+
+async def estado_difusion(req, job_id):
+    job = main.difusiones.get(job_id)
+    if job is None:
+        return "Not Found", 404
+    return job.estado(), 200
+
+
+async def reintentar_difusion(req, job_id):
+    if not main.wp_secret_valido(req.headers.get("x-wp-webhook-secret", "")):
+        return "Forbidden", 403
+    reintentados = main.difusiones.reintentar(job_id)
+    if reintentados is None:
+        return "Not Found", 404
+    return {"status": "reintentando", "count": reintentados}, 202
+
+
+async def metricas(req):
+    if not main.metricas_autorizadas(req.headers.get("authorization", "")):
+        return "Forbidden", 403
+    return metrics.exportar(), 200, metrics.CONTENT_TYPE
+
+
+RUTAS = {
+    "/":                (index,               ("GET", "HEAD")),
+    "/metrics":         (metricas,            ("GET",)),
+    "/incoming":        (incoming_whatsapp,   ("GET", "POST")),
+    "/webhook":         (webhook_woocommerce, ("GET", "POST", "HEAD")),
+    "/nuevo_contenido": (nuevo_contenido,     ("POST",)),
+}
+
+
+async def _despachar(req):
+    ruta = RUTAS.get(req.path)
+    if ruta is not None:
+        handler, metodos = ruta
+        if req.method not in metodos:
+            return "Method Not Allowed", 405
+        return await handler(req)
+    partes = req.path.strip("/").split("/")
+    if partes[0] == "nuevo_contenido" and len(partes) == 2:
+        handler, metodos = estado_difusion, ("GET", "HEAD")
+    elif partes[0] == "nuevo_contenido" and len(partes) == 3 and partes[2] == "reintentar":
+        handler, metodos = reintentar_difusion, ("POST",)
+    else:
+        return "Not Found", 404
+    if req.method not in metodos:
+        return "Method Not Allowed", 405
+    return await handler(req, partes[1])
+
+
+def _ruta(path):
+    """
+    Plantilla de la ruta (como url_rule en Flask) para etiquetar métricas.
+    """
+    if path in RUTAS:
+        return path
+    partes = path.strip("/").split("/")
+    if partes[0] == "nuevo_contenido" and len(partes) == 2:
+        return "/nuevo_contenido/<job_id>"
+    if partes[0] == "nuevo_contenido" and len(partes) == 3 and partes[2] == "reintentar":
+        return "/nuevo_contenido/<job_id>/reintentar"
+    return "desconocida"
+
+
+async def _lifespan(receive, send):
+    global _http, _bloqueantes, _limites, _por_telefono
+    while True:
+        mensaje = await receive()
+        if mensaje["type"] == "lifespan.startup":
+            _http = httpx.AsyncClient(
+                timeout=main.OPENAI_TIMEOUT,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            )
+            _bloqueantes = asyncio.Semaphore(MAX_BLOQUEANTES)
+            _limites = AsyncLimites(limites_desde_env())
+            _por_telefono = AsyncKeyedLocks()
+            await send({"type": "lifespan.startup.complete"})
+        elif mensaje["type"] == "lifespan.shutdown":
+            await _http.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+    t0 = time.perf_counter()
+    req = Peticion(scope, await _leer_cuerpo(receive))
+    content_type = "text/plain"
+    try:
+        cuerpo, status, *extra = await _despachar(req)
+        if extra:
+            content_type = extra[0]
+    except Exception:
+        logging.exception(f"Error en {req.method} {req.path}")
+        cuerpo, status = "Internal Server Error", 500
+    if req.method == "HEAD":
+        cuerpo = b""
+    await _responder(send, status, cuerpo, content_type)
+    metrics.peticion(_ruta(req.path), req.method, status, time.perf_counter() - t0)
@@ -0,0 +1,29 @@
+# benchmarks/app_simulada.py
+#
+# Arranca main.py (SERVER_MODE sync o async) con Twilio y Google Calendar
+# sustituidos por los dobles de fakes.py. OpenAI se apunta al servidor falso
+# con OPENAI_API_BASE. Lo lanza bench_carga.py; a mano:
+#
+#   FAKE_TWILIO=80:0.01 FAKE_CALENDAR=150:0 OPENAI_API_BASE=http://127.0.0.1:9000/v1 \
+#       python benchmarks/app_simulada.py
+
+import os
+import sys
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(AQUI), AQUI]
+
+import calendar_client  # noqa: E402
+import fakes  # noqa: E402
+
+calendar_client._manager = fakes.CalendarManagerFalso(
+    fakes.Perfil.desde_texto(os.getenv("FAKE_CALENDAR", "150:0")),
+    ocupacion=float(os.getenv("FAKE_CALENDAR_OCUPACION", "0.3")),
+)
+
+import main  # noqa: E402
+
+main.outbound.transport = fakes.TwilioFalso(fakes.Perfil.desde_texto(os.getenv("FAKE_TWILIO", "80:0")))
+
+if __name__ == "__main__":
+    main.servir()
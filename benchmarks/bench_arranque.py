@@ -0,0 +1,118 @@
+# benchmarks/bench_arranque.py
+#
+# Arranque en frío: tiempo desde lanzar `python main.py` hasta el primer 200
+# en "/", con y sin precalentado, más las fases que reporta la app en
+# /metrics (arranque_segundos) y los imports más caros (-X importtime).
+#
+#   python benchmarks/bench_arranque.py --runs 5 --modes sync,async
+
+import argparse
+import http.client
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_FASE = re.compile(r'^arranque_segundos\{fase="(\w+)"\} (\S+)$', re.M)
+_IMPORT = re.compile(r"^import time:\s+\d+ \|\s+(\d+) \|(\s*)(\S+)$")
+
+
+def primer_200(port, timeout=60):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/")
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            time.sleep(0.01)
+    return False
+
+
+def fases(port, espera=10):
+    """
+    Lee arranque_segundos de /metrics cuando el precalentado terminó (fase "listo").
+    """
+    limite = time.monotonic() + espera
+    while True:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        conn.request("GET", "/metrics")
+        datos = {k: float(v) for k, v in _FASE.findall(conn.getresponse().read().decode())}
+        if "listo" in datos or time.monotonic() > limite:
+            return datos
+        time.sleep(0.1)
+
+
+def medir(modo, precalentar, args, tmp):
+    env = dict(
+        os.environ, SERVER_MODE=modo, PORT=str(args.port), PRECALENTAR="1" if precalentar else "0",
+        STATE_BACKEND="memory", SCHEDULER_DB=os.path.join(tmp, "jobs.db"), METRICS_TOKEN="",
+        TWILIO_ACCOUNT_SID="ACfalso", TWILIO_AUTH_TOKEN="falso",
+    )
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, os.path.join(RAIZ, "main.py")], cwd=tmp, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not primer_200(args.port):
+            raise RuntimeError(f"main.py no respondió en el puerto {args.port}")
+        hasta_200 = time.perf_counter() - t0
+        return hasta_200, fases(args.port) if precalentar else {}
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+
+def imports_mas_caros(n):
+    """
+    Los `n` imports de primer nivel con más tiempo acumulado al importar main.
+    """
+    salida = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=RAIZ,
+                            env=dict(os.environ, STATE_BACKEND="memory", SCHEDULER_DB=":memory:"),
+                            capture_output=True, text=True).stderr
+    niveles = []
+    for linea in salida.splitlines():
+        m = _IMPORT.match(linea)
+        if m and len(m.group(2)) <= 1:
+            niveles.append((int(m.group(1)), m.group(3)))
+    return sorted(niveles, reverse=True)[:n]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempo de arranque en frío de main.py")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=5057)
+    parser.add_argument("--modes", default="sync")
+    parser.add_argument("--top", type=int, default=10, help="imports más caros a listar (0 = ninguno)")
+    args = parser.parse_args()
+    tmp = tempfile.mkdtemp(prefix="bench-arranque-")
+
+    print(f"{'modo':<6} {'precalentar':<12} {'primer 200 (mediana) ms':>24} {'mín ms':>8}")
+    ultimas_fases = {}
+    for modo in args.modes.split(","):
+        for precalentar in (False, True):
+            tiempos = []
+            for _ in range(args.runs):
+                t, f = medir(modo, precalentar, args, tmp)
+                tiempos.append(t)
+                ultimas_fases = f or ultimas_fases
+            print(f"{modo:<6} {str(precalentar):<12} {statistics.median(tiempos) * 1000:>24.1f} "
+                  f"{min(tiempos) * 1000:>8.1f}")
+
+    if ultimas_fases:
+        print("\nfases (último arranque con precalentado, ms desde el inicio de main o duración del paso):")
+        for fase, segundos in sorted(ultimas_fases.items(), key=lambda x: x[1]):
+            print(f"  {fase:<28} {segundos * 1000:>8.1f}")
+    if args.top:
+        print("\nimports de primer nivel más caros al importar main (µs acumulados):")
+        for us, modulo in imports_mas_caros(args.top):
+            print(f"  {modulo:<28} {us:>10}")
+
+
+if __name__ == "__main__":
+    main()
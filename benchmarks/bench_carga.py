@@ -0,0 +1,295 @@
+# benchmarks/bench_carga.py
+#
+# Prueba de carga sin APIs de pago: levanta la app (app_simulada.py) contra
+# dobles locales de Twilio, OpenAI y Google Calendar, reproduce trazas de
+# conversación a un ritmo fijo y reporta throughput, p50/p99 por ruta,
+# memoria del servidor y latencia de cada dependencia (leída de /metrics).
+#
+#   python benchmarks/bench_carga.py --rps 50 --duracion 30 --mode sync
+#   python benchmarks/bench_carga.py --openai 1500:0.05 --calendar 300:0.2
+#   python benchmarks/bench_carga.py --guardar-traza base.jsonl   # y luego --traza base.jsonl
+#
+# La carga es de lazo abierto: cada evento tiene su instante programado y la
+# latencia se mide desde ese instante, así las colas del cliente también cuentan.
+
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+RAIZ = os.path.dirname(AQUI)
+sys.path[:0] = [RAIZ, AQUI]
+
+from bench_server_modes import esperar_servidor, percentil  # noqa: E402
+from fakes import OpenAIFalso, Perfil  # noqa: E402
+
+PREGUNTAS_IA = [
+    "¿qué es la sanación cuántica?", "¿funciona para la diabetes?", "¿cuánto dura una sesión?",
+    "tengo migraña desde hace años", "¿atienden en línea?", "me duele la espalda",
+]
+
+
+# ─── TRAZAS ────────────────────────────────────────────────────────────────────
+def _mensaje(numero, texto):
+    return {"ruta": "/incoming", "form": {"From": f"whatsapp:+52{numero}", "Body": texto}}
+
+
+def _pedido(numero, pedido_id, producto):
+    return {"ruta": "/webhook", "json": {
+        "id": pedido_id,
+        "billing": {"phone": numero, "first_name": "Cliente"},
+        "line_items": [{"name": producto}],
+    }}
+
+
+def conversacion(i, rng):
+    """
+    Secuencia de eventos de un usuario, elegida entre los flujos habituales.
+    """
+    numero = f"155{i:07d}"
+    flujo = rng.choices(["informes", "terapia", "ebook", "curso", "ia"], weights=[30, 20, 10, 15, 25])[0]
+    if flujo == "informes":
+        return [_mensaje(numero, "quiero informes"), _mensaje(numero, rng.choice(PREGUNTAS_IA)),
+                _mensaje(numero, "sí")]
+    if flujo == "terapia":
+        return [_pedido(numero, 100000 + i, "Terapia online"), _mensaje(numero, str(rng.randint(1, 3))),
+                _mensaje(numero, rng.choice(["migraña", "ansiedad", "dolor de espalda"]))]
+    if flujo == "ebook":
+        return [_pedido(numero, 100000 + i, "E-book El Método"), _mensaje(numero, "método")]
+    if flujo == "curso":
+        return [_mensaje(numero, "curso"), _mensaje(numero, "me gustaría")]
+    return [_mensaje(numero, rng.choice(PREGUNTAS_IA)) for _ in range(rng.randint(1, 3))]
+
+
+def generar_traza(total, activas, prob_reintento, prob_difusion, seed):
+    """
+    Intercala conversaciones (hasta `activas` a la vez) conservando el orden de
+    cada una. Con `prob_reintento` repite una entrega como haría Twilio.
+    """
+    rng = random.Random(seed)
+    sids = itertools.count(1)
+    abiertas, nuevas = [], itertools.count()
+    traza = []
+    while len(traza) < total:
+        while len(abiertas) < activas:
+            abiertas.append(conversacion(next(nuevas), rng))
+        if rng.random() < prob_difusion:
+            traza.append({"ruta": "/nuevo_contenido",
+                          "json": {"title": "Nuevo video", "permalink": f"https://example.com/p/{len(traza)}"}})
+            continue
+        actual = rng.randrange(len(abiertas))
+        evento = abiertas[actual].pop(0)
+        if not abiertas[actual]:
+            abiertas.pop(actual)
+        if "form" in evento:
+            evento["form"]["MessageSid"] = f"SMtraza{next(sids):010d}"
+        traza.append(evento)
+        if "form" in evento and rng.random() < prob_reintento:
+            traza.append(json.loads(json.dumps(evento)))
+    return traza[:total]
+
+
+# ─── CARGA ─────────────────────────────────────────────────────────────────────
+class Cliente:
+    """
+    Conexión keep-alive por hilo hacia el servidor bajo prueba.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self._local = threading.local()
+
+    def _conn(self, nueva=False):
+        if nueva or getattr(self._local, "conn", None) is None:
+            self._local.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        return self._local.conn
+
+    def enviar(self, evento):
+        if "form" in evento:
+            cuerpo, tipo = urlencode(evento["form"]), "application/x-www-form-urlencoded"
+        else:
+            cuerpo, tipo = json.dumps(evento["json"]), "application/json"
+        try:
+            conn = self._conn()
+            conn.request("POST", evento["ruta"], body=cuerpo, headers={"Content-Type": tipo})
+            resp = conn.getresponse()
+            resp.read()
+            return resp.status
+        except OSError:
+            self._conn(nueva=True)
+            return 0
+
+    def get(self, ruta):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=10)
+        conn.request("GET", ruta)
+        return conn.getresponse().read().decode()
+
+
+def reproducir(cliente, traza, rps, concurrencia):
+    latencias = {}
+    errores = {}
+    lock = threading.Lock()
+
+    def uno(evento, programado):
+        status = cliente.enviar(evento)
+        latencia = time.perf_counter() - programado
+        with lock:
+            latencias.setdefault(evento["ruta"], []).append(latencia)
+            if status == 0 or status >= 400:
+                errores[evento["ruta"]] = errores.get(evento["ruta"], 0) + 1
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrencia) as pool:
+        for k, evento in enumerate(traza):
+            programado = t0 + k / rps
+            espera = programado - time.perf_counter()
+            if espera > 0:
+                time.sleep(espera)
+            pool.submit(uno, evento, programado)
+    return latencias, errores, time.perf_counter() - t0
+
+
+# ─── SERVIDOR ──────────────────────────────────────────────────────────────────
+def memoria(pid):
+    """
+    RSS actual y pico (MB) del proceso, leídos de /proc (Linux).
+    """
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            campos = dict(linea.split(":", 1) for linea in f)
+    except OSError:
+        return None, None
+    return (int(campos["VmRSS"].split()[0]) / 1024, int(campos["VmHWM"].split()[0]) / 1024)
+
+
+_SERIE = re.compile(r'^(\w+)\{([^}]*)\} (\S+)$')
+
+
+def leer_metricas(texto):
+    """
+    {(nombre, etiquetas): valor} de la exposición Prometheus (sin buckets).
+    """
+    series = {}
+    for linea in texto.splitlines():
+        m = _SERIE.match(linea)
+        if m and not m.group(1).endswith("_bucket"):
+            series[(m.group(1), m.group(2))] = float(m.group(3))
+        elif linea and not linea.startswith("#"):
+            nombre, _, valor = linea.partition(" ")
+            series[(nombre, "")] = float(valor)
+    return series
+
+
+def esperar_drenado(cliente, timeout):
+    """
+    Espera a que las colas internas (entrantes, salida, reservas) se vacíen.
+    """
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < timeout:
+        series = leer_metricas(cliente.get("/metrics"))
+        if not any(series.get((n, ""), 0) for n in ("entrantes_pendientes", "outbound_cola",
+                                                     "reservas_pendientes")):
+            return time.perf_counter() - t0
+        time.sleep(0.2)
+    return None
+
+
+def reporte(latencias, errores, duracion, mem, drenado, series):
+    total = sum(len(v) for v in latencias.values())
+    print(f"\n{'ruta':<18} {'peticiones':>10} {'errores':>8} {'p50 ms':>8} {'p99 ms':>9}")
+    for ruta, muestras in sorted(latencias.items()):
+        muestras.sort()
+        print(f"{ruta:<18} {len(muestras):>10} {errores.get(ruta, 0):>8} "
+              f"{percentil(muestras, 0.50) * 1000:>8.2f} {percentil(muestras, 0.99) * 1000:>9.2f}")
+    print(f"\nthroughput: {total / duracion:.1f} req/s ({total} en {duracion:.1f} s)")
+    if mem[0] is not None:
+        print(f"memoria servidor: RSS {mem[0]:.1f} MB, pico {mem[1]:.1f} MB")
+    print(f"colas drenadas en: {'%.1f s' % drenado if drenado is not None else 'timeout'}")
+
+    print(f"\n{'dependencia':<20} {'llamadas':>9} {'media ms':>9} {'errores':>8}")
+    for (nombre, etiquetas), n in sorted(series.items()):
+        if nombre != "dependencia_segundos_count":
+            continue
+        suma = series.get(("dependencia_segundos_sum", etiquetas), 0.0)
+        fallos = sum(v for (k, e), v in series.items()
+                     if k == "dependencia_errores_total" and e.startswith(etiquetas + ","))
+        dependencia = etiquetas.split('"')[1]
+        print(f"{dependencia:<20} {int(n):>9} {suma / n * 1000 if n else 0:>9.2f} {int(fallos):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Carga offline con Twilio, OpenAI y Calendar simulados")
+    parser.add_argument("--mode", default="sync", choices=("sync", "async"))
+    parser.add_argument("--rps", type=float, default=50)
+    parser.add_argument("--duracion", type=float, default=20, help="segundos de carga (si no hay --traza)")
+    parser.add_argument("--concurrencia", type=int, default=128, help="peticiones en vuelo como máximo")
+    parser.add_argument("--port", type=int, default=5056)
+    parser.add_argument("--twilio", default="80:0.01", metavar="MS:FALLOS")
+    parser.add_argument("--openai", default="800:0.02", metavar="MS:FALLOS")
+    parser.add_argument("--calendar", default="150:0.01", metavar="MS:FALLOS")
+    parser.add_argument("--activas", type=int, default=200, help="conversaciones simultáneas en la traza")
+    parser.add_argument("--reintentos", type=float, default=0.03, help="prob. de reentrega de Twilio")
+    parser.add_argument("--difusiones", type=float, default=0.001, help="prob. de /nuevo_contenido por evento")
+    parser.add_argument("--suscriptores", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--traza", help="JSONL de eventos {ruta, form|json} a reproducir")
+    parser.add_argument("--guardar-traza", help="guarda la traza generada en este JSONL")
+    parser.add_argument("--env", action="append", default=[], metavar="CLAVE=VALOR",
+                        help="variables extra para el servidor")
+    args = parser.parse_args()
+
+    if args.traza:
+        with open(args.traza) as f:
+            traza = [json.loads(linea) for linea in f if linea.strip()]
+    else:
+        traza = generar_traza(int(args.rps * args.duracion), args.activas, args.reintentos,
+                              args.difusiones, args.seed)
+    if args.guardar_traza:
+        with open(args.guardar_traza, "w") as f:
+            f.writelines(json.dumps(e, ensure_ascii=False) + "\n" for e in traza)
+
+    openai_falso = OpenAIFalso(Perfil.desde_texto(args.openai)).start()
+    tmp = tempfile.mkdtemp(prefix="bench-carga-")
+    env = dict(
+        os.environ,
+        SERVER_MODE=args.mode, PORT=str(args.port),
+        STATE_BACKEND="memory", SCHEDULER_DB=os.path.join(tmp, "jobs.db"),
+        OPENAI_API_BASE=openai_falso.url, OPENAI_API_KEY="sk-falsa",
+        TWILIO_ACCOUNT_SID="ACfalso", TWILIO_AUTH_TOKEN="falso", TWILIO_WHATSAPP_NUMBER="+10000000000",
+        WP_WEBHOOK_SECRET="", METRICS_TOKEN="",
+        SUBSCRIBED_USERS=",".join(f"+52166{i:07d}" for i in range(args.suscriptores)),
+        FAKE_TWILIO=args.twilio, FAKE_CALENDAR=args.calendar,
+    )
+    env.update(dict(e.split("=", 1) for e in args.env))
+    proc = subprocess.Popen([sys.executable, os.path.join(AQUI, "app_simulada.py")], cwd=tmp, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        esperar_servidor(args.port)
+        cliente = Cliente(args.port)
+        print(f"modo={args.mode} eventos={len(traza)} rps={args.rps} twilio={args.twilio} "
+              f"openai={args.openai} calendar={args.calendar}")
+        latencias, errores, duracion = reproducir(cliente, traza, args.rps, args.concurrencia)
+        drenado = esperar_drenado(cliente, timeout=120)
+        mem = memoria(proc.pid)
+        series = leer_metricas(cliente.get("/metrics"))
+        reporte(latencias, errores, duracion, mem, drenado, series)
+        print(f"llamadas al OpenAI falso: {openai_falso.llamadas}")
+    finally:
+        proc.terminate()
+        proc.wait(10)
+        openai_falso.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# benchmarks/bench_server_modes.py
+#
+# Compara throughput y latencia de cola entre SERVER_MODE=sync (waitress) y
+# SERVER_MODE=async (uvicorn). Levanta la app en cada modo con los dobles de
+# fakes.py (app_simulada.py: ni Twilio, ni OpenAI, ni Calendar reales) y
+# lanza peticiones concurrentes contra "/" y "/incoming".
+#
+#   python benchmarks/bench_server_modes.py --requests 2000 --concurrency 64
+#
+# Por defecto /incoming recibe "curso" (respuesta fija, sin IA); con
+# --body "hola" se mide el camino de OpenAI contra el servidor falso.
+
+import argparse
+import http.client
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+RAIZ = os.path.dirname(AQUI)
+sys.path[:0] = [RAIZ, AQUI]
+
+from fakes import OpenAIFalso, Perfil  # noqa: E402
+
+
+def esperar_servidor(port, timeout=30):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"El servidor no respondió en el puerto {port}")
+
+
+def percentil(muestras, q):
+    return muestras[min(len(muestras) - 1, int(q * len(muestras)))]
+
+
+def cargar(port, ruta, cuerpo, total, concurrencia):
+    headers = {"Content-Type": "application/x-www-form-urlencoded"} if cuerpo else {}
+    por_hilo = total // concurrencia
+
+    def cliente(i):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        latencias, errores = [], 0
+        for n in range(por_hilo):
+            datos = urlencode({"From": f"whatsapp:+52155{i:04d}{n:04d}", "Body": cuerpo}) if cuerpo else None
+            t0 = time.perf_counter()
+            try:
+                conn.request("POST" if cuerpo else "GET", ruta, body=datos, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                if resp.status >= 400:
+                    errores += 1
+            except OSError:
+                errores += 1
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            latencias.append(time.perf_counter() - t0)
+        return latencias, errores
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrencia) as pool:
+        resultados = list(pool.map(cliente, range(concurrencia)))
+    duracion = time.perf_counter() - t0
+    latencias = sorted(l for r in resultados for l in r[0])
+    return {
+        "rps": len(latencias) / duracion,
+        "p50_ms": percentil(latencias, 0.50) * 1000,
+        "p99_ms": percentil(latencias, 0.99) * 1000,
+        "media_ms": statistics.fmean(latencias) * 1000,
+        "errores": sum(r[1] for r in resultados),
+    }
+
+
+def medir_modo(modo, args, openai_falso):
+    # Credenciales falsas explícitas: tienen prioridad sobre el .env del desarrollador
+    tmp = tempfile.mkdtemp(prefix="bench-modos-")
+    env = dict(
+        os.environ, SERVER_MODE=modo, PORT=str(args.port), STATE_BACKEND="memory",
+        SCHEDULER_DB=os.path.join(tmp, "jobs.db"),
+        OPENAI_API_BASE=openai_falso.url, OPENAI_API_KEY="sk-falsa",
+        TWILIO_ACCOUNT_SID="ACfalso", TWILIO_AUTH_TOKEN="falso", TWILIO_WHATSAPP_NUMBER="+10000000000",
+        FAKE_TWILIO=args.twilio, FAKE_CALENDAR=args.calendar,
+    )
+    env.update(args.env)
+    proc = subprocess.Popen([sys.executable, os.path.join(AQUI, "app_simulada.py")], cwd=tmp, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        esperar_servidor(args.port)
+        return {
+            "/": cargar(args.port, "/", None, args.requests, args.concurrency),
+            "/incoming": cargar(args.port, "/incoming", args.body, args.requests, args.concurrency),
+        }
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara SERVER_MODE=sync y SERVER_MODE=async")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--body", default="curso")
+    parser.add_argument("--modes", default="sync,async")
+    parser.add_argument("--twilio", default="80:0", help="perfil latencia_ms:fallos de Twilio")
+    parser.add_argument("--openai", default="800:0", help="perfil de OpenAI (primer fragmento)")
+    parser.add_argument("--calendar", default="150:0", help="perfil de Google Calendar")
+    parser.add_argument("--env", action="append", default=[], metavar="CLAVE=VALOR",
+                        help="variables extra para el servidor (p.ej. IA_STREAM=0)")
+    args = parser.parse_args()
+    args.env = dict(e.split("=", 1) for e in args.env)
+
+    openai_falso = OpenAIFalso(Perfil.desde_texto(args.openai)).start()
+    try:
+        print(f"{'modo':<6} {'ruta':<10} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'media ms':>9} {'errores':>8}")
+        for modo in args.modes.split(","):
+            for ruta, r in medir_modo(modo, args, openai_falso).items():
+                print(f"{modo:<6} {ruta:<10} {r['rps']:>9.1f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+                      f"{r['media_ms']:>9.2f} {r['errores']:>8}")
+    finally:
+        openai_falso.stop()
+
+
+if __name__ == "__main__":
+    main()
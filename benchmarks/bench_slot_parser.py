@@ -0,0 +1,57 @@
+# benchmarks/bench_slot_parser.py
+#
+# Tiempo por mensaje de slot_parser.parsear_slot frente a dateutil.parser.parse
+# sobre respuestas típicas de usuarios (frío = LRU vacía, caliente = repetidas).
+#
+#   python benchmarks/bench_slot_parser.py --repeticiones 20000
+
+import argparse
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dateutil import parser as dateparser  # noqa: E402
+
+import slot_parser  # noqa: E402
+
+MENSAJES = [
+    "2026-10-20 08:20", "20/10 8:20", "mañana a las 7", "lunes 10:00", "martes 7",
+    "hoy a las 3 pm", "2", "opción 3", "08:20", "pasado mañana 10",
+    "hola", "quiero la de las 9", "gracias", "¿cuánto cuesta?", "ok",
+]
+OFRECIDOS = ["2026-10-19 12:20", "2026-10-20 07:00", "2026-10-20 08:20", "2026-10-26 09:40"]
+
+
+def con_dateutil(texto):
+    try:
+        return dateparser.parse(texto, dayfirst=True)
+    except (ValueError, OverflowError):
+        return None
+
+
+def medir(nombre, fn, repeticiones):
+    t0 = time.perf_counter()
+    for i in range(repeticiones):
+        fn(MENSAJES[i % len(MENSAJES)])
+    us = (time.perf_counter() - t0) / repeticiones * 1e6
+    print(f"{nombre:<28} {us:>9.2f} µs/mensaje")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parser de slots vs dateutil")
+    parser.add_argument("--repeticiones", type=int, default=20000)
+    args = parser.parse_args()
+    hoy = datetime.date(2026, 10, 19)
+
+    medir("dateutil.parse", con_dateutil, args.repeticiones)
+    slot_parser._interpretar.cache_clear()
+    medir("parsear_slot (frío)", lambda t: slot_parser.parsear_slot(t, OFRECIDOS, hoy), len(MENSAJES))
+    medir("parsear_slot (caliente)", lambda t: slot_parser.parsear_slot(t, OFRECIDOS, hoy), args.repeticiones)
+    print(slot_parser._interpretar.cache_info())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+# benchmarks/fakes.py
+#
+# Dobles locales de Twilio, OpenAI y Google Calendar para medir la app sin
+# tocar las APIs de pago. Cada uno tiene latencia y tasa de fallos
+# configurables con un perfil "latencia_ms:tasa_fallos" (p.ej. "80:0.01").
+#
+# - TwilioFalso sustituye a outbound.TwilioTransport (main.outbound.transport).
+# - CalendarManagerFalso sustituye a calendar_client.CalendarClientManager
+#   (FreeBusy, insert y peticiones batch).
+# - OpenAIFalso es un servidor HTTP con /v1/chat/completions (normal o en
+#   streaming SSE); la app lo usa con OPENAI_API_BASE, así se mide también
+#   el cliente HTTP real.
+
+import datetime
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from metrics import medir
+
+
+class FalloSimulado(Exception):
+    """
+    Error transitorio del servicio falso (como un 503 de la API real).
+    """
+
+    def __init__(self, status=503):
+        super().__init__(f"fallo simulado ({status})")
+        self.status = status
+        # Como googleapiclient.HttpError: el status también viene en .resp
+        self.resp = {"status": status}
+
+
+class Perfil:
+    """
+    Latencia (media y dispersión relativa) y probabilidad de fallo de un servicio.
+    """
+
+    def __init__(self, latencia=0.05, fallos=0.0, jitter=0.25, seed=None):
+        self.latencia = latencia
+        self.fallos = fallos
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def desde_texto(cls, texto):
+        latencia, _, fallos = texto.partition(":")
+        return cls(float(latencia) / 1000, float(fallos or 0))
+
+    def llamar(self):
+        """
+        Espera la latencia simulada y lanza FalloSimulado según la tasa de fallos.
+        """
+        with self._lock:
+            espera = max(0.0, self._rng.gauss(self.latencia, self.latencia * self.jitter))
+            falla = self._rng.random() < self.fallos
+        time.sleep(espera)
+        if falla:
+            raise FalloSimulado()
+
+
+# ─── TWILIO ────────────────────────────────────────────────────────────────────
+class TwilioFalso:
+    """
+    Mismo contrato que outbound.TwilioTransport: send(to, body) -> sid.
+    """
+
+    def __init__(self, perfil):
+        self.perfil = perfil
+        self._seq = itertools.count(1)
+
+    def send(self, to, body):
+        with medir("twilio"):
+            self.perfil.llamar()
+            return f"SMfalso{next(self._seq):010d}"
+
+
+# ─── GOOGLE CALENDAR ───────────────────────────────────────────────────────────
+class _PeticionFalsa:
+    def __init__(self, perfil, respuesta):
+        self.perfil = perfil
+        self.respuesta = respuesta
+
+    def execute(self, http=None, num_retries=0):
+        self.perfil.llamar()
+        return self.respuesta()
+
+
+class _BatchFalso:
+    def __init__(self, perfil, callback):
+        self.perfil = perfil
+        self.callback = callback
+        self._peticiones = []
+
+    def add(self, peticion, request_id=None):
+        self._peticiones.append((request_id, peticion))
+
+    def execute(self, http=None):
+        # Un solo viaje de red para todo el lote; cada inserción puede fallar aparte
+        self.perfil.llamar()
+        for request_id, peticion in self._peticiones:
+            try:
+                respuesta, error = peticion.respuesta(), None
+                if random.random() < self.perfil.fallos:
+                    respuesta, error = None, FalloSimulado()
+            except Exception as e:
+                respuesta, error = None, e
+            self.callback(request_id, respuesta, error)
+
+
+class CalendarServiceFalso:
+    """
+    Recurso "calendar v3" con freebusy().query, events().insert y batch.
+
+    FreeBusy devuelve, por calendario, bloques de una hora ocupados con
+    probabilidad `ocupacion` (deterministas por calendario y hora).
+    """
+
+    def __init__(self, perfil, ocupacion=0.3):
+        self.perfil = perfil
+        self.ocupacion = ocupacion
+        self._ids = itertools.count(1)
+
+    def _busy(self, calendar_id, desde, hasta):
+        bloques = []
+        hora = desde.replace(minute=0, second=0, microsecond=0)
+        while hora < hasta:
+            if random.Random(f"{calendar_id}:{hora.isoformat()}").random() < self.ocupacion:
+                bloques.append({"start": hora.isoformat(),
+                                "end": (hora + datetime.timedelta(hours=1)).isoformat()})
+            hora += datetime.timedelta(hours=1)
+        return bloques
+
+    def freebusy(self):
+        return self
+
+    def query(self, body):
+        desde = datetime.datetime.fromisoformat(body["timeMin"])
+        hasta = datetime.datetime.fromisoformat(body["timeMax"])
+        return _PeticionFalsa(self.perfil, lambda: {"calendars": {
+            item["id"]: {"busy": self._busy(item["id"], desde, hasta)} for item in body["items"]
+        }})
+
+    def events(self):
+        return self
+
+    def insert(self, calendarId, body):
+        return _PeticionFalsa(self.perfil, lambda: dict(body, id=f"evfalso{next(self._ids)}"))
+
+    def new_batch_http_request(self, callback=None):
+        return _BatchFalso(self.perfil, callback)
+
+
+class CalendarManagerFalso:
+    """
+    Mismo contrato que calendar_client.CalendarClientManager.
+    """
+
+    def __init__(self, perfil, ocupacion=0.3):
+        self._service = CalendarServiceFalso(perfil, ocupacion)
+
+    def credentials(self):
+        return None
+
+    def service(self):
+        return self._service
+
+    def http(self):
+        return None
+
+    def execute(self, request, num_retries=1):
+        return request.execute(num_retries=num_retries)
+
+    def precalentar(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# ─── OPENAI ────────────────────────────────────────────────────────────────────
+class _OpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        cuerpo = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        try:
+            self.server.perfil.llamar()
+        except FalloSimulado as e:
+            return self._json(e.status, {"error": {"message": str(e), "type": "server_error"}})
+        self.server.llamadas += 1
+        pregunta = (cuerpo.get("messages") or [{}])[-1].get("content", "")
+        if cuerpo.get("stream"):
+            return self._stream(cuerpo, f"Respuesta simulada. Preguntaste: {pregunta[-80:]}. " * 3)
+        self._json(200, {
+            "id": f"chatcmpl-falso{self.server.llamadas}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": cuerpo.get("model", "falso"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": f"Respuesta simulada a: {pregunta[-80:]}"},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": len(pregunta) // 4, "completion_tokens": 20,
+                      "total_tokens": len(pregunta) // 4 + 20},
+        })
+
+    def _stream(self, cuerpo, texto):
+        # La latencia del perfil es la espera al primer fragmento; el resto llega seguido
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for palabra in texto.split(" "):
+            evento = {"object": "chat.completion.chunk", "model": cuerpo.get("model", "falso"),
+                      "choices": [{"index": 0, "delta": {"content": palabra + " "}, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(evento)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(0.002)
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def _json(self, status, datos):
+        cuerpo = json.dumps(datos).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+class OpenAIFalso(ThreadingHTTPServer):
+    """
+    Servidor local compatible con POST {url}/chat/completions.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, perfil, port=0):
+        super().__init__(("127.0.0.1", port), _OpenAIHandler)
+        self.perfil = perfil
+        self.llamadas = 0
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="openai-falso", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,290 @@
+# booking.py
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from functools import partial
+
+import calendar_utils
+from calendar_client import get_calendar_manager
+from metrics import medir
+from resiliencia import CircuitoAbierto, es_fallo_upstream, es_limite_cuota, get_breaker
+
+BOOKING_BATCH     = int(os.getenv("BOOKING_BATCH", "20"))      # máximo de la API batch: 50
+BOOKING_INTERVALO = float(os.getenv("BOOKING_INTERVALO", "0.5"))
+BOOKING_REINTENTOS = 3
+
+
+class SlotOcupado(Exception):
+    """
+    El horario pedido ya no está libre (cita existente o reserva de otro usuario).
+    """
+
+
+class SlotInvalido(ValueError):
+    """
+    El texto no es un horario de la agenda (formato, hora fuera de agenda o pasada).
+    """
+
+
+class _Reserva:
+    __slots__ = ("numero", "slot", "calendar_id", "inicio", "fin", "evento", "on_result", "intentos",
+                 "reclamada")
+
+    def __init__(self, numero, slot, calendar_id, inicio, fin, evento, on_result):
+        self.numero = numero
+        self.slot = slot
+        self.calendar_id = calendar_id
+        self.inicio = inicio
+        self.fin = fin
+        self.evento = evento
+        self.on_result = on_result
+        self.intentos = 0
+        self.reclamada = False
+
+    def datos(self):
+        return {"numero": self.numero, "slot": self.slot, "calendar_id": self.calendar_id,
+                "evento": self.evento}
+
+
+class BookingPipeline:
+    """
+    Reserva de citas con comprobación de conflictos.
+
+    `reservar` valida el horario contra el índice de ocupados de cada
+    calendario (terapeuta) y lo aparta en el primero libre, al instante (en
+    el índice local y, si hay StateStore, entre workers). Las
+    inserciones en Google se agrupan en peticiones batch desde un hilo propio;
+    si una falla, la reserva se libera y se avisa por `on_result(ok, error)`.
+
+    Con StateStore, cada inserción pendiente también se guarda (NS_COLA) y
+    `start()` recupera las que dejó un proceso que se reinició; como en el
+    JobScheduler, un worker reclama la inserción (pop atómico) antes de
+    escribirla, así que nunca la escriben dos. Las recuperadas avisan con
+    `on_recuperada(numero, slot, ok, error)`.
+    """
+
+    NS = "reservas"
+    NS_COLA = "reservas_cola"
+
+    def __init__(self, store=None, calendarios=None, batch_size=BOOKING_BATCH,
+                 intervalo=BOOKING_INTERVALO, on_recuperada=None):
+        self.store = store
+        self.on_recuperada = on_recuperada
+        self.calendarios = dict(calendarios or calendar_utils.CALENDARIOS)
+        self.batch_size = batch_size
+        self.intervalo = intervalo
+        self._cola = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stop = False
+
+    @staticmethod
+    def _clave(calendar_id, slot):
+        return f"{calendar_id}:{slot}"
+
+    def _apartar(self, numero, calendar_id, slot, inicio, fin):
+        indice = calendar_utils.indice_de(calendar_id)
+        clave = self._clave(calendar_id, slot)
+        if self.store is not None:
+            ttl = max(60.0, fin.timestamp() - time.time())
+            if not self.store.add(self.NS, clave, numero, ttl=ttl):
+                return False
+        if not indice.reservar(inicio, fin):
+            if self.store is not None:
+                self.store.delete(self.NS, clave)
+            return False
+        return True
+
+    def reservar(self, numero, slot, description=None, gratuito=False, on_result=None,
+                 terapeuta=None):
+        """
+        Aparta `slot` ("%Y-%m-%d %H:%M") para `numero` con `terapeuta`, o con
+        el primero libre en el orden de `calendarios`. Devuelve el nombre del
+        terapeuta asignado; lanza SlotInvalido, SlotOcupado o
+        calendar_utils.TerapeutaDesconocido.
+        """
+        try:
+            inicio, fin = calendar_utils.intervalo_slot(slot)
+        except ValueError:
+            raise SlotInvalido(slot) from None
+        indice = calendar_utils.asegurar_indice()
+        if inicio.timestamp() <= time.time() or not indice.es_slot(inicio):
+            raise SlotInvalido(slot)
+        candidatos = [terapeuta] if terapeuta is not None else list(self.calendarios)
+        for nombre in candidatos:
+            calendar_id = calendar_utils.calendario_de(nombre, self.calendarios)
+            if self._apartar(numero, calendar_id, slot, inicio, fin):
+                break
+        else:
+            raise SlotOcupado(slot)
+        evento = calendar_utils.cuerpo_evento(numero, inicio, fin, gratuito, description)
+        reserva = _Reserva(numero, slot, calendar_id, inicio, fin, evento, on_result)
+        self._persistir(reserva)
+        with self._cond:
+            self._cola.append(reserva)
+            self._cond.notify()
+        return nombre
+
+    def pending(self):
+        with self._cond:
+            return len(self._cola)
+
+    # ─── CICLO DE VIDA ────────────────────────────────────────────────────────
+    def start(self):
+        if self._thread is not None:
+            return
+        self._recuperar()
+        self._stop = False
+        self._thread = threading.Thread(target=self._bucle, name="booking", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    # ─── INSERCIONES PENDIENTES PERSISTIDAS ───────────────────────────────────
+    def _persistir(self, reserva):
+        if self.store is None:
+            return
+        ttl = max(60.0, reserva.fin.timestamp() - time.time())
+        self.store.set(self.NS_COLA, self._clave(reserva.calendar_id, reserva.slot), reserva.datos(), ttl=ttl)
+        reserva.reclamada = False
+
+    def _reclamar(self, reserva):
+        """
+        True si este worker debe escribir la reserva. Si otro la reclamó antes,
+        la suelta: el evento ya está (o estará) en Google y lo traerá FreeBusy.
+        """
+        if self.store is None or reserva.reclamada:
+            return True
+        reserva.reclamada = self.store.pop(self.NS_COLA, self._clave(reserva.calendar_id, reserva.slot)) is not None
+        if not reserva.reclamada:
+            calendar_utils.indice_de(reserva.calendar_id).confirmar(reserva.inicio, reserva.fin)
+        return reserva.reclamada
+
+    def _recuperar(self):
+        if self.store is None:
+            return
+        with self._cond:
+            en_cola = {self._clave(r.calendar_id, r.slot) for r in self._cola}
+        recuperadas = []
+        for clave, datos in self.store.items(self.NS_COLA):
+            if clave in en_cola:
+                continue
+            try:
+                inicio, fin = calendar_utils.intervalo_slot(datos["slot"])
+                indice = calendar_utils.indice_de(datos["calendar_id"])
+            except (KeyError, ValueError):
+                logging.error(f"Reserva pendiente no recuperable: {clave}")
+                continue
+            indice.reservar(inicio, fin)
+            on_result = None
+            if self.on_recuperada is not None:
+                on_result = partial(self.on_recuperada, datos["numero"], datos["slot"])
+            recuperadas.append(_Reserva(datos["numero"], datos["slot"], datos["calendar_id"],
+                                        inicio, fin, datos["evento"], on_result))
+        if recuperadas:
+            with self._cond:
+                self._cola.extend(recuperadas)
+            logging.info(f"{len(recuperadas)} citas pendientes de escribir recuperadas")
+
+    def _devolver(self, reservas, al_frente=False):
+        """
+        Vuelve a encolar reservas sin escribir; quedan persistidas otra vez.
+        """
+        for reserva in reservas:
+            self._persistir(reserva)
+        with self._cond:
+            if al_frente:
+                self._cola.extendleft(reversed(reservas))
+            else:
+                self._cola.extend(reservas)
+            self._cond.notify()
+
+    # ─── ESCRITURA EN GOOGLE ──────────────────────────────────────────────────
+    def _bucle(self):
+        while True:
+            with self._cond:
+                while not self._cola and not self._stop:
+                    self._cond.wait()
+                if self._stop and not self._cola:
+                    return
+            # Breve espera para juntar confirmaciones simultáneas en un mismo batch
+            time.sleep(self.intervalo)
+            with self._cond:
+                lote = [self._cola.popleft() for _ in range(min(self.batch_size, len(self._cola)))]
+            lote = [reserva for reserva in lote if self._reclamar(reserva)]
+            if lote:
+                self._escribir(lote)
+
+    def _escribir(self, lote):
+        errores = {}
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                errores[request_id] = exception
+
+        for reserva in lote:
+            reserva.intentos += 1
+        try:
+            # Construir el servicio puede refrescar el token: un fallo aquí se
+            # trata como el de la petición y no se pierde el lote
+            manager = get_calendar_manager()
+            service = manager.service()
+            batch = service.new_batch_http_request(callback=callback)
+            for i, reserva in enumerate(lote):
+                batch.add(
+                    service.events().insert(calendarId=reserva.calendar_id, body=reserva.evento),
+                    request_id=str(i),
+                )
+            with get_breaker("calendar"), medir("calendar_batch"):
+                batch.execute(http=manager.http())
+        except CircuitoAbierto as e:
+            # Calendar caído: el lote espera a que el circuito vuelva a probar,
+            # sin gastar intentos (el horario sigue apartado en el índice)
+            for reserva in lote:
+                reserva.intentos -= 1
+            self._devolver(lote, al_frente=True)
+            with self._cond:
+                if not self._stop:
+                    self._cond.wait(get_breaker(e.nombre).espera)
+            return
+        except Exception as e:
+            logging.exception("Error enviando batch de citas a Google Calendar")
+            errores = {str(i): e for i in range(len(lote))}
+
+        for i, reserva in enumerate(lote):
+            error = errores.get(str(i))
+            if error is None:
+                calendar_utils.indice_de(reserva.calendar_id).confirmar(reserva.inicio, reserva.fin)
+                logging.info(f"Cita {reserva.slot} creada para {reserva.numero}")
+                self._notificar(reserva, True, None)
+            elif reserva.intentos < BOOKING_REINTENTOS and (es_fallo_upstream(error) or es_limite_cuota(error)):
+                # Red, 429, 5xx o 403 por cuota (la API batch los da por inserción
+                # bajo carga): se reintenta en el próximo batch
+                self._devolver([reserva])
+            else:
+                self._liberar(reserva)
+                logging.error(f"No se pudo crear la cita {reserva.slot} de {reserva.numero}: {error}")
+                self._notificar(reserva, False, error)
+
+    def _liberar(self, reserva):
+        calendar_utils.indice_de(reserva.calendar_id).liberar(reserva.inicio, reserva.fin)
+        if self.store is not None:
+            self.store.delete(self.NS, self._clave(reserva.calendar_id, reserva.slot))
+
+    @staticmethod
+    def _notificar(reserva, ok, error):
+        if reserva.on_result is None:
+            return
+        try:
+            reserva.on_result(ok, error)
+        except Exception:
+            logging.exception("Error en callback de reserva")
@@ -0,0 +1,144 @@
+# broadcast.py
+
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from outbound import TokenBucket
+
+
+class BroadcastJob:
+    """
+    Estado de una difusión: quién falta, a quién ya se envió y quién falló.
+    """
+
+    def __init__(self, job_id, mensaje, destinatarios):
+        self.id = job_id
+        self.mensaje = mensaje
+        self.destinatarios = list(dict.fromkeys(destinatarios))
+        self.pendientes = set(self.destinatarios)
+        self.enviados = set()
+        self.fallidos = {}              # destinatario -> error
+        self.creado = time.time()
+        # Sin destinatarios no hay envío que la cierre: nace terminada
+        self.terminado = None if self.destinatarios else self.creado
+        self.huella = None
+        self.lock = threading.Lock()
+
+    def estado(self):
+        with self.lock:
+            return {
+                "job_id": self.id,
+                "estado": "en_curso" if self.pendientes else "terminado",
+                "total": len(self.destinatarios),
+                "enviados": len(self.enviados),
+                "fallidos": len(self.fallidos),
+                "pendientes": len(self.pendientes),
+                "creado": self.creado,
+                "terminado": self.terminado,
+            }
+
+
+class BroadcastManager:
+    """
+    Difusiones masivas en segundo plano.
+
+    Cada difusión se reparte en un pool acotado de hilos, con un token bucket
+    que limita los envíos por segundo. Los reintentos solo cubren a quienes
+    fallaron; nunca se reenvía a quien ya recibió el mensaje.
+    """
+
+    def __init__(self, send_fn, max_workers=8, rate=10.0, max_jobs=100):
+        self.send_fn = send_fn
+        self.bucket = TokenBucket(rate)
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="broadcast")
+        self._jobs = OrderedDict()      # job_id -> BroadcastJob
+        self._por_mensaje = {}          # hash del mensaje -> job_id
+        self._lock = threading.Lock()
+
+    def crear(self, destinatarios, mensaje):
+        """
+        Lanza una difusión y devuelve su job. Si el mismo mensaje ya se está
+        difundiendo (p.ej. WordPress reenvió el webhook), devuelve el job existente.
+        """
+        huella = hashlib.sha256(mensaje.encode()).hexdigest()
+        with self._lock:
+            existente = self._jobs.get(self._por_mensaje.get(huella))
+            if existente is not None:
+                return existente
+            job = BroadcastJob(uuid.uuid4().hex, mensaje, destinatarios)
+            job.huella = huella
+            self._jobs[job.id] = job
+            self._por_mensaje[huella] = job.id
+            while len(self._jobs) > self.max_jobs:
+                _, viejo = self._jobs.popitem(last=False)
+                self._por_mensaje.pop(viejo.huella, None)
+        self._lanzar(job, job.destinatarios)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def reintentar(self, job_id):
+        """
+        Vuelve a enviar solo a los destinatarios que fallaron. Devuelve cuántos.
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        with job.lock:
+            fallidos = list(job.fallidos)
+            job.fallidos.clear()
+            job.pendientes.update(fallidos)
+            if fallidos:
+                job.terminado = None
+        self._lanzar(job, fallidos)
+        return len(fallidos)
+
+    # ─── INTERNOS ─────────────────────────────────────────────────────────────
+    def _lanzar(self, job, destinatarios):
+        if destinatarios:
+            threading.Thread(target=self._repartir, args=(job, destinatarios),
+                             name=f"broadcast-{job.id[:8]}", daemon=True).start()
+
+    def _repartir(self, job, destinatarios):
+        # Como mucho max_workers envíos en vuelo; el resto espera su turno aquí
+        en_vuelo = threading.BoundedSemaphore(self.max_workers)
+        for destinatario in destinatarios:
+            self.bucket.acquire()
+            en_vuelo.acquire()
+            futuro = self._executor.submit(self._enviar, job, destinatario)
+            futuro.add_done_callback(lambda _f: en_vuelo.release())
+
+    def _enviar(self, job, destinatario):
+        with job.lock:
+            if destinatario in job.enviados:
+                job.pendientes.discard(destinatario)
+                return
+        try:
+            self.send_fn(destinatario, job.mensaje)
+        except Exception as e:
+            logging.error(f"Difusión {job.id}: error notificando {destinatario}: {e}")
+            with job.lock:
+                job.fallidos[destinatario] = str(e)
+                self._marcar(job, destinatario)
+            return
+        with job.lock:
+            job.enviados.add(destinatario)
+            self._marcar(job, destinatario)
+
+    @staticmethod
+    def _marcar(job, destinatario):
+        job.pendientes.discard(destinatario)
+        if not job.pendientes:
+            job.terminado = time.time()
+            logging.info(
+                f"Difusión {job.id} terminada: {len(job.enviados)} enviados, {len(job.fallidos)} fallidos"
+            )
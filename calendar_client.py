@@ -0,0 +1,169 @@
+# calendar_client.py
+
+import datetime
+import logging
+import os
+import pickle
+import threading
+
+# google-auth, httplib2 y googleapiclient se importan al primer uso (o al
+# precalentar): la mayoría de peticiones no toca Calendar.
+
+SCOPES           = ["https://www.googleapis.com/auth/calendar"]
+TOKEN_FILE       = os.getenv("GOOGLE_TOKEN_FILE", "token.json")
+CREDENTIALS_FILE = os.getenv("GOOGLE_CREDENTIALS_FILE", "credentials.json")
+REFRESH_MARGIN   = int(os.getenv("GOOGLE_REFRESH_MARGIN", "300"))    # segundos antes de expirar
+HTTP_TIMEOUT     = float(os.getenv("GOOGLE_HTTP_TIMEOUT", "10"))
+
+
+class CalendarClientManager:
+    """
+    Cliente de Google Calendar compartido por todo el proceso.
+
+    - El servicio (documento de discovery) se construye una sola vez.
+    - Las credenciales viven en memoria y se renuevan en segundo plano antes de expirar.
+    - Cada hilo reutiliza su propia conexión HTTP (httplib2 no es thread-safe).
+    - Las librerías de Google se cargan al primer uso o en `precalentar`.
+    """
+
+    def __init__(self, token_file=TOKEN_FILE, credentials_file=CREDENTIALS_FILE,
+                 refresh_margin=REFRESH_MARGIN, timeout=HTTP_TIMEOUT):
+        self.token_file = token_file
+        self.credentials_file = credentials_file
+        self.refresh_margin = refresh_margin
+        self.timeout = timeout
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._creds = None
+        self._service = None
+        self._refresher = None
+        self._stop = threading.Event()
+
+    # ─── CREDENCIALES ─────────────────────────────────────────────────────────
+    def _cargar_credenciales(self):
+        from google.auth.transport.requests import Request
+        creds = None
+        if os.path.exists(self.token_file):
+            with open(self.token_file, "rb") as token_file:
+                creds = pickle.load(token_file)
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                creds.refresh(Request())
+            else:
+                from google_auth_oauthlib.flow import InstalledAppFlow
+                flow = InstalledAppFlow.from_client_secrets_file(self.credentials_file, SCOPES)
+                creds = flow.run_local_server(port=0)
+            self._guardar(creds)
+        return creds
+
+    def _guardar(self, creds):
+        with open(self.token_file, "wb") as token_file:
+            pickle.dump(creds, token_file)
+
+    def credentials(self):
+        """
+        Devuelve las credenciales en memoria; solo lee token.json la primera vez.
+        """
+        with self._lock:
+            if self._creds is None:
+                self._creds = self._cargar_credenciales()
+                self._iniciar_renovacion()
+            elif not self._creds.valid:
+                self._renovar()
+            return self._creds
+
+    def _renovar(self):
+        from google.auth.transport.requests import Request
+        with self._lock:
+            self._creds.refresh(Request())
+            self._guardar(self._creds)
+            logging.info("Credenciales de Google Calendar renovadas")
+
+    def _segundos_para_renovar(self):
+        expiry = self._creds.expiry if self._creds else None
+        if expiry is None:
+            return None
+        # google-auth guarda expiry como UTC naive
+        restante = (expiry - datetime.datetime.utcnow()).total_seconds()
+        return max(0.0, restante - self.refresh_margin)
+
+    def _iniciar_renovacion(self):
+        if self._refresher is not None or not getattr(self._creds, "refresh_token", None):
+            return
+        self._refresher = threading.Thread(target=self._bucle_renovacion,
+                                           name="calendar-token-refresh", daemon=True)
+        self._refresher.start()
+
+    def _bucle_renovacion(self):
+        while not self._stop.is_set():
+            espera = self._segundos_para_renovar()
+            if espera is None:
+                return
+            if self._stop.wait(espera):
+                return
+            try:
+                self._renovar()
+            except Exception:
+                logging.exception("No se pudieron renovar las credenciales de Google")
+                self._stop.wait(30)
+
+    # ─── SERVICIO Y HTTP ──────────────────────────────────────────────────────
+    def service(self):
+        """
+        Recurso "calendar v3" construido una única vez para todo el proceso.
+        """
+        if self._service is None:
+            from googleapiclient.discovery import build
+            with self._lock:
+                if self._service is None:
+                    self._service = build("calendar", "v3", credentials=self.credentials(),
+                                          cache_discovery=False)
+        return self._service
+
+    def http(self):
+        """
+        Conexión HTTP autorizada y persistente del hilo actual.
+        """
+        http = getattr(self._local, "http", None)
+        if http is None:
+            import google_auth_httplib2
+            import httplib2
+            http = google_auth_httplib2.AuthorizedHttp(
+                self.credentials(), http=httplib2.Http(timeout=self.timeout)
+            )
+            self._local.http = http
+        return http
+
+    def execute(self, request, num_retries=1):
+        """
+        Ejecuta una petición del servicio sobre la conexión del hilo actual.
+        """
+        return request.execute(http=self.http(), num_retries=num_retries)
+
+    def precalentar(self):
+        """
+        Importa las librerías de Google y, si ya hay token guardado, construye
+        el servicio. Sin token no hace nada más (el flujo OAuth es interactivo).
+        """
+        import google_auth_httplib2  # noqa: F401
+        import googleapiclient.discovery  # noqa: F401
+        from google.auth.transport.requests import Request  # noqa: F401
+        if os.path.exists(self.token_file):
+            self.service()
+            self.http()
+
+    def close(self):
+        self._stop.set()
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_calendar_manager():
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = CalendarClientManager()
+    return _manager
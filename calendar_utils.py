@@ -1,101 +1,398 @@
 # calendar_utils.py
 
+import bisect
 import datetime
+import logging
 import os
-import pickle
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from functools import partial
+
+from agenda import Disponibilidad, Horario
+from calendar_client import get_calendar_manager
+# Antes se definía aquí; se reexporta para quien aún lo importe de calendar_utils
+from calendar_client import SCOPES  # noqa: F401
+import metrics
+from metrics import medir
+from resiliencia import con_cobertura, get_breaker
 
-SCOPES      = ["https://www.googleapis.com/auth/calendar"]
 CALENDAR_ID = "primary"
 
+# Horario de consulta (AGENDA_HORAS, AGENDA_HORIZONTE_DIAS, ... ver agenda.Horario)
+HORARIO          = Horario.desde_env()
+SLOT_MINUTOS     = HORARIO.slot_minutos
+MAX_SLOTS        = 10
+BUSY_TTL         = float(os.getenv("CALENDAR_BUSY_TTL", "60"))   # segundos
+FREEBUSY_MAX_DIAS = 60
+FORMATO_SLOT     = "%Y-%m-%d %H:%M"
+FREEBUSY_MAX_ITEMS = 50        # calendarios por consulta FreeBusy
+# Si FreeBusy no respondió en estos segundos se lanza una segunda consulta (0 = nunca)
+FREEBUSY_COBERTURA = float(os.getenv("FREEBUSY_COBERTURA", "2"))
+
+
+def _parsear_calendarios(texto):
+    """
+    "ana=ana@ejemplo.com,luis=luis@ejemplo.com" -> {"ana": "ana@ejemplo.com", ...}
+    """
+    calendarios = {}
+    for parte in filter(None, (p.strip() for p in texto.split(","))):
+        nombre, _, calendar_id = parte.partition("=")
+        calendarios[nombre.strip()] = (calendar_id or nombre).strip()
+    return calendarios or {"principal": CALENDAR_ID}
+
+
+# Terapeuta -> calendario; el orden define la preferencia al asignar citas
+CALENDARIOS = _parsear_calendarios(os.getenv("CALENDARIOS", ""))
+
+
+class TerapeutaDesconocido(ValueError):
+    """
+    El terapeuta pedido no está en CALENDARIOS.
+    """
+
+
+class CalendarioInaccesible(Exception):
+    """
+    FreeBusy devolvió errores para el calendario (no existe o sin permiso).
+    """
+
+    def __init__(self, calendar_id, errores):
+        super().__init__(f"calendario {calendar_id} inaccesible: {errores}")
+        self.calendar_id = calendar_id
+        self.errores = errores
+
+
+def calendario_de(terapeuta, calendarios=None):
+    calendarios = CALENDARIOS if calendarios is None else calendarios
+    try:
+        return calendarios[terapeuta]
+    except KeyError:
+        raise TerapeutaDesconocido(terapeuta) from None
+
 def obtener_credenciales():
     """
-    Carga o renueva credenciales de Google Calendar usando credentials.json y token.json.
+    Credenciales de Google Calendar en memoria (ver calendar_client).
     """
-    creds = None
-    if os.path.exists("token.json"):
-        with open("token.json", "rb") as token_file:
-            creds = pickle.load(token_file)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            from google_auth_oauthlib.flow import InstalledAppFlow
-            flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
-            creds = flow.run_local_server(port=0)
-            with open("token.json", "wb") as token_file:
-                pickle.dump(creds, token_file)
-    return creds
+    return get_calendar_manager().credentials()
 
-def get_free_busy(service, time_min, time_max):
+
+def _local(dt):
+    """
+    Normaliza un datetime a la zona horaria local (los naive se asumen locales).
+    """
+    return dt.astimezone()
+
+
+class IndiceOcupado:
+    """
+    Intervalos ocupados del horizonte y la disponibilidad derivada de ellos.
+
+    Los intervalos de FreeBusy se refrescan cada BUSY_TTL segundos aplicando
+    solo las diferencias a la Disponibilidad; las citas creadas y las reservas
+    aún no escritas en Google se aplican al momento y sobreviven a las recargas.
+    """
+
+    def __init__(self, horario=None, ttl=BUSY_TTL):
+        self.horario = horario or HORARIO
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._intervalos = []      # [(inicio, fin)] ordenados por inicio
+        self._reservas = []        # [(inicio, fin)] pendientes de confirmar en Google
+        self._disp = None          # agenda.Disponibilidad del día de carga
+        self._cargado_en = 0.0
+
+    def vigente(self, hoy):
+        with self._lock:
+            return (
+                self._disp is not None
+                and self._disp.desde == hoy
+                and time.monotonic() - self._cargado_en < self.ttl
+            )
+
+    def reemplazar(self, intervalos, hoy):
+        ordenados = sorted(intervalos)
+        with self._lock:
+            if self._disp is not None and self._disp.desde == hoy:
+                # Misma ventana: solo se aplican los cambios desde la última carga
+                nuevos, viejos = Counter(ordenados), Counter(self._intervalos)
+                for intervalo in (viejos - nuevos).elements():
+                    self._disp.quitar(*intervalo)
+                for intervalo in (nuevos - viejos).elements():
+                    self._disp.agregar(*intervalo)
+            else:
+                self._disp = Disponibilidad(self.horario, hoy)
+                for intervalo in ordenados + self._reservas:
+                    self._disp.agregar(*intervalo)
+            self._intervalos = ordenados
+            self._cargado_en = time.monotonic()
+
+    def agregar(self, inicio, fin):
+        with self._lock:
+            bisect.insort(self._intervalos, (inicio, fin))
+            if self._disp is not None:
+                self._disp.agregar(inicio, fin)
+
+    def _libre(self, inicio, fin):
+        # Solo pueden solaparse los intervalos que empiezan antes de `fin`
+        for lista in (self._intervalos, self._reservas):
+            for i in range(bisect.bisect_left(lista, (fin,))):
+                if lista[i][1] > inicio:
+                    return False
+        return True
+
+    def reservar(self, inicio, fin):
+        """
+        Comprueba y aparta el intervalo de forma atómica. False si ya está ocupado.
+        """
+        with self._lock:
+            if not self._libre(inicio, fin):
+                return False
+            bisect.insort(self._reservas, (inicio, fin))
+            if self._disp is not None:
+                self._disp.agregar(inicio, fin)
+            return True
+
+    def liberar(self, inicio, fin):
+        with self._lock:
+            if (inicio, fin) in self._reservas:
+                self._reservas.remove((inicio, fin))
+                if self._disp is not None:
+                    self._disp.quitar(inicio, fin)
+
+    def confirmar(self, inicio, fin):
+        """
+        La reserva ya está escrita en Google: pasa a ser un intervalo ocupado normal.
+        """
+        with self._lock:
+            if (inicio, fin) in self._reservas:
+                self._reservas.remove((inicio, fin))
+                bisect.insort(self._intervalos, (inicio, fin))
+
+    def siguientes(self, n, desde):
+        with self._lock:
+            if self._disp is None:
+                return []
+            return [d.strftime(FORMATO_SLOT) for d in self._disp.siguientes(n, desde)]
+
+    def es_slot(self, inicio):
+        """
+        True si `inicio` es el comienzo de un slot de la agenda cargada.
+        """
+        with self._lock:
+            return self._disp is not None and self._disp.es_slot(inicio)
+
+    def cargado(self):
+        with self._lock:
+            return self._disp is not None
+
+    def bloqueos(self):
+        """
+        Copia de (inicios, bloqueado) para combinar varios calendarios.
+        """
+        with self._lock:
+            if self._disp is None:
+                return None, None
+            return self._disp.inicios, bytes(self._disp.bloqueado)
+
+
+_indices = {calendar_id: IndiceOcupado() for calendar_id in CALENDARIOS.values()}
+# Índice del primer calendario (compatibilidad con el modo de un solo terapeuta)
+_indice = next(iter(_indices.values()))
+
+
+def indice_de(calendar_id):
+    return _indices[calendar_id]
+
+
+def get_free_busy(service, time_min, time_max, calendar_ids=None):
     """
     Llama a la API FreeBusy para obtener los bloques ocupados entre time_min y time_max.
+    Con `calendar_ids` consulta todos en la misma petición y devuelve {id: busy},
+    con None para los calendarios que FreeBusy no pudo leer. Sin `calendar_ids`,
+    un calendario ilegible lanza CalendarioInaccesible.
     """
+    ids = calendar_ids or [CALENDAR_ID]
     body = {
-        "timeMin": time_min.isoformat(),
-        "timeMax": time_max.isoformat(),
-        "items": [{"id": CALENDAR_ID}]
+        "timeMin": _local(time_min).isoformat(),
+        "timeMax": _local(time_max).isoformat(),
+        "items": [{"id": calendar_id} for calendar_id in ids]
     }
-    eventos = service.freebusy().query(body=body).execute()
-    return eventos["calendars"][CALENDAR_ID]["busy"]
+    with medir("calendar_freebusy"):
+        eventos = get_calendar_manager().execute(service.freebusy().query(body=body))
+    # Un calendario con "errors" (notFound, sin acceso) viene sin bloques: no está libre
+    resultado = {}
+    for calendar_id in ids:
+        datos = eventos["calendars"].get(calendar_id) or {"errors": [{"reason": "missing"}]}
+        if datos.get("errors"):
+            if calendar_ids is None:
+                raise CalendarioInaccesible(calendar_id, datos["errors"])
+            logging.error(f"FreeBusy sin acceso a {calendar_id}: {datos['errors']}")
+            resultado[calendar_id] = None
+        else:
+            resultado[calendar_id] = datos.get("busy", [])
+    return resultado if calendar_ids is not None else resultado[CALENDAR_ID]
+
+
+def _ventana(hoy):
+    inicio = datetime.datetime.combine(hoy, datetime.time()).astimezone()
+    return inicio, inicio + datetime.timedelta(days=HORARIO.horizonte_dias + 1)
 
-def get_available_slots():
+
+def _intervalo_busy(b):
+    return (_local(datetime.datetime.fromisoformat(b["start"].replace("Z", "+00:00"))),
+            _local(datetime.datetime.fromisoformat(b["end"].replace("Z", "+00:00"))))
+
+
+def _cargar_ocupados(hoy):
     """
-    Retorna una lista (hasta 10) de horarios disponibles (50min + 30min descanso)
-    para los próximos 7 días, considerando horarios:
-      - Lunes a sábado: 07:00 - 17:00
-      - Domingo:          09:00 - 13:00
+    Consulta FreeBusy para todos los calendarios y todo el horizonte en una
+    sola petición (una más por cada FREEBUSY_MAX_DIAS o FREEBUSY_MAX_ITEMS)
+    y actualiza los índices. Todo pasa por el circuito "calendar" y cada
+    consulta lenta se cubre con una segunda tras FREEBUSY_COBERTURA segundos.
     """
-    creds = obtener_credenciales()
-    service = build("calendar", "v3", credentials=creds)
+    desde, hasta = _ventana(hoy)
+    ids = list(_indices)
+    busy = {calendar_id: [] for calendar_id in ids}
+    tramo = desde
+    with get_breaker("calendar"):
+        service = get_calendar_manager().service()
+        while tramo < hasta:
+            fin_tramo = min(hasta, tramo + datetime.timedelta(days=FREEBUSY_MAX_DIAS))
+            for i in range(0, len(ids), FREEBUSY_MAX_ITEMS):
+                consulta = partial(get_free_busy, service, tramo, fin_tramo, ids[i:i + FREEBUSY_MAX_ITEMS])
+                respuesta = con_cobertura(consulta, FREEBUSY_COBERTURA, "calendar_freebusy")
+                for calendar_id, bloques in respuesta.items():
+                    if bloques is None:
+                        busy[calendar_id] = None
+                    elif busy[calendar_id] is not None:
+                        busy[calendar_id].extend(bloques)
+            tramo = fin_tramo
+    for calendar_id, bloques in busy.items():
+        # Calendario ilegible: todo el horizonte ocupado, no se le asignan citas
+        intervalos = [(desde, hasta)] if bloques is None else [_intervalo_busy(b) for b in bloques]
+        _indices[calendar_id].reemplazar(intervalos, hoy)
 
-    now = datetime.datetime.now()
-    end_period = now + datetime.timedelta(days=7)
-    disponibles = []
 
-    current_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    while current_day < end_period:
-        weekday = current_day.weekday()  # 0=lun,...,6=dom
-        if weekday < 6:
-            day_start = current_day.replace(hour=7, minute=0)
-            day_end   = current_day.replace(hour=17, minute=0)
-        else:
-            day_start = current_day.replace(hour=9, minute=0)
-            day_end   = current_day.replace(hour=13, minute=0)
-
-        busy_times = get_free_busy(service, day_start, day_end)
-        slot_start = day_start
-        while slot_start + datetime.timedelta(minutes=50) <= day_end:
-            slot_end = slot_start + datetime.timedelta(minutes=50)
-            ocupado = False
-            for busy in busy_times:
-                inicio = datetime.datetime.fromisoformat(busy["start"])
-                fin    = datetime.datetime.fromisoformat(busy["end"])
-                if slot_start < fin and slot_end > inicio:
-                    ocupado = True
-                    break
-            if not ocupado:
-                disponibles.append(slot_start.strftime("%Y-%m-%d %H:%M"))
-            slot_start = slot_start + datetime.timedelta(minutes=80)
-        current_day += datetime.timedelta(days=1)
-
-    return disponibles[:10]
-
-def crear_evento_google_calendar(numero, texto_horario, gratuito=False):
-    """
-    Crea un evento en Google Calendar.
-    Si gratuito=True, añade “(GRATIS)” al título.
+_recarga = None                # Future de la recarga de FreeBusy en curso
+_recarga_lock = threading.Lock()
+
+
+def _recargar(hoy):
+    """
+    Una sola recarga a la vez: quien llega mientras otra está en curso espera
+    su resultado (o su error) en vez de lanzar otra consulta, y una respuesta
+    vieja nunca pisa a una más nueva en el índice.
+    """
+    global _recarga
+    with _recarga_lock:
+        futuro = _recarga
+        lider = futuro is None
+        if lider:
+            futuro = _recarga = Future()
+    if not lider:
+        return futuro.result()
+    try:
+        _cargar_ocupados(hoy)
+    except BaseException as e:
+        futuro.set_exception(e)
+        raise
+    else:
+        futuro.set_result(None)
+    finally:
+        with _recarga_lock:
+            _recarga = None
+
+
+def asegurar_indice(now=None, calendar_id=None):
+    """
+    Recarga los bloques ocupados si la ventana cacheada expiró. Si FreeBusy
+    falla (o su circuito está abierto) y ya hubo una carga, sigue con los
+    bloques en caché; las citas y reservas locales siguen aplicándose.
+    """
+    hoy = (now or datetime.datetime.now()).date()
+    if not all(indice.vigente(hoy) for indice in _indices.values()):
+        try:
+            _recargar(hoy)
+        except Exception as e:
+            if not all(indice.cargado() for indice in _indices.values()):
+                raise
+            metrics.incrementar("degradado_total", tipo="slots_cache")
+            logging.warning(f"FreeBusy no disponible, se usan los horarios en caché: {e}")
+    return _indices[calendar_id] if calendar_id else _indice
+
+
+def _libres_cualquiera(n, desde):
+    """
+    Slots en los que al menos un terapeuta está libre: AND de los mapas de bloqueo.
+    """
+    inicios, combinado = None, None
+    for indice in _indices.values():
+        inicios_i, bloqueado = indice.bloqueos()
+        if bloqueado is None:
+            continue
+        inicios = inicios_i
+        actual = int.from_bytes(bloqueado, "big")
+        combinado = actual if combinado is None else combinado & actual
+    if inicios is None:
+        return []
+    mapa = combinado.to_bytes(len(inicios), "big")
+    libres = []
+    i = bisect.bisect_left(inicios, desde.timestamp())
+    while len(libres) < n:
+        i = mapa.find(0, i)
+        if i < 0:
+            break
+        libres.append(datetime.datetime.fromtimestamp(inicios[i]).astimezone().strftime(FORMATO_SLOT))
+        i += 1
+    return libres
+
+
+def get_available_slots(n=MAX_SLOTS, terapeuta=None):
     """
-    creds = obtener_credenciales()
-    service = build("calendar", "v3", credentials=creds)
-    inicio = datetime.datetime.strptime(texto_horario, "%Y-%m-%d %H:%M")
-    fin    = inicio + datetime.timedelta(minutes=50)
+    Retorna los próximos `n` horarios disponibles según la agenda configurada
+    (HORARIO). Sin `terapeuta`, un horario está disponible si cualquiera de los
+    CALENDARIOS lo tiene libre. Los bloques ocupados se consultan una vez por
+    ventana y se reutilizan durante BUSY_TTL segundos; la respuesta sale del índice.
+    """
+    now = datetime.datetime.now().astimezone()
+    asegurar_indice(now)
+    if terapeuta is not None:
+        return _indices[calendario_de(terapeuta)].siguientes(n, now)
+    if len(_indices) == 1:
+        return _indice.siguientes(n, now)
+    return _libres_cualquiera(n, now)
+
+
+def intervalo_slot(texto_horario):
+    inicio = _local(datetime.datetime.strptime(texto_horario, FORMATO_SLOT))
+    return inicio, inicio + datetime.timedelta(minutes=SLOT_MINUTOS)
+
+
+def cuerpo_evento(numero, inicio, fin, gratuito=False, description=None):
     summary = f"Cita Terapia {'(GRATIS)' if gratuito else ''} - {numero}"
     evento = {
         "summary": summary,
         "start": {"dateTime": inicio.isoformat()},
         "end":   {"dateTime": fin.isoformat()},
     }
-    service.events().insert(calendarId=CALENDAR_ID, body=evento).execute()
+    if description:
+        evento["description"] = description
+    return evento
 
+
+def crear_evento_google_calendar(numero, texto_horario, gratuito=False, description=None,
+                                 calendar_id=None):
+    """
+    Crea un evento en Google Calendar (por defecto, el del primer terapeuta).
+    Si gratuito=True, añade “(GRATIS)” al título.
+    """
+    calendar_id = calendar_id or next(iter(_indices))
+    manager = get_calendar_manager()
+    inicio, fin = intervalo_slot(texto_horario)
+    evento = cuerpo_evento(numero, inicio, fin, gratuito, description)
+    with get_breaker("calendar"), medir("calendar_insert"):
+        manager.execute(manager.service().events().insert(calendarId=calendar_id, body=evento))
+    # El horario queda ocupado sin esperar a la próxima consulta FreeBusy
+    _indices[calendar_id].agregar(inicio, fin)
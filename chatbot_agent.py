@@ -1,51 +1,89 @@
 # chatbot_agent.py
 
+import logging
 import os
 
+from conversacion import MemoriaConversacion
+from intent_router import IntentRouter
+from llm_cache import get_llm_cache
+from metrics import incrementar, medir
+from resiliencia import CircuitoAbierto, get_breaker
+
 # Si defines OPENAI_API_KEY en .env, usarás OpenAI; de lo contrario, solo reglas
+# (el SDK se importa en la primera consulta)
 USE_OPENAI = bool(os.getenv("OPENAI_API_KEY"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "15"))
+
+ROUTER = IntentRouter([
+    ("precio", ("precio", "costo"), False),
+    ("metodo", ("método", "cómo funciona", "qué es"), False),
+])
+
+# Prompt de sistema fijo (se construye una vez); el texto del usuario va aparte
+PROMPT_VENTAS = (
+    "Eres un asistente de ventas de AvatarM Exchange, una clínica de sanación cuántica. "
+    "Responde de manera empática, científica y guía al usuario hacia la conversión "
+    "(venta de terapia o curso). Máximo 120 palabras.\n"
+    "- Terapia 3 sesiones: https://avatarmexchange.com/product/tratamiento-completo-3-cesiones/\n"
+    "- Terapia individual: https://avatarmexchange.com/product/terapia-online/\n"
+    "- E-book: https://avatarmexchange.com/product/el-meteto-la-cura-y-sanacion-a-toda-enfermedad/\n"
+    "- Curso online: https://avatarmexchange.com/product/medicina-de-quinta-dimension/\n"
+    "- Videos IG: https://www.instagram.com/p/C9fNSX8s6Rp/ y https://www.instagram.com/p/C8jBPP0osN-/\n"
+)
 
-if USE_OPENAI:
+memoria = MemoriaConversacion(PROMPT_VENTAS)
+
+def _preguntar_openai(mensajes):
     import openai
     openai.api_key = os.getenv("OPENAI_API_KEY")
+    with get_breaker("openai"), medir("openai"):
+        response = openai.ChatCompletion.create(model="gpt-3.5-turbo", messages=mensajes,
+                                                request_timeout=OPENAI_TIMEOUT)
+    return response.choices[0].message.content.strip()
 
-def responder_con_ia(texto_usuario, numero):
+def responder_sin_ia(texto_usuario):
     """
-    Usa OpenAI (si tienes clave) o reglas simples para generar respuesta.
+    Reglas básicas gratuitas; también es la respuesta degradada cuando OpenAI
+    no responde o su circuito está abierto.
     """
-    texto = texto_usuario.lower()
-    # Reglas básicas gratuitas
-    if "precio" in texto or "costo" in texto:
+    intent = ROUTER.clasificar(texto_usuario)
+    if intent == "precio":
         return (
             "Nuestro tratamiento de 3 sesiones cuesta $XXX MXN. "
             "Puedes usar el cupón '3terapias' en: "
             "https://avatarmexchange.com/product/tratamiento-completo-3-cesiones/?currency=mxn"
         )
-    if "método" in texto or "cómo funciona" in texto or "qué es" in texto:
+    if intent == "metodo":
         return (
             "Nuestros métodos siguen un protocolo cuántico y científico. "
             "Mira esto para entender cómo devolverá tu salud: https://www.instagram.com/p/C9fNSX8s6Rp/"
         )
-    # Si tienes OpenAI, delega a GPT-3.5
-    if USE_OPENAI:
-        prompt = (
-            f"Eres un asistente de ventas de AvatarM Exchange, una clínica de sanación cuántica. "
-            f"El usuario dice: \"{texto_usuario}\". Responde de manera empática, científica y "
-            f"guía al usuario hacia la conversión (venta de terapia o curso). Máximo 120 palabras.\n"
-            "- Terapia 3 sesiones: https://avatarmexchange.com/product/tratamiento-completo-3-cesiones/\n"
-            "- Terapia individual: https://avatarmexchange.com/product/terapia-online/\n"
-            "- E-book: https://avatarmexchange.com/product/el-meteto-la-cura-y-sanacion-a-toda-enfermedad/\n"
-            "- Curso online: https://avatarmexchange.com/product/medicina-de-quinta-dimension/\n"
-            "- Videos IG: https://www.instagram.com/p/C9fNSX8s6Rp/ y https://www.instagram.com/p/C8jBPP0osN-/\n"
-        )
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "system", "content": prompt}]
-        )
-        return response.choices[0].message.content.strip()
     # Respuesta por defecto
     return (
         "¡Buen día! Somos AvatarM Exchange, clínica de sanación cuántica. "
         "¿En qué puedo ayudarte hoy?"
     )
 
+def responder_con_ia(texto_usuario, numero):
+    """
+    Usa OpenAI (si tienes clave) o reglas simples para generar respuesta.
+    """
+    if not USE_OPENAI or ROUTER.clasificar(texto_usuario) is not None:
+        return responder_sin_ia(texto_usuario)
+    # Delega a GPT-3.5 con el contexto reciente del número
+    # (en el primer turno, las preguntas repetidas salen de la caché)
+    mensajes = memoria.mensajes(numero, texto_usuario)
+    try:
+        if len(mensajes) == 2:
+            respuesta = get_llm_cache().get_or_compute(
+                PROMPT_VENTAS, texto_usuario, lambda: _preguntar_openai(mensajes)
+            )
+        else:
+            respuesta = _preguntar_openai(mensajes)
+    except Exception as e:
+        if not isinstance(e, CircuitoAbierto):
+            logging.exception("OpenAI error")
+        incrementar("degradado_total", tipo="ia_reglas")
+        return responder_sin_ia(texto_usuario)
+    memoria.registrar(numero, texto_usuario, respuesta)
+    return respuesta
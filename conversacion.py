@@ -0,0 +1,130 @@
+# conversacion.py
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+IA_MEMORIA_TURNOS   = int(os.getenv("IA_MEMORIA_TURNOS", "8"))       # mensajes (usuario + IA) por teléfono
+IA_MEMORIA_USUARIOS = int(os.getenv("IA_MEMORIA_USUARIOS", "5000"))
+IA_MEMORIA_TTL      = float(os.getenv("IA_MEMORIA_TTL", str(6 * 3600)))
+IA_PRESUPUESTO      = int(os.getenv("IA_PRESUPUESTO_TOKENS", "1500"))  # prompt completo, sin la respuesta
+IA_MAX_CARACTERES   = 2000      # un turno largo se recorta antes de guardarlo
+IA_PRIMER_FRAGMENTO = int(os.getenv("IA_PRIMER_FRAGMENTO", "160"))
+
+
+def estimar_tokens(texto: str) -> int:
+    """
+    Aproximación barata (~4 caracteres por token en español) para presupuestar.
+    """
+    return len(texto) // 4 + 4
+
+
+class MemoriaConversacion:
+    """
+    Últimos turnos con la IA por teléfono, para respuestas coherentes entre mensajes.
+
+    Cada teléfono tiene un buffer circular de `max_turnos` mensajes; los
+    teléfonos forman una LRU de `max_usuarios` y caducan tras `ttl` segundos
+    sin actividad. El mensaje de sistema se construye una sola vez y va
+    siempre primero, idéntico, para aprovechar la caché de prompts del proveedor.
+    """
+
+    def __init__(self, sistema, max_turnos=IA_MEMORIA_TURNOS, max_usuarios=IA_MEMORIA_USUARIOS,
+                 ttl=IA_MEMORIA_TTL, presupuesto=IA_PRESUPUESTO):
+        self.sistema = {"role": "system", "content": sistema}
+        self.max_turnos = max_turnos
+        self.max_usuarios = max_usuarios
+        self.ttl = ttl
+        self.presupuesto = presupuesto
+        self._tokens_sistema = estimar_tokens(sistema)
+        self._turnos = OrderedDict()    # clave -> (deque de (rol, texto, tokens), última actividad)
+        self._lock = threading.Lock()
+
+    def _historial(self, clave):
+        """
+        Debe llamarse con self._lock tomado.
+        """
+        entrada = self._turnos.get(clave)
+        if entrada is None:
+            return ()
+        if entrada[1] + self.ttl < time.time():
+            del self._turnos[clave]
+            return ()
+        return entrada[0]
+
+    def mensajes(self, clave, texto):
+        """
+        Mensajes para la API: sistema, los turnos más recientes que quepan en
+        el presupuesto de tokens y la pregunta actual como "user".
+        """
+        pregunta = {"role": "user", "content": texto[:IA_MAX_CARACTERES]}
+        disponible = self.presupuesto - self._tokens_sistema - estimar_tokens(pregunta["content"])
+        previos = []
+        with self._lock:
+            for rol, contenido, tokens in reversed(self._historial(clave)):
+                if tokens > disponible:
+                    break
+                disponible -= tokens
+                previos.append({"role": rol, "content": contenido})
+        previos.reverse()
+        return [self.sistema, *previos, pregunta]
+
+    def registrar(self, clave, pregunta, respuesta):
+        ahora = time.time()
+        with self._lock:
+            entrada = self._turnos.get(clave)
+            turnos = entrada[0] if entrada is not None else deque(maxlen=self.max_turnos)
+            for rol, contenido in (("user", pregunta), ("assistant", respuesta)):
+                contenido = contenido[:IA_MAX_CARACTERES]
+                turnos.append((rol, contenido, estimar_tokens(contenido)))
+            self._turnos[clave] = (turnos, ahora)
+            self._turnos.move_to_end(clave)
+            while len(self._turnos) > self.max_usuarios:
+                self._turnos.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._turnos)
+
+
+_FIN_FRASE = re.compile(r"[.!?…]\s|\n")
+
+
+class PrimerFragmento:
+    """
+    Acumula una respuesta en streaming y adelanta, con `on_parte(texto)`, la
+    primera parte en cuanto hay una frase completa de al menos `minimo`
+    caracteres. `resto(respuesta)` es lo que queda por enviar al terminar.
+    """
+
+    def __init__(self, on_parte, minimo=IA_PRIMER_FRAGMENTO):
+        self.on_parte = on_parte
+        self.minimo = minimo
+        self._partes = []
+        self._largo = 0
+        self.enviado = ""
+
+    def agregar(self, delta):
+        self._partes.append(delta)
+        self._largo += len(delta)
+        if self.enviado or self._largo < self.minimo:
+            return
+        texto = "".join(self._partes)
+        corte = None
+        for m in _FIN_FRASE.finditer(texto, self.minimo - 1):
+            corte = m.end()
+            break
+        if corte is None:
+            return
+        self.enviado = texto[:corte]
+        self.on_parte(self.enviado.strip())
+
+    def texto(self):
+        return "".join(self._partes)
+
+    def resto(self, respuesta):
+        if not self.enviado or not respuesta.startswith(self.enviado.strip()):
+            return respuesta
+        return respuesta[len(self.enviado.strip()):].strip()
@@ -0,0 +1,165 @@
+# dispatcher.py
+
+import asyncio
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+
+
+class KeyedDispatcher:
+    """
+    Procesa tareas en orden por clave y en paralelo entre claves.
+
+    Cada clave (teléfono normalizado) tiene su cola; como mucho un worker la
+    drena a la vez, así los mensajes de una conversación no se adelantan entre
+    sí. El pool es acotado y `max_pendientes` limita el total encolado.
+    """
+
+    def __init__(self, max_workers=8, max_pendientes=10000):
+        self.max_pendientes = max_pendientes
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inbound")
+        self._colas = {}                # clave -> deque de (fn, args)
+        self._pendientes = 0
+        self._lock = threading.Lock()
+
+    def submit(self, clave, fn, *args):
+        """
+        Encola fn(*args) tras las tareas previas de `clave`. False si está saturado.
+        """
+        with self._lock:
+            if self._pendientes >= self.max_pendientes:
+                return False
+            self._pendientes += 1
+            cola = self._colas.get(clave)
+            if cola is not None:
+                cola.append((fn, args))
+                return True
+            self._colas[clave] = deque([(fn, args)])
+        self._executor.submit(self._drenar, clave)
+        return True
+
+    def pending(self):
+        with self._lock:
+            return self._pendientes
+
+    def _drenar(self, clave):
+        while True:
+            with self._lock:
+                cola = self._colas[clave]
+                if not cola:
+                    del self._colas[clave]
+                    return
+                fn, args = cola.popleft()
+            try:
+                fn(*args)
+            except Exception:
+                logging.exception(f"Error procesando mensaje de {clave}")
+            finally:
+                with self._lock:
+                    self._pendientes -= 1
+
+
+LIMITE_ESPERA = float(os.getenv("LIMITE_ESPERA", "10"))
+
+
+class LimiteSaturado(Exception):
+    """
+    No hubo hueco para llamar a la dependencia en `espera` segundos.
+    """
+
+
+class Limites:
+    """
+    Concurrencia máxima por dependencia externa: `with limites("openai"): ...`.
+    Si no hay hueco en `espera` segundos lanza LimiteSaturado en lugar de
+    dejar el hilo bloqueado detrás de una dependencia lenta.
+    """
+
+    def __init__(self, maximos, espera=LIMITE_ESPERA):
+        self.maximos = dict(maximos)
+        self.espera = espera
+        self._semaforos = {n: threading.BoundedSemaphore(m) for n, m in self.maximos.items()}
+        self._en_uso = {n: 0 for n in self.maximos}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def __call__(self, nombre):
+        semaforo = self._semaforos.get(nombre)
+        if semaforo is None:
+            yield
+            return
+        if not semaforo.acquire(timeout=self.espera):
+            raise LimiteSaturado(nombre)
+        try:
+            with self._lock:
+                self._en_uso[nombre] += 1
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self._en_uso[nombre] -= 1
+        finally:
+            semaforo.release()
+
+    def en_uso(self):
+        with self._lock:
+            return dict(self._en_uso)
+
+
+class AsyncLimites:
+    """
+    Equivalente de Limites para el modo ASGI (asyncio.Semaphore por dependencia).
+    """
+
+    def __init__(self, maximos, espera=LIMITE_ESPERA):
+        self.espera = espera
+        self._semaforos = {n: asyncio.Semaphore(m) for n, m in maximos.items()}
+
+    @asynccontextmanager
+    async def __call__(self, nombre):
+        semaforo = self._semaforos.get(nombre)
+        if semaforo is None:
+            yield
+            return
+        try:
+            await asyncio.wait_for(semaforo.acquire(), self.espera)
+        except asyncio.TimeoutError:
+            raise LimiteSaturado(nombre) from None
+        try:
+            yield
+        finally:
+            semaforo.release()
+
+
+class AsyncKeyedLocks:
+    """
+    Un asyncio.Lock por clave, liberado cuando nadie lo usa (orden FIFO por clave).
+    """
+
+    def __init__(self):
+        self._locks = {}                # clave -> [lock, usuarios]
+
+    @asynccontextmanager
+    async def __call__(self, clave):
+        entrada = self._locks.setdefault(clave, [asyncio.Lock(), 0])
+        entrada[1] += 1
+        try:
+            async with entrada[0]:
+                yield
+        finally:
+            entrada[1] -= 1
+            if entrada[1] == 0:
+                del self._locks[clave]
+
+
+def limites_desde_env():
+    """
+    LIMITE_OPENAI / LIMITE_CALENDAR: llamadas simultáneas por dependencia.
+    """
+    return {
+        "openai": int(os.getenv("LIMITE_OPENAI", "8")),
+        "calendar": int(os.getenv("LIMITE_CALENDAR", "4")),
+    }
@@ -0,0 +1,82 @@
+# idempotency.py
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+IDEMPOTENCIA_TTL  = float(os.getenv("IDEMPOTENCIA_TTL", str(24 * 3600)))
+IDEMPOTENCIA_SIZE = int(os.getenv("IDEMPOTENCIA_SIZE", "20000"))
+EN_CURSO_TTL      = 120     # si el proceso muere a mitad, el reintento vuelve a procesar
+
+
+class IdempotencyCache:
+    """
+    Conjunto de entregas ya vistas (Twilio MessageSid, pedidos de WooCommerce).
+
+    El primer `begin(clave)` gana y procesa; los reintentos reciben la
+    respuesta guardada (o "en curso" mientras el primero no termina). El
+    frente en memoria es acotado con TTL; el StateStore opcional lo comparte
+    entre workers y reinicios.
+    """
+
+    NS = "idempotencia"
+
+    def __init__(self, maxsize=IDEMPOTENCIA_SIZE, ttl=IDEMPOTENCIA_TTL, store=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.store = store
+        self._vistos = OrderedDict()    # clave -> (respuesta | None, expira)
+        self._lock = threading.Lock()
+        self.replays = 0
+
+    def _recordar(self, clave, respuesta, ttl):
+        self._vistos[clave] = (respuesta, time.time() + ttl)
+        self._vistos.move_to_end(clave)
+        while len(self._vistos) > self.maxsize:
+            self._vistos.popitem(last=False)
+
+    def begin(self, clave):
+        """
+        Devuelve (nuevo, respuesta_previa). Si nuevo es False no hay que procesar.
+        """
+        with self._lock:
+            entrada = self._vistos.get(clave)
+            if entrada is not None and entrada[1] > time.time():
+                self.replays += 1
+                return False, entrada[0]
+            if self.store is None:
+                self._recordar(clave, None, EN_CURSO_TTL)
+                return True, None
+        if not self.store.add(self.NS, clave, {"respuesta": None}, ttl=EN_CURSO_TTL):
+            previa = (self.store.get(self.NS, clave) or {}).get("respuesta")
+            with self._lock:
+                self.replays += 1
+                if previa is not None:
+                    self._recordar(clave, previa, self.ttl)
+            return False, previa
+        with self._lock:
+            self._recordar(clave, None, EN_CURSO_TTL)
+        return True, None
+
+    def complete(self, clave, respuesta):
+        """
+        Guarda la respuesta (serializable a JSON) para repetirla en los reintentos.
+        """
+        with self._lock:
+            self._recordar(clave, respuesta, self.ttl)
+        if self.store is not None:
+            self.store.set(self.NS, clave, {"respuesta": respuesta}, ttl=self.ttl)
+
+    def fail(self, clave):
+        """
+        Olvida la clave para que un reintento vuelva a procesar.
+        """
+        with self._lock:
+            self._vistos.pop(clave, None)
+        if self.store is not None:
+            self.store.delete(self.NS, clave)
+
+    def size(self):
+        with self._lock:
+            return len(self._vistos)
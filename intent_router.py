@@ -0,0 +1,64 @@
+# intent_router.py
+
+import re
+
+from text_utils import normalizar_texto
+
+# Indicios baratos de que un texto puede contener una fecha u hora
+_POSIBLE_FECHA = re.compile(
+    r"\d|\b(?:hoy|mañana|pasado|lunes|martes|miercoles|jueves|viernes|sabado|domingo"
+    r"|enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|setiembre"
+    r"|octubre|noviembre|diciembre)\b"
+)
+
+
+def puede_ser_fecha(texto_normalizado: str) -> bool:
+    """
+    Pre-filtro antes de llamar a un parser de fechas caro.
+    """
+    return _POSIBLE_FECHA.search(texto_normalizado) is not None
+
+
+class IntentRouter:
+    """
+    Clasificador de intenciones por palabras clave, compilado una sola vez.
+
+    `reglas` es una lista ordenada por prioridad de (intent, frases, exacta):
+    - exacta=False: el intent aplica si alguna frase aparece en el texto como
+      palabras completas (admite el plural: "curso" también cubre "cursos").
+    - exacta=True: el intent aplica si el texto completo es una de las frases.
+    Las frases y el texto se comparan normalizados (sin acentos ni signos),
+    así que "método" y "metodo" son la misma regla.
+    """
+
+    def __init__(self, reglas):
+        self._prioridad = {}
+        self._por_frase = {}            # frase normalizada -> intent (contiene)
+        self._exactas = {}              # texto normalizado -> intent
+        for prioridad, (intent, frases, exacta) in enumerate(reglas):
+            self._prioridad.setdefault(intent, prioridad)
+            destino = self._exactas if exacta else self._por_frase
+            for frase in frases:
+                destino.setdefault(normalizar_texto(frase), intent)
+        alternativas = sorted(self._por_frase, key=len, reverse=True)
+        # El lookahead encuentra coincidencias solapadas en una sola pasada. El
+        # \b inicial evita que "que es" coincida dentro de "porque estoy"; el
+        # plural opcional deja pasar "terapias", "enfermedades", "cursos"...
+        self._patron = re.compile(
+            r"(?=\b(" + "|".join(map(re.escape, alternativas)) + r")(?:e?s)?\b)"
+        ) if alternativas else None
+
+    def clasificar_normalizado(self, texto):
+        mejor = self._exactas.get(texto)
+        if self._patron is not None:
+            for m in self._patron.finditer(texto):
+                intent = self._por_frase[m.group(1)]
+                if mejor is None or self._prioridad[intent] < self._prioridad[mejor]:
+                    mejor = intent
+        return mejor
+
+    def clasificar(self, texto: str):
+        """
+        Devuelve el intent de mayor prioridad presente en `texto`, o None.
+        """
+        return self.clasificar_normalizado(normalizar_texto(texto))
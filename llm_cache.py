@@ -0,0 +1,189 @@
+# llm_cache.py
+
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+from text_utils import normalizar_texto
+
+LLM_CACHE_SIZE    = int(os.getenv("LLM_CACHE_SIZE", "2048"))
+LLM_CACHE_TTL     = float(os.getenv("LLM_CACHE_TTL", str(6 * 3600)))
+LLM_CACHE_PERSIST = os.getenv("LLM_CACHE_PERSIST", "0") == "1"
+
+
+class LLMCache:
+    """
+    Caché de respuestas de la IA por (plantilla de prompt, texto normalizado).
+
+    - LRU en memoria con TTL; opcionalmente respaldada en un StateStore.
+    - Preguntas idénticas simultáneas comparten una sola llamada upstream.
+    - Los errores no se cachean: se propagan a todos los que esperaban.
+    """
+
+    NS = "llm_cache"
+
+    def __init__(self, maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL, store=None, latencias=1024):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.store = store
+        self._data = OrderedDict()      # clave -> (respuesta, expira)
+        self._en_vuelo = {}             # clave -> Future
+        self._en_vuelo_async = {}       # clave -> asyncio.Future
+        self._lock = threading.Lock()
+        self._latencias = deque(maxlen=latencias)
+        self._contadores = {"hits": 0, "misses": 0, "coalescidas": 0, "errores": 0}
+
+    @staticmethod
+    def clave(plantilla: str, texto: str) -> str:
+        huella = hashlib.sha256(plantilla.encode()).hexdigest()[:16]
+        return f"{huella}:{normalizar_texto(texto)}"
+
+    # ─── LECTURA / ESCRITURA ──────────────────────────────────────────────────
+    def _leer_memoria(self, clave):
+        """
+        Debe llamarse con self._lock tomado.
+        """
+        entrada = self._data.get(clave)
+        if entrada is not None:
+            if entrada[1] > time.time():
+                self._data.move_to_end(clave)
+                return entrada[0]
+            del self._data[clave]
+        return None
+
+    def _leer(self, clave):
+        """
+        Memoria y, si falta, el StateStore; la lectura en disco va fuera del
+        lock para no serializar todas las consultas detrás de SQLite.
+        """
+        with self._lock:
+            respuesta = self._leer_memoria(clave)
+        if respuesta is None and self.store is not None:
+            respuesta = self.store.get(self.NS, clave)
+            if respuesta is not None:
+                with self._lock:
+                    self._guardar_memoria(clave, respuesta)
+        return respuesta
+
+    def _guardar_memoria(self, clave, respuesta):
+        self._data[clave] = (respuesta, time.time() + self.ttl)
+        self._data.move_to_end(clave)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def _guardar(self, clave, respuesta, duracion):
+        with self._lock:
+            self._guardar_memoria(clave, respuesta)
+            self._latencias.append(duracion)
+        if self.store is not None:
+            self.store.set(self.NS, clave, respuesta, ttl=self.ttl)
+
+    # ─── API ──────────────────────────────────────────────────────────────────
+    def get_or_compute(self, plantilla, texto, compute):
+        """
+        Devuelve la respuesta cacheada o llama a `compute()` una sola vez por clave.
+        """
+        clave = self.clave(plantilla, texto)
+        respuesta = self._leer(clave)
+        with self._lock:
+            # Un líder pudo terminar mientras se leía el StateStore
+            respuesta = respuesta if respuesta is not None else self._leer_memoria(clave)
+            if respuesta is not None:
+                self._contadores["hits"] += 1
+                return respuesta
+            futuro = self._en_vuelo.get(clave)
+            lider = futuro is None
+            if lider:
+                futuro = self._en_vuelo[clave] = Future()
+                self._contadores["misses"] += 1
+            else:
+                self._contadores["coalescidas"] += 1
+        if not lider:
+            return futuro.result()
+        t0 = time.perf_counter()
+        try:
+            respuesta = compute()
+        except BaseException as e:
+            with self._lock:
+                self._contadores["errores"] += 1
+                del self._en_vuelo[clave]
+            futuro.set_exception(e)
+            raise
+        self._guardar(clave, respuesta, time.perf_counter() - t0)
+        with self._lock:
+            del self._en_vuelo[clave]
+        futuro.set_result(respuesta)
+        return respuesta
+
+    async def aget_or_compute(self, plantilla, texto, compute):
+        """
+        Variante para el modo ASGI: `compute()` devuelve una corrutina.
+        """
+        clave = self.clave(plantilla, texto)
+        respuesta = self._leer(clave)
+        with self._lock:
+            # Un líder pudo terminar mientras se leía el StateStore
+            respuesta = respuesta if respuesta is not None else self._leer_memoria(clave)
+            if respuesta is not None:
+                self._contadores["hits"] += 1
+                return respuesta
+            futuro = self._en_vuelo_async.get(clave)
+            lider = futuro is None
+            if lider:
+                futuro = self._en_vuelo_async[clave] = asyncio.get_running_loop().create_future()
+                self._contadores["misses"] += 1
+            else:
+                self._contadores["coalescidas"] += 1
+        if not lider:
+            return await asyncio.shield(futuro)
+        t0 = time.perf_counter()
+        try:
+            respuesta = await compute()
+        except BaseException as e:
+            with self._lock:
+                self._contadores["errores"] += 1
+                del self._en_vuelo_async[clave]
+            futuro.set_exception(e)
+            futuro.exception()          # marcada como leída si nadie más esperaba
+            raise
+        self._guardar(clave, respuesta, time.perf_counter() - t0)
+        with self._lock:
+            del self._en_vuelo_async[clave]
+        futuro.set_result(respuesta)
+        return respuesta
+
+    def metrics(self):
+        with self._lock:
+            datos = dict(self._contadores, size=len(self._data))
+            muestras = sorted(self._latencias)
+        consultas = datos["hits"] + datos["misses"] + datos["coalescidas"]
+        datos["hit_rate"] = (datos["hits"] + datos["coalescidas"]) / consultas if consultas else 0.0
+        for nombre, q in (("latencia_upstream_p50", 0.50), ("latencia_upstream_p99", 0.99)):
+            datos[nombre] = muestras[min(len(muestras) - 1, int(q * len(muestras)))] if muestras else 0.0
+        return datos
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """
+    Caché compartida por main.py y chatbot_agent.py (persistente si LLM_CACHE_PERSIST=1).
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                store = None
+                if LLM_CACHE_PERSIST:
+                    from state_store import get_state_store
+                    store = get_state_store()
+                _cache = LLMCache(store=store)
+                logging.info(f"Caché de IA: {LLM_CACHE_SIZE} entradas, TTL {LLM_CACHE_TTL:.0f}s")
+    return _cache
@@ -1,18 +1,39 @@
 # main.py
-from flask import Flask, request, jsonify, abort, Response
-from twilio.rest import Client
-import openai
+import time
+_T_INICIO = time.perf_counter()
+
+from flask import Flask, request, jsonify, abort, Response, g
 import os
-import threading
 import logging
 import hmac
 import hashlib
+import socket
+import threading
 from datetime import datetime
 from dotenv import load_dotenv
-from dateutil import parser as dateparser
 
 # Importar utilidades de calendario
-from calendar_utils import get_available_slots, crear_evento_google_calendar
+from calendar_utils import CALENDARIOS, get_available_slots
+from booking import BookingPipeline, SlotInvalido, SlotOcupado
+from broadcast import BroadcastManager
+from calendar_client import get_calendar_manager
+from chatbot_agent import responder_sin_ia
+from conversacion import MemoriaConversacion, PrimerFragmento
+from dispatcher import KeyedDispatcher, Limites, limites_desde_env
+from idempotency import IdempotencyCache
+from intent_router import IntentRouter, puede_ser_fecha
+from llm_cache import get_llm_cache
+import metrics
+from outbound import OutboundQueue, TwilioTransport
+from resiliencia import CircuitoAbierto, breakers, get_breaker
+from scheduler import JobScheduler
+from slot_parser import cargar_dateutil, parsear_slot
+from state_store import get_state_store
+from text_utils import normalizar_texto
+
+# Solo imports: openai, twilio, dateutil y googleapiclient se cargan al primer
+# uso o al precalentar (ver PRODUCCIÓN)
+TIEMPOS_ARRANQUE = {"imports": time.perf_counter() - _T_INICIO}
 
 # ─── CARGA DE VARIABLES DE ENTORNO ─────────────────────────────────────────────
 load_dotenv()
@@ -26,27 +47,134 @@ SUBSCRIBED_USERS       = [u.strip() for u in os.getenv("SUBSCRIBED_USERS", "").s
 EBOOK_LINK             = os.getenv("EBOOK_LINK")
 EBOOK_METODO_LINK      = os.getenv("EBOOK_METODO_LINK")
 CURSO_LINK             = os.getenv("CURSO_LINK")
+METRICS_TOKEN          = os.getenv("METRICS_TOKEN")             # Bearer opcional para /metrics
+OPENAI_TIMEOUT         = float(os.getenv("OPENAI_TIMEOUT", "15"))   # segundos por llamada a la IA
+TWILIO_TIMEOUT         = float(os.getenv("TWILIO_TIMEOUT", "10"))
 
 # ─── CONFIG CLIENTES Y LOGGING ─────────────────────────────────────────────────
-twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-openai.api_key = OPENAI_API_KEY
+outbound = OutboundQueue(
+    TwilioTransport(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_WHATSAPP_NUMBER, timeout=TWILIO_TIMEOUT),
+    workers=int(os.getenv("OUTBOUND_WORKERS", "4")),
+    account_rate=float(os.getenv("TWILIO_RATE", "10")),
+    per_number_rate=float(os.getenv("TWILIO_RATE_POR_NUMERO", "1")),
+)
+outbound.start()
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
 
-# ─── ESTADO TEMPORAL PARA SEGUIMIENTO ──────────────────────────────────────────
-pending_slots    = {}
-paid_users       = set()
-scheduled_users  = set()
-interested_users = {}
+# ─── ESTADO PARA SEGUIMIENTO (compartido entre workers, ver state_store) ───────
+# Claves: teléfono normalizado (normalize_phone)
+estado           = get_state_store()
+PENDING_SLOTS    = "pending_slots"
+PAID_USERS       = "paid_users"
+SCHEDULED_USERS  = "scheduled_users"
+INTERESTED_USERS = "interested_users"
+SLOTS_OFRECIDOS  = "slots_ofrecidos"
+PENDING_TTL      = 24 * 3600
+INTERESTED_TTL   = 48 * 3600
+PURGA_ESTADO_SEG = float(os.getenv("STATE_PURGA_SEG", "600"))
+
+
+def purgar_estado_periodicamente():
+    """
+    Borra las claves vencidas (idempotencia, caché de IA, reservas...) cada
+    PURGA_ESTADO_SEG: una clave solo caduca sola si alguien vuelve a leerla.
+    """
+    while True:
+        time.sleep(PURGA_ESTADO_SEG)
+        try:
+            borradas = estado.purge()
+        except Exception:
+            logging.exception("No se pudo purgar el StateStore")
+            continue
+        if borradas:
+            logging.info(f"StateStore: {borradas} claves vencidas eliminadas")
+
+
+estado.purge()
+threading.Thread(target=purgar_estado_periodicamente, name="purga-estado", daemon=True).start()
+
+# Reservas: conflicto comprobado al instante, escritura en Google por lotes
+# Citas recuperadas tras un reinicio: si Google las rechaza se avisa igual al usuario
+reservas = BookingPipeline(
+    store=estado,
+    on_recuperada=lambda numero, slot, ok, error: reserva_fallida(f"whatsapp:{numero}", slot, ok),
+)
+reservas.start()
+
+# Reintentos de Twilio/WooCommerce: se responden con la respuesta guardada
+idempotencia = IdempotencyCache(store=estado)
+
+# ─── DIFUSIONES DE NUEVO CONTENIDO ─────────────────────────────────────────────
+difusiones = BroadcastManager(
+    lambda phone, mensaje: notificar_nuevo_contenido(phone, mensaje),
+    max_workers=int(os.getenv("BROADCAST_WORKERS", "8")),
+    rate=float(os.getenv("BROADCAST_RATE", "5")),
+)
+
+# ─── MENSAJES ENTRANTES: orden por teléfono, paralelo entre usuarios ─────────────
+entrantes = KeyedDispatcher(
+    max_workers=int(os.getenv("INBOUND_WORKERS", "8")),
+    max_pendientes=int(os.getenv("INBOUND_MAX_PENDIENTES", "10000")),
+)
+limites = Limites(limites_desde_env())
+
+# ─── TAREAS DIFERIDAS (sobreviven a reinicios) ─────────────────────────────────
+RECORDATORIO_VIDEOS_SEG = 8 * 60
+SEGUIMIENTO_EBOOK_SEG   = 24 * 3600
+scheduler = JobScheduler()
+
+# ─── MÉTRICAS (GET /metrics, formato Prometheus) ───────────────────────────────
+metrics.gauge("scheduler_pendientes", "Tareas diferidas pendientes", scheduler.pending_count)
+metrics.gauge("outbound_cola", "Mensajes de WhatsApp en cola de salida", outbound.depth)
+metrics.gauge("outbound_mensajes_total", "Mensajes de salida por resultado",
+              lambda: {k: v for k, v in outbound.metrics().items() if k in
+                       ("encolados", "enviados", "fallidos", "reintentos")},
+              etiqueta="resultado", tipo="counter")
+metrics.gauge("entrantes_pendientes", "Mensajes entrantes en el dispatcher", entrantes.pending)
+metrics.gauge("reservas_pendientes", "Citas esperando escritura en Google Calendar", reservas.pending)
+metrics.gauge("limites_en_uso", "Llamadas simultáneas por dependencia", limites.en_uso, etiqueta="dependencia")
+metrics.gauge("idempotencia_claves", "Entregas recordadas en memoria", idempotencia.size)
+metrics.gauge("idempotencia_reintentos_total", "Reintentos de webhook respondidos sin reprocesar",
+              lambda: idempotencia.replays, tipo="counter")
+metrics.gauge("state_store_claves", "Claves vivas en el StateStore por namespace",
+              lambda: {ns: estado.count(ns) for ns in (PENDING_SLOTS, PAID_USERS, SCHEDULED_USERS,
+                                                       INTERESTED_USERS, SLOTS_OFRECIDOS,
+                                                       BookingPipeline.NS, BookingPipeline.NS_COLA,
+                                                       IdempotencyCache.NS)},
+              etiqueta="ns")
+metrics.gauge("ia_conversaciones", "Teléfonos con historial de IA en memoria", lambda: len(memoria))
+metrics.gauge("llm_cache_entradas", "Respuestas de IA en caché", lambda: get_llm_cache().metrics()["size"])
+metrics.gauge("arranque_segundos", "Tiempos de arranque por fase", lambda: dict(TIEMPOS_ARRANQUE),
+              etiqueta="fase")
+metrics.gauge("llm_cache_hit_rate", "Proporción de consultas de IA resueltas por caché",
+              lambda: get_llm_cache().metrics()["hit_rate"])
+metrics.gauge("breaker_estado", "Circuito por dependencia (0 cerrado, 1 semiabierto, 2 abierto)",
+              lambda: {nombre: b.estado for nombre, b in breakers().items()}, etiqueta="dependencia")
+metrics.gauge("breaker_rechazos_total", "Llamadas rechazadas con el circuito abierto",
+              lambda: {nombre: b.rechazos for nombre, b in breakers().items()},
+              etiqueta="dependencia", tipo="counter")
 
 # ─── APP ───────────────────────────────────────────────────────────────────────
 app = Flask(__name__)
 
+
+@app.before_request
+def _iniciar_cronometro():
+    g.t0 = time.perf_counter()
+
+
+@app.after_request
+def _registrar_peticion(response):
+    ruta = request.url_rule.rule if request.url_rule is not None else "desconocida"
+    metrics.peticion(ruta, request.method, response.status_code, time.perf_counter() - g.t0)
+    return response
+
 # ─── UTILIDADES ─────────────────────────────────────────────────────────────────
-def parse_fecha_usuario(text: str):
-    try:
-        return dateparser.parse(text, dayfirst=True)
-    except Exception:
-        return None
+def parse_fecha_usuario(text: str, ofrecidos=None):
+    """
+    Interpreta la elección de horario; si se le ofrecieron slots, solo devuelve uno de ellos.
+    """
+    return parsear_slot(text, ofrecidos)
 
 
 def normalize_phone(phone: str) -> str:
@@ -65,6 +193,13 @@ def validar_wc_signature(payload: bytes, signature: str) -> bool:
     return hmac.compare_digest(mac, signature)
 
 
+def enviar_whatsapp(to: str, body: str, on_result=None):
+    """
+    Encola un mensaje de WhatsApp; el envío ocurre fuera de la petición.
+    """
+    outbound.enqueue(to, body, on_result=on_result)
+
+
 def send_ebook_method(phone: str):
     msg = (
         "No podemos negarle la salud a nadie, cualquier servicio es un intercambio justo de energía, amor y dedicación. "
@@ -73,65 +208,110 @@ def send_ebook_method(phone: str):
         f"{EBOOK_METODO_LINK}\n\n"
         "Descárgalo gratis."
     )
-    twilio_client.messages.create(
-        body=msg,
-        from_=f"whatsapp:{TWILIO_WHATSAPP_NUMBER}",
-        to=normalize_phone(phone)
-    )
-    logging.info(f"Ebook 'El Método' enviado a {phone}")
+    enviar_whatsapp(normalize_phone(phone), msg)
+    logging.info(f"Ebook 'El Método' encolado para {phone}")
 
 
 def schedule_followup(phone: str):
-    if phone not in paid_users and phone not in scheduled_users:
+    clave = normalize_phone(phone)
+    if not estado.contains(PAID_USERS, clave) and not estado.contains(SCHEDULED_USERS, clave):
         send_ebook_method(phone)
-    interested_users.pop(phone, None)
+    estado.delete(INTERESTED_USERS, clave)
+
+
+def recordar_videos(to: str):
+    enviar_whatsapp(to, "¿Ya viste los videos? Podemos continuar con la reserva.")
+
+
+def cancelar_seguimientos(phone: str):
+    """
+    Cancela recordatorios pendientes de un usuario que ya pagó o agendó.
+    """
+    cancelados = scheduler.cancel(normalize_phone(phone))
+    if cancelados:
+        logging.info(f"{cancelados} seguimientos cancelados para {phone}")
 
 
 def notificar_nuevo_contenido(phone: str, mensaje: str):
-    try:
-        twilio_client.messages.create(
-            body=f"Nuevo contenido publicado:\n{mensaje}",
-            from_=f"whatsapp:{TWILIO_WHATSAPP_NUMBER}",
-            to=normalize_phone(phone)
-        )
-        logging.info(f"Notificación enviada a {phone}")
-    except Exception as e:
-        logging.error(f"Error notificando {phone}: {e}")
+    """
+    Envío síncrono usado por las difusiones; lanza excepción si Twilio falla
+    para que la difusión lo registre como fallido.
+    """
+    outbound.send_now(normalize_phone(phone), f"Nuevo contenido publicado:\n{mensaje}")
+    logging.info(f"Notificación enviada a {phone}")
 
-# ─── RUTAS ──────────────────────────────────────────────────────────────────────
-@app.route("/", methods=["GET","HEAD"], strict_slashes=False)
-def index():
-    return jsonify({"message": "Webhook is alive."}), 200
+scheduler.register("recordar_videos", recordar_videos)
+scheduler.register("schedule_followup", schedule_followup)
+scheduler.start()
 
-@app.route("/incoming", methods=["GET","POST"], strict_slashes=False)
-def incoming_whatsapp():
-    # Verificación GET para Twilio
-    if request.method == "GET":
-        mode = request.args.get("hub.mode")
-        token = request.args.get("hub.verify_token")
-        challenge = request.args.get("hub.challenge")
-        if mode == "subscribe" and token == VERIFY_TOKEN:
-            return Response(challenge, status=200, mimetype='text/plain')
-        return Response('Token inválido', status=403, mimetype='text/plain')
+# ─── CONVERSACIÓN (independiente del servidor: Flask o ASGI) ─────────────────────
+OPENAI_MODEL = "gpt-4o"
+IA_MAX_TOKENS = 500
+# IA_STREAM=1: la primera frase de la respuesta sale por WhatsApp en cuanto llega
+IA_STREAM = os.getenv("IA_STREAM", "1") == "1"
+# Mensaje de sistema fijo: la pregunta va aparte, con rol "user"
+PROMPT_EMILIA = "Eres Emilia, la asistente virtual de AvatarMexchange."
+IA_CORTADA = "Perdona, se me cortó la respuesta. ¿Me repites la pregunta en un momento?"
+memoria = MemoriaConversacion(PROMPT_EMILIA)
 
-    # POST entrante
-    frm = request.form.get("From", "")
-    body = request.form.get("Body", "").strip()
+# Reglas por prioridad; "método" cubre también "metodo" (se comparan sin acentos)
+ROUTER = IntentRouter([
+    ("informes",    ("informes","más información","terapia","consulta","enfermedad"), False),
+    ("guia_compra", ("sí","me gustaría"), True),
+    ("metodo",      ("método",), False),
+    ("curso",       ("curso",), False),
+])
+
+
+def verificar_suscripcion(args):
+    """
+    Verificación hub.challenge de Twilio/Facebook. Devuelve (texto, status).
+    """
+    mode = args.get("hub.mode")
+    token = args.get("hub.verify_token")
+    challenge = args.get("hub.challenge")
+    if mode == "subscribe" and token == VERIFY_TOKEN:
+        return challenge, 200
+    return 'Token inválido', 403
+
+
+def resolver_mensaje(frm: str, body: str):
+    """
+    Aplica las reglas de conversación a un mensaje entrante.
+    Devuelve (respuesta, consulta_ia); si respuesta es None hay que pasar consulta_ia a la IA.
+    """
     phone = frm.replace("whatsapp:", "")
+    clave = normalize_phone(phone)
     text = body.lower()
+    normalizado = normalizar_texto(body)
+    intent = ROUTER.clasificar_normalizado(normalizado)
 
     # 1) Confirmación slot pendiente
-    if phone in pending_slots:
-        slot = pending_slots.pop(phone)
-        crear_evento_google_calendar(phone, slot, gratuito=False, description=body)
-        scheduled_users.add(phone)
-        msg = f"Tu cita ha sido agendada para {slot} con padecimiento: {body}. ¡Nos vemos pronto!"
-        twilio_client.messages.create(body=msg, from_=f"whatsapp:{TWILIO_WHATSAPP_NUMBER}", to=frm)
-        return "", 200
+    slot = estado.pop(PENDING_SLOTS, clave)
+    if slot:
+        try:
+            with limites("calendar"):
+                terapeuta = reservas.reservar(phone, slot, description=body,
+                                              on_result=lambda ok, error: reserva_fallida(frm, slot, ok))
+        except SlotOcupado:
+            return ofrecer_otros_horarios(clave, f"Lo siento, el horario {slot} ya fue reservado."), None
+        except SlotInvalido:
+            return ofrecer_otros_horarios(clave, f"El horario {slot} no está en la agenda."), None
+        except Exception:
+            # Calendar caído o saturado: se conserva la elección para reintentar
+            logging.exception(f"No se pudo reservar {slot} para {phone}")
+            estado.set(PENDING_SLOTS, clave, slot, ttl=PENDING_TTL)
+            return ("No pude confirmar tu cita en este momento. "
+                    "Por favor envíame de nuevo tu padecimiento en unos minutos."), None
+        estado.set(SCHEDULED_USERS, clave)
+        estado.delete(SLOTS_OFRECIDOS, clave)
+        cancelar_seguimientos(phone)
+        con = f" con {terapeuta.capitalize()}" if len(CALENDARIOS) > 1 else ""
+        return f"Tu cita ha sido agendada para {slot}{con} con padecimiento: {body}. ¡Nos vemos pronto!", None
 
     # 2) Flujo 'informes'
-    if any(k in text for k in ("informes","más información","terapia","consulta","enfermedad")):
-        interested_users[phone] = datetime.now()
+    if intent == "informes":
+        estado.set(INTERESTED_USERS, clave, datetime.now().isoformat(), ttl=INTERESTED_TTL)
         msg = (
             "Hola 👋, soy Emilia tu asistente en *Avatarmexchange*.\n"
             "Mira estos videos para entender el método y tratamiento:\n"
@@ -140,25 +320,21 @@ def incoming_whatsapp():
             f"• Curso: https://www.youtube.com/watch?v=fRWlGnDlGAY\n\n"
             "En 8 min pregunto si los viste para continuar."
         )
-        twilio_client.messages.create(body=msg, from_=f"whatsapp:{TWILIO_WHATSAPP_NUMBER}", to=frm)
-        threading.Timer(8*60, lambda: twilio_client.messages.create(
-            body="¿Ya viste los videos? Podemos continuar con la reserva.",
-            from_=f"whatsapp:{TWILIO_WHATSAPP_NUMBER}", to=frm
-        )).start()
-        threading.Timer(24*3600, lambda: schedule_followup(phone)).start()
-        return "", 200
-
-    # 3) Selección de fecha
-    fecha = parse_fecha_usuario(text)
+        scheduler.schedule("recordar_videos", RECORDATORIO_VIDEOS_SEG, {"to": frm}, clave=clave)
+        scheduler.schedule("schedule_followup", SEGUIMIENTO_EBOOK_SEG, {"phone": phone}, clave=clave)
+        return msg, None
+
+    # 3) Selección de fecha (solo si el texto puede contener una)
+    fecha = None
+    if puede_ser_fecha(normalizado):
+        fecha = parse_fecha_usuario(text, estado.get(SLOTS_OFRECIDOS, clave))
     if fecha:
         slot = fecha.strftime("%Y-%m-%d %H:%M")
-        pending_slots[phone] = slot
-        resp = f"Has seleccionado {slot}. Por favor indícame tu padecimiento."
-        twilio_client.messages.create(body=resp, from_=f"whatsapp:{TWILIO_WHATSAPP_NUMBER}", to=frm)
-        return "", 200
+        estado.set(PENDING_SLOTS, clave, slot, ttl=PENDING_TTL)
+        return f"Has seleccionado {slot}. Por favor indícame tu padecimiento.", None
 
     # 4) Guía de compra
-    if text in ("sí","si","me gustaría","me gustaria"):
+    if intent == "guia_compra":
         guia = (
             "Te guío paso a paso:\n"
             "1) Ve a https://avatarmexchange.com\n"
@@ -167,47 +343,246 @@ def incoming_whatsapp():
             "4) Elige Mercado Pago u OXXO\n"
             "5) Completa y confirma\n"
         )
-        twilio_client.messages.create(body=guia, from_=f"whatsapp:{TWILIO_WHATSAPP_NUMBER}", to=frm)
-        return "", 200
+        return guia, None
 
     # 5) Ebook 'El Método'
-    if "método" in text or "metodo" in text:
-        msg = f"El ebook ‘El Método’ te permite sanar...\n{EBOOK_METODO_LINK}\nResponde 'sí' si quieres guía."
-        twilio_client.messages.create(body=msg, from_=f"whatsapp:{TWILIO_WHATSAPP_NUMBER}", to=frm)
-        return "", 200
+    if intent == "metodo":
+        return f"El ebook ‘El Método’ te permite sanar...\n{EBOOK_METODO_LINK}\nResponde 'sí' si quieres guía.", None
 
     # 6) Curso
-    if "curso" in text:
-        msg = f"El curso 'Medicina de Quinta Dimensión'...\n{CURSO_LINK}\nResponde 'sí' si quieres guía."
-        twilio_client.messages.create(body=msg, from_=f"whatsapp:{TWILIO_WHATSAPP_NUMBER}", to=frm)
-        return "", 200
+    if intent == "curso":
+        return f"El curso 'Medicina de Quinta Dimensión'...\n{CURSO_LINK}\nResponde 'sí' si quieres guía.", None
 
     # 7) Fallback IA
-    prompt = f"Eres Emilia, la asistente virtual de AvatarMexchange.\nUsuario: {text}\nEmilia:"
+    return None, text
+
+
+def cliente_openai():
+    import openai
+    openai.api_key = OPENAI_API_KEY
+    return openai
+
+
+def llamar_openai(mensajes, fragmento=None) -> str:
+    """
+    Chat completion; con `fragmento` (PrimerFragmento) la respuesta llega en
+    streaming y la primera frase se adelanta mientras se genera el resto.
+    """
+    openai = cliente_openai()
+    with metrics.medir("openai"):
+        if fragmento is None:
+            ai_resp = openai.ChatCompletion.create(
+                model=OPENAI_MODEL,
+                messages=mensajes,
+                max_tokens=IA_MAX_TOKENS,
+                temperature=0.7,
+                request_timeout=OPENAI_TIMEOUT,
+            )
+            return ai_resp.choices[0].message.content.strip()
+        t0 = time.perf_counter()
+        for chunk in openai.ChatCompletion.create(model=OPENAI_MODEL, messages=mensajes,
+                                                  max_tokens=IA_MAX_TOKENS, temperature=0.7, stream=True,
+                                                  request_timeout=OPENAI_TIMEOUT):
+            delta = chunk.choices[0].delta.get("content")
+            if delta:
+                if t0 is not None:
+                    metrics.observar("ia_primer_fragmento_segundos", time.perf_counter() - t0)
+                    t0 = None
+                fragmento.agregar(delta)
+    return fragmento.texto().strip()
+
+
+def _llamar_openai_limitado(mensajes, fragmento=None) -> str:
+    with limites("openai"), get_breaker("openai"):
+        return llamar_openai(mensajes, fragmento)
+
+
+def completar_ia(frm: str, text: str) -> str:
+    """
+    Respuesta de la IA con el contexto reciente de la conversación. Devuelve
+    lo que falta enviar: si el streaming adelantó la primera frase, solo el resto.
+    Solo el primer turno (sin historial) pasa por la caché de respuestas.
+    """
+    clave = normalize_phone(frm)
+    mensajes = memoria.mensajes(clave, text)
+    fragmento = PrimerFragmento(lambda parte: enviar_whatsapp(frm, parte)) if IA_STREAM else None
     try:
-        ai_resp = openai.ChatCompletion.create(
-            model="gpt-4o",
-            messages=[{"role":"assistant","content":prompt}],
-            max_tokens=500,
-            temperature=0.7
-        )
-        respuesta = ai_resp.choices[0].message.content.strip()
-    except Exception:
+        if len(mensajes) == 2:
+            respuesta = get_llm_cache().get_or_compute(
+                PROMPT_EMILIA, text, lambda: _llamar_openai_limitado(mensajes, fragmento)
+            )
+        else:
+            respuesta = _llamar_openai_limitado(mensajes, fragmento)
+    except Exception as e:
+        return respuesta_degradada(text, fragmento, e)
+    memoria.registrar(clave, text, respuesta)
+    return fragmento.resto(respuesta) if fragmento is not None else respuesta
+
+
+def respuesta_degradada(text: str, fragmento, error) -> str:
+    """
+    Sin IA (caída, timeout o circuito abierto) se contesta con las reglas;
+    si el streaming ya envió la primera frase, solo una disculpa breve.
+    Debe llamarse desde el `except` que capturó `error`.
+    """
+    if not isinstance(error, CircuitoAbierto):
         logging.exception("OpenAI error")
-        respuesta = "Lo siento, tuve un error con mi IA."
-    twilio_client.messages.create(body=respuesta, from_=f"whatsapp:{TWILIO_WHATSAPP_NUMBER}", to=frm)
+    if fragmento is not None and fragmento.enviado:
+        metrics.incrementar("degradado_total", tipo="ia_cortada")
+        return IA_CORTADA
+    metrics.incrementar("degradado_total", tipo="ia_reglas")
+    return responder_sin_ia(text)
+
+
+def ofrecer_otros_horarios(clave: str, aviso: str) -> str:
+    with limites("calendar"):
+        slots = get_available_slots()
+    estado.set(SLOTS_OFRECIDOS, clave, slots, ttl=PENDING_TTL)
+    return f"{aviso} Horarios disponibles:\n{formatear_horarios(slots)}"
+
+
+def formatear_horarios(slots) -> str:
+    lista = "\n".join(f"{i}) 🕒 {s}" for i, s in enumerate(slots, 1))
+    return f"{lista}\nResponde con el número o la fecha y hora que prefieras."
+
+
+def reserva_fallida(frm: str, slot: str, ok: bool):
+    """
+    Callback de BookingPipeline: si Google rechazó la cita, se avisa al usuario.
+    """
+    if ok:
+        return
+    clave = normalize_phone(frm)
+    estado.delete(SCHEDULED_USERS, clave)
+    enviar_whatsapp(frm, ofrecer_otros_horarios(clave, f"No pudimos confirmar tu cita del {slot}."))
+
+
+def atender_mensaje(frm: str, body: str):
+    respuesta, consulta = resolver_mensaje(frm, body)
+    if respuesta is None:
+        respuesta = completar_ia(frm, consulta)
+    if respuesta:
+        enviar_whatsapp(frm, respuesta)
+
+
+def encolar_mensaje(frm: str, body: str):
+    """
+    Pasa el mensaje al dispatcher (en orden tras los previos del mismo teléfono).
+    """
+    if not entrantes.submit(normalize_phone(frm), atender_mensaje, frm, body):
+        logging.warning(f"Dispatcher saturado, mensaje de {frm} rechazado")
+        return "", 503
     return "", 200
 
+
+def procesar_pedido(data: dict):
+    """
+    Pedido de WooCommerce ya validado. Devuelve (json, status).
+    """
+    billing = data.get("billing", {})
+    items   = data.get("line_items", [])
+    phone   = billing.get("phone", "")
+    name    = billing.get("first_name", "Cliente")
+    if not phone:
+        return {"status":"missing phone"}, 200
+    to_wh = normalize_phone(phone)
+    estado.set(PAID_USERS, to_wh)
+    cancelar_seguimientos(phone)
+    if any("Terapia" in i.get("name","") for i in items):
+        with limites("calendar"):
+            slots = get_available_slots()
+        estado.set(SLOTS_OFRECIDOS, to_wh, slots, ttl=PENDING_TTL)
+        msg = f"Hola {name}, gracias por tu compra de terapia. Horarios:\n{formatear_horarios(slots)}"
+    else:
+        msg = f"Hola {name}, ¡gracias por tu compra! E-book: {EBOOK_LINK}"
+    enviar_whatsapp(to_wh, msg)
+    return {"status":"ok"}, 200
+
+
+def crear_difusion(data: dict):
+    """
+    Lanza la difusión de un post nuevo. Devuelve (json, status).
+    """
+    titulo = data.get("title")
+    enlace = data.get("permalink")
+    if not titulo or not enlace:
+        return {"status":"missing data"}, 200
+    mensaje = f"{titulo}\n{enlace}"
+    job = difusiones.crear(SUBSCRIBED_USERS, mensaje)
+    return {"status":"aceptado","job_id":job.id,"count":len(job.destinatarios)}, 202
+
+
+def clave_mensaje(form) -> str:
+    sid = form.get("MessageSid")
+    return f"twilio:{sid}" if sid else None
+
+
+def clave_pedido(headers, data: dict) -> str:
+    if data.get("id"):
+        return f"wc:pedido:{data['id']}"
+    entrega = headers.get("X-WC-Webhook-Delivery-ID")
+    return f"wc:entrega:{entrega}" if entrega else None
+
+
+def procesar_idempotente(clave, fn, *args):
+    """
+    Ejecuta fn(*args) -> (json, status) una sola vez por clave; los reintentos
+    reciben la respuesta guardada sin repetir llamadas externas.
+    """
+    if not clave:
+        return fn(*args)
+    nuevo, previa = idempotencia.begin(clave)
+    if not nuevo:
+        logging.info(f"Entrega repetida {clave}")
+        return tuple(previa) if previa else ("", 200)
+    try:
+        resultado = fn(*args)
+    except Exception:
+        idempotencia.fail(clave)
+        raise
+    if resultado[1] >= 500:
+        idempotencia.fail(clave)
+    else:
+        idempotencia.complete(clave, list(resultado))
+    return resultado
+
+
+def wp_secret_valido(hdr: str) -> bool:
+    return not WP_WEBHOOK_SECRET or hdr == WP_WEBHOOK_SECRET
+
+
+def metricas_autorizadas(authorization: str) -> bool:
+    return not METRICS_TOKEN or hmac.compare_digest(authorization, f"Bearer {METRICS_TOKEN}")
+
+# ─── RUTAS ──────────────────────────────────────────────────────────────────────
+@app.route("/", methods=["GET","HEAD"], strict_slashes=False)
+def index():
+    return jsonify({"message": "Webhook is alive."}), 200
+
+@app.route("/metrics", methods=["GET"])
+def metricas():
+    if not metricas_autorizadas(request.headers.get("Authorization", "")):
+        abort(403)
+    return Response(metrics.exportar(), content_type=metrics.CONTENT_TYPE)
+
+@app.route("/incoming", methods=["GET","POST"], strict_slashes=False)
+def incoming_whatsapp():
+    # Verificación GET para Twilio
+    if request.method == "GET":
+        texto, status = verificar_suscripcion(request.args)
+        return Response(texto, status=status, mimetype='text/plain')
+
+    # POST entrante
+    frm = request.form.get("From", "")
+    body = request.form.get("Body", "").strip()
+    return procesar_idempotente(clave_mensaje(request.form), encolar_mensaje, frm, body)
+
 @app.route("/webhook", methods=["GET","POST","HEAD"], strict_slashes=False)
 def webhook_woocommerce():
     # Verificación GET/HEAD para Facebook y Twilio
     if request.method in ("GET","HEAD"):
-        mode = request.args.get("hub.mode")
-        token = request.args.get("hub.verify_token")
-        challenge = request.args.get("hub.challenge")
-        if mode == "subscribe" and token == VERIFY_TOKEN:
-            return Response(challenge, status=200, mimetype='text/plain')
-        return Response('Token inválido', status=403, mimetype='text/plain')
+        texto, status = verificar_suscripcion(request.args)
+        return Response(texto, status=status, mimetype='text/plain')
 
     # POST WooCommerce
     data = request.get_json(silent=True)
@@ -217,40 +592,112 @@ def webhook_woocommerce():
     signature = request.headers.get("X-WC-Webhook-Signature", "")
     if not validar_wc_signature(payload, signature):
         abort(403)
-    billing = data.get("billing", {})
-    items   = data.get("line_items", [])
-    phone   = billing.get("phone", "")
-    name    = billing.get("first_name", "Cliente")
-    if not phone:
-        return jsonify({"status":"missing phone"}), 200
-    to_wh = normalize_phone(phone)
-    paid_users.add(phone)
-    if any("Terapia" in i.get("name","") for i in items):
-        slots = get_available_slots()
-        lista = "\n".join(f"🕒 {s}" for s in slots)
-        msg = f"Hola {name}, gracias por tu compra de terapia. Horarios:\n{lista}"
-    else:
-        msg = f"Hola {name}, ¡gracias por tu compra! E-book: {EBOOK_LINK}"
-    twilio_client.messages.create(body=msg, from_=f"whatsapp:{TWILIO_WHATSAPP_NUMBER}", to=to_wh)
-    return jsonify({"status":"ok"}), 200
+    resp, status = procesar_idempotente(clave_pedido(request.headers, data), procesar_pedido, data)
+    return jsonify(resp), status
+
+def validar_wp_secret():
+    if not wp_secret_valido(request.headers.get("X-WP-Webhook-Secret", "")):
+        abort(403)
+
 
 @app.route("/nuevo_contenido", methods=["POST"], strict_slashes=False)
 def nuevo_contenido():
     data = request.get_json(force=True)
-    if WP_WEBHOOK_SECRET:
-        hdr = request.headers.get("X-WP-Webhook-Secret", "")
-        if hdr != WP_WEBHOOK_SECRET:
-            abort(403)
-    titulo = data.get("title")
-    enlace = data.get("permalink")
-    if not titulo or not enlace:
-        return jsonify({"status":"missing data"}), 200
-    mensaje = f"{titulo}\n{enlace}"
-    for user in SUBSCRIBED_USERS:
-        notificar_nuevo_contenido(user, mensaje)
-    return jsonify({"status":"enviado","count":len(SUBSCRIBED_USERS)}), 200
+    validar_wp_secret()
+    resp, status = crear_difusion(data)
+    return jsonify(resp), status
+
+@app.route("/nuevo_contenido/<job_id>", methods=["GET"])
+def estado_difusion(job_id):
+    job = difusiones.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job.estado()), 200
+
+@app.route("/nuevo_contenido/<job_id>/reintentar", methods=["POST"])
+def reintentar_difusion(job_id):
+    validar_wp_secret()
+    reintentados = difusiones.reintentar(job_id)
+    if reintentados is None:
+        abort(404)
+    return jsonify({"status":"reintentando","count":reintentados}), 202
 
 # ─── PRODUCCIÓN ────────────────────────────────────────────────────────────────
+# SERVER_MODE=sync  -> waitress + Flask (por defecto)
+# SERVER_MODE=async -> uvicorn + asgi_app (handlers en un event loop)
+# PRECALENTAR=1     -> carga los clientes pesados en segundo plano una vez
+#                      abierto el puerto (con gunicorn: llamar a
+#                      precalentar_en_segundo_plano() en post_worker_init)
+SERVER_MODE = os.getenv("SERVER_MODE", "sync")
+PRECALENTAR = os.getenv("PRECALENTAR", "1") == "1"
+
+TIEMPOS_ARRANQUE["modulo"] = time.perf_counter() - _T_INICIO
+logging.info(f"main importado en {TIEMPOS_ARRANQUE['modulo'] * 1000:.0f} ms "
+             f"(imports {TIEMPOS_ARRANQUE['imports'] * 1000:.0f} ms)")
+
+PRECALENTADOS = (
+    ("openai", cliente_openai),
+    ("twilio", lambda: getattr(outbound.transport, "client", None)),
+    ("dateutil", cargar_dateutil),
+    ("google_calendar", lambda: get_calendar_manager().precalentar()),
+)
+
+
+def precalentar():
+    """
+    Importa y construye los clientes diferidos para que la primera petición
+    que los use no pague el coste. Cada paso es independiente.
+    """
+    for nombre, fn in PRECALENTADOS:
+        t0 = time.perf_counter()
+        try:
+            fn()
+        except Exception:
+            logging.exception(f"No se pudo precalentar {nombre}")
+            continue
+        TIEMPOS_ARRANQUE[f"precalentar_{nombre}"] = time.perf_counter() - t0
+    TIEMPOS_ARRANQUE["listo"] = time.perf_counter() - _T_INICIO
+    logging.info("Arranque: " + ", ".join(f"{k} {v * 1000:.0f} ms" for k, v in TIEMPOS_ARRANQUE.items()))
+
+
+def _esperar_puerto(port, timeout=60):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def precalentar_en_segundo_plano(port=None):
+    """
+    Precalienta en un hilo; con `port`, espera antes a que el servidor escuche.
+    """
+    def tarea():
+        if port is not None and _esperar_puerto(port):
+            TIEMPOS_ARRANQUE["puerto"] = time.perf_counter() - _T_INICIO
+        precalentar()
+
+    threading.Thread(target=tarea, name="precalentar", daemon=True).start()
+
+
+def servir(port=None):
+    port = port or int(os.getenv("PORT", 5000))
+    if PRECALENTAR:
+        precalentar_en_segundo_plano(port)
+    if SERVER_MODE == "async":
+        import sys
+        import uvicorn
+        # asgi_app hace "import main": que reutilice este módulo en lugar de reimportarlo
+        sys.modules.setdefault("main", sys.modules[__name__])
+        from asgi_app import app as asgi
+        uvicorn.run(asgi, host="0.0.0.0", port=port)
+    else:
+        from waitress import serve
+        serve(app, host="0.0.0.0", port=port, threads=int(os.getenv("WAITRESS_THREADS", "4")))
+
+
 if __name__ == "__main__":
-    from waitress import serve
-    serve(app, host="0.0.0.0", port=int(os.getenv("PORT", 5000)))
+    servir()
@@ -0,0 +1,186 @@
+# metrics.py
+
+import bisect
+import threading
+import time
+
+# Límites de los histogramas de latencia (segundos)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _etiquetas(pares):
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in pares) + "}"
+
+
+class Registro:
+    """
+    Histogramas y contadores agregados por hilo, exportados en formato Prometheus.
+
+    Cada hilo escribe solo en su propia tabla (sin locks en el camino
+    caliente); `exportar` suma las tablas de todos los hilos al leer. Los
+    gauges son funciones que se evalúan en cada lectura.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._local = threading.local()
+        self._tablas = []               # una tabla por hilo: (nombre, etiquetas) -> valores
+        self._tipos = {}                # nombre -> (tipo, ayuda)
+        self._gauges = {}               # nombre -> (tipo, ayuda, fn, etiqueta)
+        self._lock = threading.Lock()
+
+    def _tabla(self):
+        tabla = getattr(self._local, "tabla", None)
+        if tabla is None:
+            tabla = self._local.tabla = {}
+            with self._lock:
+                self._tablas.append(tabla)
+        return tabla
+
+    def describir(self, nombre, tipo, ayuda):
+        self._tipos[nombre] = (tipo, ayuda)
+
+    def observar(self, nombre, segundos, **etiquetas):
+        """
+        Suma una observación al histograma `nombre`.
+        """
+        tabla = self._tabla()
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        valores = tabla.get(clave)
+        if valores is None:
+            # Un contador por bucket (el último es +Inf) y la suma al final
+            valores = tabla[clave] = [0] * (len(self.buckets) + 1) + [0.0]
+            self._tipos.setdefault(nombre, ("histogram", nombre))
+        valores[bisect.bisect_left(self.buckets, segundos)] += 1
+        valores[-1] += segundos
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        tabla = self._tabla()
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        valores = tabla.get(clave)
+        if valores is None:
+            valores = tabla[clave] = [0]
+            self._tipos.setdefault(nombre, ("counter", nombre))
+        valores[0] += valor
+
+    def peticion(self, ruta, metodo, status, segundos):
+        """
+        Registra una petición HTTP atendida (Flask o ASGI).
+        """
+        self.observar("http_peticion_segundos", segundos, ruta=ruta, metodo=metodo, status=str(status))
+        if status >= 500:
+            self.incrementar("http_errores_total", ruta=ruta, status=str(status))
+
+    def gauge(self, nombre, ayuda, fn, etiqueta=None, tipo="gauge"):
+        """
+        Registra un valor leído al exportar. Si `etiqueta` no es None, `fn`
+        devuelve un dict {valor_etiqueta: número}.
+        """
+        with self._lock:
+            self._gauges[nombre] = (tipo, ayuda, fn, etiqueta)
+
+    def medir(self, dependencia):
+        """
+        `with medir("openai"): ...` registra latencia y errores de la llamada.
+        """
+        return _Medicion(self, dependencia)
+
+    # ─── EXPORTACIÓN ──────────────────────────────────────────────────────────
+    def _sumar(self):
+        with self._lock:
+            tablas = list(self._tablas)
+        total = {}
+        for tabla in tablas:
+            for clave, valores in list(tabla.items()):
+                acumulado = total.get(clave)
+                if acumulado is None:
+                    total[clave] = list(valores)
+                else:
+                    for i, v in enumerate(valores):
+                        acumulado[i] += v
+        return total
+
+    def exportar(self):
+        """
+        Texto en formato de exposición de Prometheus.
+        """
+        por_nombre = {}
+        for (nombre, pares), valores in sorted(self._sumar().items()):
+            por_nombre.setdefault(nombre, []).append((pares, valores))
+
+        lineas = []
+        for nombre, series in por_nombre.items():
+            tipo, ayuda = self._tipos.get(nombre, ("untyped", nombre))
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} {tipo}")
+            for pares, valores in series:
+                if tipo != "histogram":
+                    lineas.append(f"{nombre}{_etiquetas(pares)} {valores[0]}")
+                    continue
+                acumulado = 0
+                for limite, n in zip(self.buckets + ("+Inf",), valores):
+                    acumulado += n
+                    lineas.append(f"{nombre}_bucket{_etiquetas(pares + (('le', limite),))} {acumulado}")
+                lineas.append(f"{nombre}_sum{_etiquetas(pares)} {valores[-1]}")
+                lineas.append(f"{nombre}_count{_etiquetas(pares)} {acumulado}")
+
+        with self._lock:
+            gauges = sorted(self._gauges.items())
+        for nombre, (tipo, ayuda, fn, etiqueta) in gauges:
+            try:
+                valor = fn()
+            except Exception:
+                continue
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} {tipo}")
+            if etiqueta is None:
+                lineas.append(f"{nombre} {valor}")
+            else:
+                for k, v in sorted(valor.items()):
+                    lineas.append(f"{nombre}{_etiquetas(((etiqueta, k),))} {v}")
+        return "\n".join(lineas) + "\n"
+
+
+class _Medicion:
+    __slots__ = ("registro", "dependencia", "t0")
+
+    def __init__(self, registro, dependencia):
+        self.registro = registro
+        self.dependencia = dependencia
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, exc, tb):
+        self.registro.observar("dependencia_segundos", time.perf_counter() - self.t0,
+                               dependencia=self.dependencia)
+        if tipo is not None:
+            self.registro.incrementar("dependencia_errores_total", dependencia=self.dependencia,
+                                      error=tipo.__name__)
+        return False
+
+
+registro = Registro()
+registro.describir("dependencia_segundos", "histogram", "Latencia de llamadas a servicios externos")
+registro.describir("dependencia_errores_total", "counter", "Errores en llamadas a servicios externos")
+registro.describir("ia_primer_fragmento_segundos", "histogram", "Espera hasta el primer fragmento de la IA en streaming")
+registro.describir("outbound_entrega_segundos", "histogram", "Desde que se encola un mensaje de WhatsApp hasta que Twilio lo acepta")
+registro.describir("http_peticion_segundos", "histogram", "Latencia de las rutas HTTP")
+registro.describir("http_errores_total", "counter", "Respuestas HTTP 5xx por ruta")
+registro.describir("degradado_total", "counter", "Respuestas degradadas por tipo (sin IA, IA cortada, horarios en caché)")
+registro.describir("cobertura_total", "counter", "Peticiones cubiertas con una segunda copia por lentitud")
+
+medir = registro.medir
+observar = registro.observar
+incrementar = registro.incrementar
+peticion = registro.peticion
+gauge = registro.gauge
+exportar = registro.exportar
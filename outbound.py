@@ -0,0 +1,299 @@
+# outbound.py
+
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+from metrics import medir, observar
+from resiliencia import CircuitoAbierto, get_breaker
+
+
+class TokenBucket:
+    """
+    Limitador de tasa: `rate` tokens por segundo con ráfagas de hasta `capacity`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _rellenar(self):
+        ahora = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (ahora - self._ultimo) * self.rate)
+        self._ultimo = ahora
+
+    def try_acquire(self, tokens=1.0):
+        """
+        Toma tokens si hay; si no, devuelve los segundos que faltan para tenerlos.
+        """
+        with self._lock:
+            self._rellenar()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def lleno(self, ahora=None):
+        """
+        True si ya recuperó toda la capacidad (equivale a un bucket nuevo).
+        """
+        with self._lock:
+            ahora = time.monotonic() if ahora is None else ahora
+            return self._tokens + (ahora - self._ultimo) * self.rate >= self.capacity
+
+    def acquire(self, tokens=1.0):
+        while True:
+            espera = self.try_acquire(tokens)
+            if espera <= 0:
+                return
+            time.sleep(espera)
+
+
+class TwilioTransport:
+    """
+    Envío real por Twilio reutilizando conexiones HTTP (requests.Session con pool).
+    El SDK de twilio se importa y el cliente se crea en el primer envío.
+    """
+
+    def __init__(self, account_sid, auth_token, from_number, timeout=10):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.from_ = f"whatsapp:{from_number}"
+        self.timeout = timeout
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from twilio.http.http_client import TwilioHttpClient
+                    from twilio.rest import Client
+                    self._client = Client(
+                        self.account_sid, self.auth_token,
+                        http_client=TwilioHttpClient(pool_connections=True, timeout=self.timeout),
+                    )
+        return self._client
+
+    def send(self, to, body):
+        with medir("twilio"):
+            return self.client.messages.create(body=body, from_=self.from_, to=to).sid
+
+
+class _Mensaje:
+    __slots__ = ("to", "body", "on_result", "encolado", "intentos")
+
+    def __init__(self, to, body, on_result):
+        self.to = to
+        self.body = body
+        self.on_result = on_result
+        self.encolado = time.monotonic()
+        self.intentos = 0
+
+
+def _reintentable(exc):
+    status = getattr(exc, "status", None)
+    return status is None or status == 429 or status >= 500
+
+
+class OutboundQueue:
+    """
+    Cola de salida de mensajes de WhatsApp.
+
+    Los handlers encolan y responden de inmediato; un pool de workers envía
+    respetando un límite por cuenta y otro por número destino, y reintenta con
+    backoff exponencial los errores transitorios (red, 429, 5xx). Con el
+    circuito "twilio" abierto los mensajes esperan en la cola sin gastar intentos.
+
+    Cada número tiene su propia cola FIFO y solo su primer mensaje puede
+    enviarse: los reintentos y esperas se hacen en la cabeza, así que un
+    mismo destinatario recibe los mensajes en el orden en que se encolaron.
+    """
+
+    def __init__(self, transport, workers=4, account_rate=10.0, per_number_rate=1.0,
+                 max_retries=4, backoff_base=1.0):
+        self.transport = transport
+        self.breaker = get_breaker("twilio")
+        self.workers = workers
+        self.account_bucket = TokenBucket(account_rate)
+        self.per_number_rate = per_number_rate
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self._buckets = {}              # to -> TokenBucket
+        self._colas = {}                # to -> deque de _Mensaje, en orden de llegada
+        self._heap = []                 # [(listo_en, seq, to)]: números cuya cabeza espera turno
+        self._seq = itertools.count()
+        self._pendientes = 0
+        self._proximo_barrido = 0.0
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stop = False
+        self._contadores = {"encolados": 0, "enviados": 0, "fallidos": 0, "reintentos": 0}
+
+    # ─── API ──────────────────────────────────────────────────────────────────
+    def enqueue(self, to, body, on_result=None):
+        """
+        Encola un mensaje. `on_result(ok, error)` se llama al entregarse o descartarse.
+        """
+        with self._cond:
+            cola = self._colas.get(to)
+            if cola is None:
+                cola = self._colas[to] = deque()
+                self._programar(to, 0.0)
+            # Si ya había cola, su cabeza está programada o enviándose
+            cola.append(_Mensaje(to, body, on_result))
+            self._pendientes += 1
+            self._contadores["encolados"] += 1
+
+    def send_now(self, to, body):
+        """
+        Envío síncrono (difusiones) con el mismo límite de cuenta y circuito.
+        """
+        self.account_bucket.acquire()
+        with self.breaker:
+            return self.transport.send(to, body)
+
+    def depth(self):
+        with self._cond:
+            return self._pendientes
+
+    def metrics(self):
+        with self._cond:
+            return dict(self._contadores, depth=self._pendientes)
+
+    # ─── CICLO DE VIDA ────────────────────────────────────────────────────────
+    def start(self):
+        if self._threads:
+            return
+        self._stop = False
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"outbound-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout=5):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    # ─── INTERNOS ─────────────────────────────────────────────────────────────
+    def _programar(self, to, retraso):
+        """
+        La cabeza de la cola de `to` podrá enviarse dentro de `retraso` segundos.
+        """
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + retraso, next(self._seq), to))
+            self._cond.notify()
+
+    def _siguiente(self):
+        """
+        Número con la cabeza lista y ese mensaje; mientras lo tiene un worker,
+        el número no está en el heap y nadie más le envía.
+        """
+        with self._cond:
+            while not self._stop:
+                if self._heap:
+                    espera = self._heap[0][0] - time.monotonic()
+                    if espera <= 0:
+                        to = heapq.heappop(self._heap)[2]
+                        return to, self._colas[to][0]
+                    self._cond.wait(espera)
+                else:
+                    self._cond.wait()
+            return None, None
+
+    def _avanzar(self, to):
+        """
+        Quita la cabeza ya resuelta (entregada o descartada) y programa la siguiente.
+        """
+        with self._cond:
+            cola = self._colas[to]
+            cola.popleft()
+            self._pendientes -= 1
+            if cola:
+                self._programar(to, 0.0)
+            else:
+                del self._colas[to]
+                self._barrer_buckets()
+
+    def _barrer_buckets(self, cada=60.0):
+        """
+        Debe llamarse con self._cond tomado. Olvida los buckets de números sin
+        mensajes pendientes que ya se rellenaron: uno nuevo sería idéntico.
+        """
+        ahora = time.monotonic()
+        if ahora < self._proximo_barrido:
+            return
+        self._proximo_barrido = ahora + cada
+        for to in [t for t, b in self._buckets.items() if t not in self._colas and b.lleno(ahora)]:
+            del self._buckets[to]
+
+    def _bucket(self, to):
+        bucket = self._buckets.get(to)
+        if bucket is None:
+            bucket = self._buckets.setdefault(to, TokenBucket(self.per_number_rate))
+        return bucket
+
+    def _worker(self):
+        while True:
+            to, msg = self._siguiente()
+            if msg is None:
+                return
+            # Límite por número: la cabeza espera su turno sin bloquear al worker
+            espera = self._bucket(to).try_acquire()
+            if espera > 0:
+                self._programar(to, espera)
+                continue
+            self.account_bucket.acquire()
+            self._enviar(msg)
+
+    def _enviar(self, msg):
+        msg.intentos += 1
+        try:
+            with self.breaker:
+                self.transport.send(msg.to, msg.body)
+        except CircuitoAbierto:
+            msg.intentos -= 1
+            self._programar(msg.to, self.breaker.espera * (1 + random.random()) / 2)
+            return
+        except Exception as e:
+            if _reintentable(e) and msg.intentos <= self.max_retries:
+                retraso = self.backoff_base * 2 ** (msg.intentos - 1) * (1 + random.random() / 2)
+                with self._cond:
+                    self._contadores["reintentos"] += 1
+                logging.warning(f"Reintento {msg.intentos} para {msg.to} en {retraso:.1f}s: {e}")
+                self._programar(msg.to, retraso)
+                return
+            with self._cond:
+                self._contadores["fallidos"] += 1
+            logging.error(f"Error enviando a {msg.to}: {e}")
+            self._avanzar(msg.to)
+            self._notificar(msg, False, e)
+            return
+        with self._cond:
+            self._contadores["enviados"] += 1
+        # Desde que se encoló hasta que Twilio lo aceptó, con esperas y reintentos
+        observar("outbound_entrega_segundos", time.monotonic() - msg.encolado)
+        logging.info(f"Mensaje enviado a {msg.to}")
+        self._avanzar(msg.to)
+        self._notificar(msg, True, None)
+
+    @staticmethod
+    def _notificar(msg, ok, error):
+        if msg.on_result is None:
+            return
+        try:
+            msg.on_result(ok, error)
+        except Exception:
+            logging.exception("Error en callback de envío")
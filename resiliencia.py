@@ -0,0 +1,221 @@
+# resiliencia.py
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as EsperaAgotada
+
+import metrics
+from dispatcher import LimiteSaturado
+
+BREAKER_UMBRAL  = float(os.getenv("BREAKER_UMBRAL", "0.5"))    # proporción de fallos que abre el circuito
+BREAKER_MINIMO  = int(os.getenv("BREAKER_MINIMO", "10"))       # llamadas mínimas en la ventana para decidir
+BREAKER_VENTANA = int(os.getenv("BREAKER_VENTANA", "20"))      # últimas llamadas consideradas
+BREAKER_ESPERA  = float(os.getenv("BREAKER_ESPERA", "30"))     # segundos abierto antes de probar de nuevo
+
+
+class CircuitoAbierto(Exception):
+    """
+    La dependencia está fallando: se rechaza la llamada sin esperar al timeout.
+    """
+
+    def __init__(self, nombre):
+        super().__init__(f"circuito {nombre} abierto")
+        self.nombre = nombre
+
+
+def _status(exc):
+    for obj, atributo in ((exc, "status"), (exc, "http_status"), (getattr(exc, "resp", None), "status"),
+                          (getattr(exc, "response", None), "status_code")):
+        valor = getattr(obj, atributo, None)
+        if isinstance(valor, int):
+            return valor
+    return None
+
+
+# Errores de red y timeouts de los clientes (openai, httpx, httplib2, google-auth),
+# por nombre para no importar los SDK aquí
+_ERRORES_RED = {"Timeout", "TimeoutException", "APIConnectionError", "ServiceUnavailableError",
+                "TransportError", "NetworkError", "HttpLib2Error", "ServerNotFoundError"}
+
+
+_CUOTA = ("rateLimitExceeded", "userRateLimitExceeded")
+
+
+def es_limite_cuota(exc):
+    """
+    403 de Google por cuota (rateLimitExceeded): transitorio, como un 429.
+    """
+    if _status(exc) != 403:
+        return False
+    razones = [d.get("reason") for d in getattr(exc, "error_details", None) or () if isinstance(d, dict)]
+    if any(r in _CUOTA for r in razones):
+        return True
+    contenido = getattr(exc, "content", b"") or b""
+    if isinstance(contenido, bytes):
+        contenido = contenido.decode("utf-8", "replace")
+    return any(r in contenido for r in _CUOTA)
+
+
+def es_fallo_upstream(exc):
+    """
+    Solo red, timeout, 408, 429 y 5xx cuentan como fallo de la dependencia.
+    Un 4xx es un error de la petición concreta; LimiteSaturado y los errores
+    de programación (KeyError, TypeError...) son locales y no abren el circuito.
+    """
+    if isinstance(exc, (LimiteSaturado, CircuitoAbierto)):
+        return False
+    status = _status(exc)
+    if status is not None:
+        return status in (408, 429) or status >= 500
+    if isinstance(exc, (OSError, TimeoutError, EsperaAgotada, asyncio.TimeoutError)):
+        return True
+    return any(clase.__name__ in _ERRORES_RED for clase in type(exc).__mro__)
+
+
+class CircuitBreaker:
+    """
+    Circuito por dependencia: `with breaker: llamada()`.
+
+    Cerrado, registra el resultado de las últimas `ventana` llamadas y se abre
+    si la proporción de fallos llega a `umbral` (con al menos `minimo`
+    llamadas). Abierto, rechaza al instante con CircuitoAbierto durante
+    `espera` segundos; después deja pasar una sola llamada de prueba
+    (semiabierto) y se cierra si sale bien.
+    """
+
+    CERRADO, SEMIABIERTO, ABIERTO = 0, 1, 2
+    NOMBRES = ("cerrado", "semiabierto", "abierto")
+
+    def __init__(self, nombre, umbral=BREAKER_UMBRAL, minimo=BREAKER_MINIMO,
+                 ventana=BREAKER_VENTANA, espera=BREAKER_ESPERA):
+        self.nombre = nombre
+        self.umbral = umbral
+        self.minimo = minimo
+        self.espera = espera
+        self._resultados = deque(maxlen=ventana)
+        self._estado = self.CERRADO
+        self._abierto_en = 0.0
+        self._sonda = False
+        self._lock = threading.Lock()
+        self.rechazos = 0
+
+    @property
+    def estado(self):
+        with self._lock:
+            if self._estado == self.ABIERTO and time.monotonic() - self._abierto_en >= self.espera:
+                return self.SEMIABIERTO
+            return self._estado
+
+    def permitir(self):
+        """
+        Lanza CircuitoAbierto si la llamada no debe intentarse.
+        """
+        with self._lock:
+            if self._estado == self.ABIERTO:
+                if time.monotonic() - self._abierto_en < self.espera:
+                    self.rechazos += 1
+                    raise CircuitoAbierto(self.nombre)
+                self._estado, self._sonda = self.SEMIABIERTO, False
+            if self._estado == self.SEMIABIERTO:
+                if self._sonda:
+                    self.rechazos += 1
+                    raise CircuitoAbierto(self.nombre)
+                self._sonda = True
+
+    def registrar(self, ok):
+        with self._lock:
+            if self._estado == self.ABIERTO:
+                # Llamada que empezó antes de abrirse el circuito
+                return
+            if self._estado == self.SEMIABIERTO:
+                self._sonda = False
+                if ok:
+                    self._estado = self.CERRADO
+                    self._resultados.clear()
+                    logging.info(f"Circuito {self.nombre} cerrado")
+                else:
+                    self._abrir()
+                return
+            self._resultados.append(ok)
+            fallos = self._resultados.count(False)
+            if len(self._resultados) >= self.minimo and fallos / len(self._resultados) >= self.umbral:
+                self._abrir()
+
+    def _abrir(self):
+        self._estado = self.ABIERTO
+        self._abierto_en = time.monotonic()
+        self._resultados.clear()
+        logging.warning(f"Circuito {self.nombre} abierto durante {self.espera:.0f}s")
+
+    def __enter__(self):
+        self.permitir()
+        return self
+
+    def __exit__(self, tipo, exc, tb):
+        self.registrar(exc is None or not es_fallo_upstream(exc))
+        return False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(nombre):
+    """
+    Circuito compartido por todo el proceso para la dependencia `nombre`.
+    """
+    breaker = _breakers.get(nombre)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(nombre, CircuitBreaker(nombre))
+    return breaker
+
+
+def breakers():
+    with _breakers_lock:
+        return dict(_breakers)
+
+
+# ─── PETICIONES CUBIERTAS (HEDGING) ────────────────────────────────────────────
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=int(os.getenv("HEDGE_WORKERS", "4")),
+                                           thread_name_prefix="hedge")
+    return _pool
+
+
+def con_cobertura(fn, retraso, nombre="hedge"):
+    """
+    Ejecuta fn(); si no respondió en `retraso` segundos lanza una segunda copia
+    y devuelve la primera que termine bien. Solo para lecturas idempotentes.
+    """
+    if retraso <= 0:
+        return fn()
+    primero = _executor().submit(fn)
+    try:
+        return primero.result(timeout=retraso)
+    except EsperaAgotada:
+        if primero.done():
+            raise
+    metrics.incrementar("cobertura_total", dependencia=nombre)
+    pendientes = {primero, _executor().submit(fn)}
+    error = None
+    while pendientes:
+        hechos, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+        for futuro in hechos:
+            if futuro.exception() is None:
+                return futuro.result()
+            error = futuro.exception()
+    raise error
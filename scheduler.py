@@ -0,0 +1,174 @@
+# scheduler.py
+
+import heapq
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+SCHEDULER_DB = os.getenv("SCHEDULER_DB", "jobs.db")
+
+
+class JobScheduler:
+    """
+    Planificador de tareas diferidas con un solo hilo.
+
+    Las tareas se guardan en SQLite (sobreviven a reinicios) y se ordenan en
+    memoria con un heap por hora de ejecución. Cada tarea tiene un nombre de
+    handler registrado, un payload JSON y una clave opcional (p.ej. el teléfono)
+    para poder cancelar sus seguimientos pendientes.
+    """
+
+    def __init__(self, db_path=SCHEDULER_DB, batch_size=50):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self._handlers = {}
+        self._heap = []                 # [(ejecutar_en, job_id)]
+        self._claves = {}               # job_id -> clave (solo pendientes)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stop = False
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " nombre TEXT NOT NULL,"
+            " ejecutar_en REAL NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " clave TEXT,"
+            " estado TEXT NOT NULL DEFAULT 'pendiente')"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_estado ON jobs (estado, ejecutar_en)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_clave ON jobs (clave, estado)")
+
+    def register(self, nombre, handler):
+        """
+        Asocia un nombre de tarea con la función que la ejecuta: handler(**payload).
+        """
+        self._handlers[nombre] = handler
+
+    def schedule(self, nombre, delay, payload=None, clave=None):
+        """
+        Programa `nombre` para dentro de `delay` segundos. Devuelve el id de la tarea.
+        """
+        ejecutar_en = time.time() + delay
+        with self._db_lock:
+            cur = self._db.execute(
+                "INSERT INTO jobs (nombre, ejecutar_en, payload, clave) VALUES (?, ?, ?, ?)",
+                (nombre, ejecutar_en, json.dumps(payload or {}), clave),
+            )
+        job_id = cur.lastrowid
+        with self._cond:
+            heapq.heappush(self._heap, (ejecutar_en, job_id))
+            self._claves[job_id] = clave
+            self._cond.notify()
+        return job_id
+
+    def cancel(self, clave):
+        """
+        Cancela todas las tareas pendientes asociadas a `clave`. Devuelve cuántas.
+        """
+        with self._db_lock:
+            cur = self._db.execute(
+                "UPDATE jobs SET estado = 'cancelado' WHERE clave = ? AND estado = 'pendiente'",
+                (clave,),
+            )
+        with self._cond:
+            for job_id in [j for j, c in self._claves.items() if c == clave]:
+                del self._claves[job_id]
+        return cur.rowcount
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._claves)
+
+    # ─── CICLO DE VIDA ────────────────────────────────────────────────────────
+    def start(self):
+        if self._thread is not None:
+            return
+        self._cargar_pendientes()
+        self._stop = False
+        self._thread = threading.Thread(target=self._bucle, name="job-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _cargar_pendientes(self):
+        with self._db_lock:
+            self._db.execute(
+                "DELETE FROM jobs WHERE estado != 'pendiente' AND ejecutar_en < ?",
+                (time.time() - 7 * 24 * 3600,),
+            )
+            filas = self._db.execute(
+                "SELECT id, ejecutar_en, clave FROM jobs WHERE estado = 'pendiente'"
+            ).fetchall()
+        with self._cond:
+            for job_id, ejecutar_en, clave in filas:
+                if job_id not in self._claves:
+                    heapq.heappush(self._heap, (ejecutar_en, job_id))
+                    self._claves[job_id] = clave
+        if filas:
+            logging.info(f"Scheduler: {len(filas)} tareas pendientes recuperadas")
+
+    def _bucle(self):
+        while True:
+            with self._cond:
+                while not self._stop:
+                    if self._heap and self._heap[0][0] <= time.time():
+                        break
+                    espera = self._heap[0][0] - time.time() if self._heap else None
+                    self._cond.wait(espera)
+                if self._stop:
+                    return
+                ahora = time.time()
+                lote = []
+                while self._heap and self._heap[0][0] <= ahora and len(lote) < self.batch_size:
+                    _, job_id = heapq.heappop(self._heap)
+                    if self._claves.pop(job_id, False) is not False:
+                        lote.append(job_id)
+            for job_id in lote:
+                self._ejecutar(job_id)
+
+    def _reclamar(self, job_id):
+        """
+        Marca la tarea como en ejecución; solo un proceso puede reclamarla.
+        """
+        with self._db_lock:
+            cur = self._db.execute(
+                "UPDATE jobs SET estado = 'ejecutando' WHERE id = ? AND estado = 'pendiente'",
+                (job_id,),
+            )
+            if cur.rowcount != 1:
+                return None
+            return self._db.execute(
+                "SELECT nombre, payload FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+
+    def _ejecutar(self, job_id):
+        fila = self._reclamar(job_id)
+        if fila is None:
+            return
+        nombre, payload = fila
+        handler = self._handlers.get(nombre)
+        estado = "hecho"
+        if handler is None:
+            logging.error(f"Scheduler: no hay handler para '{nombre}'")
+            estado = "error"
+        else:
+            try:
+                handler(**json.loads(payload))
+            except Exception:
+                logging.exception(f"Scheduler: fallo la tarea {nombre} ({job_id})")
+                estado = "error"
+        with self._db_lock:
+            self._db.execute("UPDATE jobs SET estado = ? WHERE id = ?", (estado, job_id))
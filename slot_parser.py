@@ -0,0 +1,150 @@
+# slot_parser.py
+
+import datetime
+import re
+from functools import lru_cache
+
+from metrics import medir
+from text_utils import normalizar_texto
+
+FORMATO_SLOT = "%Y-%m-%d %H:%M"
+SNAP_MINUTOS = 40           # tolerancia para ajustar "10:00" al slot ofrecido más cercano
+
+DIAS = {"lunes": 0, "martes": 1, "miercoles": 2, "jueves": 3, "viernes": 4, "sabado": 5, "domingo": 6}
+
+_HORA = r"(?:a\s+las?\s+)?(\d{1,2})(?::(\d{2}))?\s*(am|pm|de la mañana|de la tarde)?"
+_ISO = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})(?:\s+|t)(\d{1,2}):(\d{2})\b")
+_DMY = re.compile(r"\b(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?\s+" + _HORA)
+_DIA = re.compile(
+    r"\b(hoy|pasado mañana|mañana|" + "|".join(DIAS) + r")\b(?:\s+\d{1,2}(?=\s+a\s+las?\b))?\s*" + _HORA
+)
+_INDICE = re.compile(r"^(?:opcion|numero|la|el|#)?\s*(\d{1,2})$")
+_SOLO_HORA = re.compile(r"^(?:a\s+las?\s+)?(\d{1,2}):(\d{2})$")
+
+
+def _hora(h, m, sufijo):
+    h, m = int(h), int(m or 0)
+    if sufijo in ("pm", "de la tarde") and h < 12:
+        h += 12
+    elif sufijo is None and h < 7:
+        # Sin am/pm, "a las 3" en horario de consulta (07-17) es por la tarde
+        h += 12
+    if h > 23 or m > 59:
+        return None
+    return h, m
+
+
+def _fecha_dia(palabra, hoy):
+    if palabra == "hoy":
+        return hoy
+    if palabra == "mañana":
+        return hoy + datetime.timedelta(days=1)
+    if palabra == "pasado mañana":
+        return hoy + datetime.timedelta(days=2)
+    return hoy + datetime.timedelta(days=(DIAS[palabra] - hoy.weekday()) % 7)
+
+
+@lru_cache(maxsize=2048)
+def _interpretar(texto, hoy):
+    """
+    Reconoce los formatos habituales sobre el texto normalizado. Devuelve
+    ("fecha", datetime) | ("indice", n) | ("hora", (h, m)) | None si no reconoce nada.
+    """
+    m = _ISO.search(texto)
+    if m:
+        try:
+            return "fecha", datetime.datetime(*map(int, m.groups()))
+        except ValueError:
+            return None
+    m = _DMY.search(texto)
+    if m:
+        dia, mes, anio, h, mi, suf = m.groups()
+        hm = _hora(h, mi, suf)
+        anio = int(anio) if anio else hoy.year
+        if anio < 100:
+            anio += 2000
+        try:
+            return ("fecha", datetime.datetime(anio, int(mes), int(dia), *hm)) if hm else None
+        except ValueError:
+            return None
+    m = _DIA.search(texto)
+    if m:
+        palabra, h, mi, suf = m.groups()
+        hm = _hora(h, mi, suf)
+        if hm is None:
+            return None
+        fecha = datetime.datetime.combine(_fecha_dia(palabra, hoy), datetime.time(*hm))
+        if palabra in DIAS and fecha.date() == hoy:
+            # "lunes" dicho un lunes: si no se aclara, es el de la próxima semana
+            fecha += datetime.timedelta(days=7)
+        return "fecha", fecha
+    m = _INDICE.match(texto)
+    if m:
+        return "indice", int(m.group(1))
+    m = _SOLO_HORA.match(texto)
+    if m:
+        hm = _hora(m.group(1), m.group(2), None)
+        return ("hora", hm) if hm else None
+    return None
+
+
+def _ajustar(fecha, ofrecidos):
+    """
+    Ajusta una fecha al slot ofrecido igual o más cercano del mismo día.
+    """
+    exacto = fecha.strftime(FORMATO_SLOT)
+    if exacto in ofrecidos:
+        return fecha
+    mejor, distancia = None, None
+    for s in ofrecidos:
+        candidato = datetime.datetime.strptime(s, FORMATO_SLOT)
+        if candidato.date() != fecha.date():
+            continue
+        d = abs((candidato - fecha).total_seconds())
+        if d <= SNAP_MINUTOS * 60 and (distancia is None or d < distancia):
+            mejor, distancia = candidato, d
+    return mejor
+
+
+def cargar_dateutil():
+    """
+    dateutil solo hace falta en el fallback; se importa al primer uso.
+    """
+    from dateutil import parser as dateparser
+    return dateparser
+
+
+def parsear_slot(texto: str, ofrecidos=None, hoy=None):
+    """
+    Interpreta la respuesta de un usuario a la lista de horarios.
+
+    Acepta "2026-05-04 10:00", "4/5 10:00", "lunes 10:00", "mañana a las 7",
+    "10:00" o el número de la opción. Si se pasan `ofrecidos` (lista de
+    "%Y-%m-%d %H:%M"), el resultado se ajusta a uno de ellos o es None.
+    dateutil solo se usa si ningún formato conocido coincide.
+    """
+    hoy = hoy or datetime.date.today()
+    resultado = _interpretar(normalizar_texto(texto), hoy)
+    if resultado is None:
+        try:
+            with medir("dateutil"):
+                fecha = cargar_dateutil().parse(texto, dayfirst=True)
+        except (ValueError, OverflowError):
+            return None
+        resultado = ("fecha", fecha)
+
+    tipo, valor = resultado
+    if tipo == "indice":
+        if ofrecidos and 1 <= valor <= len(ofrecidos):
+            return datetime.datetime.strptime(ofrecidos[valor - 1], FORMATO_SLOT)
+        return None
+    if tipo == "hora":
+        if not ofrecidos:
+            return datetime.datetime.combine(hoy, datetime.time(*valor))
+        for s in ofrecidos:
+            if s.endswith(f" {valor[0]:02d}:{valor[1]:02d}"):
+                return datetime.datetime.strptime(s, FORMATO_SLOT)
+        return None
+    if ofrecidos:
+        return _ajustar(valor, ofrecidos)
+    return valor
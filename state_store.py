@@ -0,0 +1,260 @@
+# state_store.py
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")      # "sqlite" | "memory"
+STATE_DB      = os.getenv("STATE_DB", "estado.db")
+
+
+class StateStore(ABC):
+    """
+    Almacén clave-valor por espacio de nombres (ns), con TTL opcional.
+
+    Los valores deben ser serializables a JSON. `pop` y `add` son atómicos.
+    """
+
+    @abstractmethod
+    def get(self, ns, key, default=None):
+        ...
+
+    @abstractmethod
+    def set(self, ns, key, value=True, ttl=None):
+        ...
+
+    @abstractmethod
+    def add(self, ns, key, value=True, ttl=None):
+        """
+        Inserta solo si la clave no existe. Devuelve True si se insertó.
+        """
+
+    @abstractmethod
+    def pop(self, ns, key, default=None):
+        ...
+
+    def delete(self, ns, key):
+        self.pop(ns, key)
+
+    @abstractmethod
+    def contains(self, ns, key):
+        ...
+
+    @abstractmethod
+    def count(self, ns):
+        ...
+
+    @abstractmethod
+    def items(self, ns):
+        """
+        Lista de (clave, valor) vivos del namespace.
+        """
+
+    @abstractmethod
+    def purge(self):
+        """
+        Elimina las entradas expiradas. Devuelve cuántas.
+        """
+
+
+def _expira(ttl):
+    return time.time() + ttl if ttl is not None else None
+
+
+class MemoryStateStore(StateStore):
+    """
+    Implementación en memoria del proceso (desarrollo o un solo worker).
+    """
+
+    def __init__(self):
+        self._data = {}                 # ns -> {key: (value, expira)}
+        self._lock = threading.Lock()
+
+    def _vivo(self, ns, key):
+        entrada = self._data.get(ns, {}).get(key)
+        if entrada is None:
+            return None
+        if entrada[1] is not None and entrada[1] <= time.time():
+            del self._data[ns][key]
+            return None
+        return entrada
+
+    def get(self, ns, key, default=None):
+        with self._lock:
+            entrada = self._vivo(ns, key)
+            return entrada[0] if entrada else default
+
+    def set(self, ns, key, value=True, ttl=None):
+        with self._lock:
+            self._data.setdefault(ns, {})[key] = (value, _expira(ttl))
+
+    def add(self, ns, key, value=True, ttl=None):
+        with self._lock:
+            if self._vivo(ns, key):
+                return False
+            self._data.setdefault(ns, {})[key] = (value, _expira(ttl))
+            return True
+
+    def pop(self, ns, key, default=None):
+        with self._lock:
+            entrada = self._vivo(ns, key)
+            if entrada is None:
+                return default
+            del self._data[ns][key]
+            return entrada[0]
+
+    def contains(self, ns, key):
+        with self._lock:
+            return self._vivo(ns, key) is not None
+
+    def count(self, ns):
+        with self._lock:
+            ahora = time.time()
+            return sum(1 for _, exp in self._data.get(ns, {}).values() if exp is None or exp > ahora)
+
+    def items(self, ns):
+        with self._lock:
+            ahora = time.time()
+            return [(k, v) for k, (v, exp) in self._data.get(ns, {}).items() if exp is None or exp > ahora]
+
+    def purge(self):
+        with self._lock:
+            ahora = time.time()
+            total = 0
+            for entradas in self._data.values():
+                vencidas = [k for k, (_, exp) in entradas.items() if exp is not None and exp <= ahora]
+                for k in vencidas:
+                    del entradas[k]
+                total += len(vencidas)
+            return total
+
+
+class SQLiteStateStore(StateStore):
+    """
+    Implementación en SQLite (modo WAL) compartida entre procesos.
+
+    La clave primaria (ns, clave) hace que cada búsqueda sea un acceso por
+    índice; cada hilo usa su propia conexión.
+    """
+
+    def __init__(self, path=STATE_DB):
+        self.path = path
+        self._local = threading.local()
+        db = self._conn()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS estado ("
+            " ns TEXT NOT NULL,"
+            " clave TEXT NOT NULL,"
+            " valor TEXT NOT NULL,"
+            " expira REAL,"
+            " PRIMARY KEY (ns, clave)) WITHOUT ROWID"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS estado_expira ON estado (expira)")
+
+    def _conn(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    _VIVO = "(expira IS NULL OR expira > ?)"
+
+    def get(self, ns, key, default=None):
+        fila = self._conn().execute(
+            f"SELECT valor FROM estado WHERE ns = ? AND clave = ? AND {self._VIVO}",
+            (ns, key, time.time()),
+        ).fetchone()
+        return json.loads(fila[0]) if fila else default
+
+    def set(self, ns, key, value=True, ttl=None):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO estado (ns, clave, valor, expira) VALUES (?, ?, ?, ?)",
+            (ns, key, json.dumps(value), _expira(ttl)),
+        )
+
+    def add(self, ns, key, value=True, ttl=None):
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute(
+                "DELETE FROM estado WHERE ns = ? AND clave = ? AND expira <= ?",
+                (ns, key, time.time()),
+            )
+            cur = db.execute(
+                "INSERT OR IGNORE INTO estado (ns, clave, valor, expira) VALUES (?, ?, ?, ?)",
+                (ns, key, json.dumps(value), _expira(ttl)),
+            )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return cur.rowcount == 1
+
+    def pop(self, ns, key, default=None):
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            fila = db.execute(
+                f"SELECT valor FROM estado WHERE ns = ? AND clave = ? AND {self._VIVO}",
+                (ns, key, time.time()),
+            ).fetchone()
+            db.execute("DELETE FROM estado WHERE ns = ? AND clave = ?", (ns, key))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return json.loads(fila[0]) if fila else default
+
+    def contains(self, ns, key):
+        return self._conn().execute(
+            f"SELECT 1 FROM estado WHERE ns = ? AND clave = ? AND {self._VIVO}",
+            (ns, key, time.time()),
+        ).fetchone() is not None
+
+    def count(self, ns):
+        return self._conn().execute(
+            f"SELECT COUNT(*) FROM estado WHERE ns = ? AND {self._VIVO}",
+            (ns, time.time()),
+        ).fetchone()[0]
+
+    def items(self, ns):
+        filas = self._conn().execute(
+            f"SELECT clave, valor FROM estado WHERE ns = ? AND {self._VIVO}",
+            (ns, time.time()),
+        ).fetchall()
+        return [(clave, json.loads(valor)) for clave, valor in filas]
+
+    def purge(self):
+        return self._conn().execute(
+            "DELETE FROM estado WHERE expira <= ?", (time.time(),)
+        ).rowcount
+
+
+def crear_state_store(backend=STATE_BACKEND, path=STATE_DB):
+    if backend == "memory":
+        return MemoryStateStore()
+    if backend == "sqlite":
+        return SQLiteStateStore(path)
+    raise ValueError(f"STATE_BACKEND desconocido: {backend}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_state_store():
+    """
+    Almacén compartido por main.py y utils.py, según STATE_BACKEND.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = crear_state_store()
+    return _store
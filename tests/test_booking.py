@@ -0,0 +1,204 @@
+# tests/test_booking.py
+#
+# Sin dobles reservas: dos usuarios que piden el mismo horario a la vez no
+# pueden quedarse ambos con él, y un batch rechazado por Google lo libera.
+
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import calendar_client
+import calendar_utils
+import resiliencia
+from booking import BookingPipeline, SlotOcupado
+from state_store import MemoryStateStore
+
+
+class _Peticion:
+    def __init__(self, respuesta):
+        self.respuesta = respuesta
+
+    def execute(self, http=None, num_retries=0):
+        return self.respuesta
+
+
+class _ErrorGoogle(Exception):
+    """
+    Como googleapiclient.HttpError: el status viene en .resp (httplib2.Response).
+    """
+
+    def __init__(self, status):
+        super().__init__(f"HttpError {status}")
+        self.resp = SimpleNamespace(status=status)
+
+
+class _Batch:
+    def __init__(self, servicio, callback):
+        self.servicio = servicio
+        self.callback = callback
+        self.ids = []
+
+    def add(self, peticion, request_id=None):
+        self.ids.append(request_id)
+
+    def execute(self, http=None):
+        for request_id in self.ids:
+            error = self.servicio.errores.pop(0) if self.servicio.errores else self.servicio.error
+            self.callback(request_id, None if error else {"id": request_id}, error)
+
+
+class _Servicio:
+    """
+    Calendar sin citas; `error` hace fallar cada inserción del batch y
+    `errores` solo las próximas, una por inserción.
+    """
+
+    def __init__(self):
+        self.error = None
+        self.errores = []
+        self.insertados = []
+
+    def freebusy(self):
+        return self
+
+    def query(self, body):
+        return _Peticion({"calendars": {item["id"]: {"busy": []} for item in body["items"]}})
+
+    def events(self):
+        return self
+
+    def insert(self, calendarId, body):
+        self.insertados.append(body)
+        return _Peticion(body)
+
+    def new_batch_http_request(self, callback=None):
+        return _Batch(self, callback)
+
+
+class _Manager:
+    def __init__(self):
+        self.servicio = _Servicio()
+
+    def service(self):
+        return self.servicio
+
+    def http(self):
+        return None
+
+    def execute(self, request, num_retries=1):
+        return request.execute(num_retries=num_retries)
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    manager = _Manager()
+    monkeypatch.setattr(calendar_client, "_manager", manager)
+    indices = {calendar_id: calendar_utils.IndiceOcupado() for calendar_id in calendar_utils.CALENDARIOS.values()}
+    monkeypatch.setattr(calendar_utils, "_indices", indices)
+    monkeypatch.setattr(calendar_utils, "_indice", next(iter(indices.values())))
+    monkeypatch.setattr(resiliencia, "_breakers", {})
+    return manager
+
+
+def test_reservas_simultaneas_del_mismo_slot(manager):
+    pipeline = BookingPipeline()
+    slot = calendar_utils.get_available_slots(1)[0]
+    barrera = threading.Barrier(2)
+    resultados = []
+
+    def reservar(numero):
+        barrera.wait()
+        try:
+            resultados.append(pipeline.reservar(numero, slot))
+        except SlotOcupado:
+            resultados.append(SlotOcupado)
+
+    hilos = [threading.Thread(target=reservar, args=(n,)) for n in ("+5210000000001", "+5210000000002")]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert resultados.count(SlotOcupado) == 1
+    assert pipeline.pending() == 1
+    assert slot not in calendar_utils.get_available_slots(5)
+
+
+def test_batch_fallido_libera_el_slot(manager):
+    manager.servicio.error = _ErrorGoogle(403)
+    pipeline = BookingPipeline(intervalo=0)
+    slot = calendar_utils.get_available_slots(1)[0]
+    resultado = threading.Event()
+    avisos = []
+
+    def on_result(ok, error):
+        avisos.append((ok, error))
+        resultado.set()
+
+    pipeline.reservar("+5210000000001", slot, on_result=on_result)
+    with pytest.raises(SlotOcupado):
+        pipeline.reservar("+5210000000002", slot)
+
+    pipeline.start()
+    try:
+        assert resultado.wait(5)
+    finally:
+        pipeline.stop()
+
+    assert avisos[0][0] is False
+    assert slot in calendar_utils.get_available_slots(5)
+    manager.servicio.error = None
+    assert pipeline.reservar("+5210000000002", slot)
+
+
+@pytest.mark.parametrize("error", [_ErrorGoogle(503), _ErrorGoogle(429), ConnectionError("reset")])
+def test_batch_con_error_transitorio_se_reintenta(manager, error):
+    manager.servicio.errores = [error]
+    pipeline = BookingPipeline(intervalo=0)
+    slot = calendar_utils.get_available_slots(1)[0]
+    resultado = threading.Event()
+    avisos = []
+
+    def on_result(ok, error):
+        avisos.append(ok)
+        resultado.set()
+
+    pipeline.reservar("+5210000000001", slot, on_result=on_result)
+    pipeline.start()
+    try:
+        assert resultado.wait(5)
+    finally:
+        pipeline.stop()
+
+    assert avisos == [True]
+    assert slot not in calendar_utils.get_available_slots(5)
+
+
+def test_reinicio_recupera_las_inserciones_pendientes(manager):
+    store = MemoryStateStore()
+    anterior = BookingPipeline(store=store)
+    slot = calendar_utils.get_available_slots(1)[0]
+    anterior.reservar("+5210000000001", slot)       # el proceso muere antes del batch
+
+    resultado = threading.Event()
+    avisos = []
+
+    def on_recuperada(numero, slot, ok, error):
+        avisos.append((numero, slot, ok))
+        resultado.set()
+
+    nuevo = BookingPipeline(store=store, intervalo=0, on_recuperada=on_recuperada)
+    nuevo.start()
+    try:
+        assert resultado.wait(5)
+    finally:
+        nuevo.stop()
+
+    assert avisos == [("+5210000000001", slot, True)]
+    assert len(manager.servicio.insertados) == 1
+    assert store.count(BookingPipeline.NS_COLA) == 0
+    # Si el proceso anterior siguiera vivo, ya no puede reclamarla: no hay doble evento
+    anterior.start()
+    anterior.stop()
+    assert len(manager.servicio.insertados) == 1
@@ -0,0 +1,63 @@
+# tests/test_intent_router.py
+
+import pytest
+
+from chatbot_agent import ROUTER as ROUTER_VENTAS
+from intent_router import IntentRouter, puede_ser_fecha
+from text_utils import normalizar_texto
+
+# Mismas reglas que main.ROUTER (main no se importa aquí: arranca servicios)
+ROUTER_MAIN = IntentRouter([
+    ("informes",    ("informes", "más información", "terapia", "consulta", "enfermedad"), False),
+    ("guia_compra", ("sí", "me gustaría"), True),
+    ("metodo",      ("método",), False),
+    ("curso",       ("curso",), False),
+])
+
+
+@pytest.mark.parametrize("texto, intent", [
+    ("Informes", "informes"),
+    ("quiero más información", "informes"),
+    ("quiero info de las terapias", "informes"),
+    ("tengo enfermedades", "informes"),
+    ("¿consultas?", "informes"),
+    ("Sí", "guia_compra"),
+    ("me gustaría", "guia_compra"),
+    ("sí, pero quiero más información", "informes"),
+    ("el método", "metodo"),
+    ("metodos", "metodo"),
+    ("cursos", "curso"),
+    ("el curso y la terapia", "informes"),
+    ("hola", None),
+    ("discurso", None),
+])
+def test_router_main(texto, intent):
+    assert ROUTER_MAIN.clasificar(texto) == intent
+
+
+@pytest.mark.parametrize("texto, intent", [
+    ("¿Cuál es el precio?", "precio"),
+    ("precios", "precio"),
+    ("costos y precios", "precio"),
+    ("¿Qué es esto?", "metodo"),
+    ("¿cómo funciona?", "metodo"),
+    ("porque estoy enfermo", None),
+    ("aunque es caro", None),
+])
+def test_router_ventas(texto, intent):
+    assert ROUTER_VENTAS.clasificar(texto) == intent
+
+
+@pytest.mark.parametrize("texto, normalizado", [
+    ("¿Qué es el MÉTODO?", "que es el metodo"),
+    ("  Mañana   a las 10:30 ", "mañana a las 10:30"),
+    ("¡Sí!", "si"),
+])
+def test_normalizar_texto(texto, normalizado):
+    assert normalizar_texto(texto) == normalizado
+
+
+def test_puede_ser_fecha():
+    assert puede_ser_fecha(normalizar_texto("el Miércoles"))
+    assert puede_ser_fecha("a las 5")
+    assert not puede_ser_fecha("quiero informes")
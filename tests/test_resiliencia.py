@@ -0,0 +1,62 @@
+# tests/test_resiliencia.py
+
+import time
+
+import pytest
+
+from dispatcher import LimiteSaturado
+from resiliencia import CircuitBreaker, CircuitoAbierto
+
+
+class _ErrorHttp(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+def _fallar(breaker, exc):
+    with pytest.raises(type(exc)):
+        with breaker:
+            raise exc
+
+
+@pytest.fixture
+def breaker():
+    return CircuitBreaker("prueba", umbral=0.5, minimo=4, ventana=4, espera=0.05)
+
+
+def test_se_abre_con_fallos_y_rechaza_al_instante(breaker):
+    for _ in range(4):
+        _fallar(breaker, _ErrorHttp(503))
+    assert breaker.estado == CircuitBreaker.ABIERTO
+    with pytest.raises(CircuitoAbierto):
+        with breaker:
+            pass
+    assert breaker.rechazos == 1
+
+
+def test_semiabierto_deja_una_sola_prueba_y_se_cierra(breaker):
+    for _ in range(4):
+        _fallar(breaker, ConnectionError())
+    time.sleep(0.06)
+    assert breaker.estado == CircuitBreaker.SEMIABIERTO
+    breaker.permitir()
+    with pytest.raises(CircuitoAbierto):
+        breaker.permitir()
+    breaker.registrar(True)
+    assert breaker.estado == CircuitBreaker.CERRADO
+
+
+def test_prueba_fallida_reabre(breaker):
+    for _ in range(4):
+        _fallar(breaker, TimeoutError())
+    time.sleep(0.06)
+    _fallar(breaker, _ErrorHttp(429))
+    assert breaker.estado == CircuitBreaker.ABIERTO
+
+
+@pytest.mark.parametrize("exc", [_ErrorHttp(404), LimiteSaturado("openai"), KeyError("x"), TypeError()])
+def test_errores_locales_no_abren(breaker, exc):
+    for _ in range(8):
+        _fallar(breaker, exc)
+    assert breaker.estado == CircuitBreaker.CERRADO
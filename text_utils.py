@@ -0,0 +1,25 @@
+# text_utils.py
+
+import re
+import unicodedata
+
+_ESPACIOS   = re.compile(r"\s+")
+_PUNTUACION = re.compile(r"[^\w\s:/-]")
+
+
+def quitar_acentos(texto: str) -> str:
+    """
+    "método" -> "metodo"; conserva la ñ.
+    """
+    texto = texto.replace("ñ", "\0").replace("Ñ", "\1")
+    sin = "".join(c for c in unicodedata.normalize("NFD", texto) if unicodedata.category(c) != "Mn")
+    return sin.replace("\0", "ñ").replace("\1", "Ñ")
+
+
+def normalizar_texto(texto: str) -> str:
+    """
+    Minúsculas, sin acentos, sin signos (¿?¡!.,) y con espacios colapsados.
+    """
+    texto = quitar_acentos(texto.lower())
+    texto = _PUNTUACION.sub(" ", texto)
+    return _ESPACIOS.sub(" ", texto).strip()
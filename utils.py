@@ -2,10 +2,17 @@
 
 import os
 import json
-from twilio.rest import Client
+import threading
 
+from state_store import get_state_store
+
+# Archivos JSON heredados; se migran al almacén de estado en el primer uso
 USUARIOS_TEMP_FILE = "usuarios_temp.json"
 CONVERSIONES_FILE = "conversiones.json"
+USUARIOS_TEMP = "usuarios_temp"
+CONVERSIONES = "conversiones"
+_migrados = set()
+_migrados_lock = threading.Lock()
 
 def enviar_mensaje_whatsapp(numero_destino, mensaje):
     """
@@ -13,6 +20,7 @@ def enviar_mensaje_whatsapp(numero_destino, mensaje):
     - numero_destino: Cadena con código de país y número (p.ej. "5215512345678").
     - mensaje: Texto plano a enviar.
     """
+    from twilio.rest import Client
     client = Client(os.getenv("TWILIO_SID"), os.getenv("TWILIO_AUTH_TOKEN"))
     msg = client.messages.create(
         from_=os.getenv("TWILIO_SANDBOX_NUMBER"),  # p.ej. "whatsapp:+14155238886"
@@ -21,41 +29,50 @@ def enviar_mensaje_whatsapp(numero_destino, mensaje):
     )
     return msg.sid
 
+def _migrar_json(ns, path):
+    """
+    Importa una sola vez las listas JSON antiguas al almacén de estado.
+    """
+    # Otro worker puede haberlo migrado ya: un archivo ausente no es un error
+    try:
+        with open(path, "r") as f:
+            numeros = json.load(f)
+    except FileNotFoundError:
+        return
+    store = get_state_store()
+    for numero in numeros:
+        store.set(ns, numero)
+    try:
+        os.replace(path, f"{path}.migrado")
+    except FileNotFoundError:
+        pass
+
+
+def _store(ns, path):
+    if ns not in _migrados:
+        with _migrados_lock:
+            if ns not in _migrados:
+                _migrar_json(ns, path)
+                _migrados.add(ns)
+    return get_state_store()
+
+
 def guardar_usuario_temporal(numero):
     """
     Guarda el número de usuario que preguntó por consulta/terapia
     sin realizar compra, para seguimiento a 24h.
     """
-    usuarios = []
-    if os.path.exists(USUARIOS_TEMP_FILE):
-        with open(USUARIOS_TEMP_FILE, "r") as f:
-            usuarios = json.load(f)
-    if numero not in usuarios:
-        usuarios.append(numero)
-        with open(USUARIOS_TEMP_FILE, "w") as f:
-            json.dump(usuarios, f)
+    _store(USUARIOS_TEMP, USUARIOS_TEMP_FILE).add(USUARIOS_TEMP, numero)
 
 def verificar_conversion(numero):
     """
-    Verifica si el usuario ya compró (o agendó) consultando un JSON local.
+    Verifica si el usuario ya compró (o agendó) consultando el almacén de estado.
     """
-    if os.path.exists(CONVERSIONES_FILE):
-        with open(CONVERSIONES_FILE, "r") as f:
-            conversiones = json.load(f)
-        return numero in conversiones
-    return False
+    return _store(CONVERSIONES, CONVERSIONES_FILE).contains(CONVERSIONES, numero)
 
 def marcar_conversion(numero):
     """
     Marca que el usuario convirtió (compró o agendó), para no volver a
     enviarle recordatorios.
     """
-    conversiones = []
-    if os.path.exists(CONVERSIONES_FILE):
-        with open(CONVERSIONES_FILE, "r") as f:
-            conversiones = json.load(f)
-    if numero not in conversiones:
-        conversiones.append(numero)
-        with open(CONVERSIONES_FILE, "w") as f:
-            json.dump(conversiones, f)
-
+    _store(CONVERSIONES, CONVERSIONES_FILE).add(CONVERSIONES, numero)